@@ -0,0 +1,240 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Core snapshot schedule benchmark for the state store
+# A Core firing a snapshot schedule starts one driver process per LUN at
+# the same time. Every simulated driver here runs the state store accesses
+# of create_snap (proxy backup chain in the operation journal) followed by
+# remove_snap of the previous snapshot, against the real src/script_db.py
+# classes, and opens the store again for each request as a new driver
+# process would. Compare locking modes and backends with e.g.
+#   python bench\core_schedule.py --processes 20 50 --journal-mode WAL DELETE
+###############################################################################
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import filelock
+from src import journal_store
+from src import script_db
+
+ARRAY = 'array.example.com'
+PROXY = 'proxy.example.com'
+
+
+def array_call(delay):
+    # Time the driver spends talking to the array between state accesses
+    if delay:
+        time.sleep(delay)
+
+
+def create_snap(store, serial, snap_name, delay):
+    cdb, sdb, rdb = store.creds, store.clones, store.snaps
+    cdb.get_enc_info(ARRAY)
+    op = sdb.begin_operation('CREATE_SNAP', ARRAY, serial, snap_name)
+    if not op.resuming():
+        rdb.get_snap_info(snap_name)
+    array_call(delay)
+
+    def unmount():
+        cdb.get_enc_info(PROXY)
+        sdb.get_clone_info(serial)
+        array_call(delay)
+        return True
+
+    def delete_clone():
+        sdb.get_clone_info(serial)
+        array_call(delay)
+        sdb.delete_clone_info(serial)
+
+    def create_clone():
+        array_call(delay)
+        clone = 'clone-' + snap_name
+        with store.transaction():
+            sdb.insert_clone_info(serial, clone, snap_name, 'proxy-group')
+            rdb.insert_snap_info(snap_name, 'replay-' + snap_name, serial)
+        return clone
+
+    def mount(clone):
+        cdb.get_enc_info(PROXY)
+        sdb.get_clone_info(serial)
+        array_call(delay)
+
+    if op.step('unmount_proxy', unmount):
+        op.step('delete_clone', delete_clone)
+        clone = op.step('create_clone', create_clone)
+        op.step('mount_proxy', mount, clone)
+    op.finish()
+
+
+def remove_snap(store, serial, snap_name, delay):
+    cdb, sdb, rdb = store.creds, store.clones, store.snaps
+    sdb.get_clone_info(serial)
+    rdb.get_snap_info(snap_name)
+    cdb.get_enc_info(ARRAY)
+    array_call(delay)
+    rdb.delete_snap_info(snap_name)
+
+
+def close_store():
+    # A driver process exits after each request
+    script_db.close_all()
+    journal_store.close_all()
+
+
+def configure(journal_mode, busy_timeout):
+    script_db.JOURNAL_MODE = journal_mode
+    script_db.BUSY_TIMEOUT = busy_timeout
+
+
+def worker_main(work_dir, config, worker, requests, start_at, results):
+    backend, journal_mode, busy_timeout, delay = config
+    configure(journal_mode, busy_timeout)
+    while time.time() < start_at:
+        time.sleep(0.001)
+    latencies = {'create_snap': [], 'remove_snap': []}
+    errors = {'create_snap': 0, 'remove_snap': 0}
+    serial = 'LUN-%d' % worker
+    for i in range(requests):
+        snap_name = 'snap-%d-%d' % (worker, i)
+        calls = [('create_snap', create_snap, snap_name)]
+        if i:
+            calls.append(('remove_snap', remove_snap, 'snap-%d-%d' % (worker, i - 1)))
+        for name, func, snap in calls:
+            started = time.time()
+            try:
+                store = script_db.StateStore(work_dir, array=ARRAY, backend=backend)
+                func(store, serial, snap, delay)
+            except (sqlite3.OperationalError, filelock.LockTimeout):
+                errors[name] += 1
+                continue
+            finally:
+                close_store()
+            latencies[name].append(time.time() - started)
+    results.put((latencies, errors))
+
+
+def setup(work_dir, config):
+    backend, journal_mode, busy_timeout, delay = config
+    configure(journal_mode, busy_timeout)
+    store = script_db.StateStore(work_dir, backend=backend)
+    store.creds.setup()
+    store.creds.insert_enc_info(ARRAY, 'admin', 'secret')
+    store.creds.insert_enc_info(PROXY, 'root', 'secret')
+    close_store()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else 0
+
+
+def run(config, processes, requests):
+    work_dir = tempfile.mkdtemp()
+    try:
+        setup(work_dir, config)
+        results = multiprocessing.Queue()
+        start_at = time.time() + 1
+        workers = [multiprocessing.Process(target=worker_main,
+                                           args=(work_dir, config, i, requests,
+                                                 start_at, results))
+                   for i in range(processes)]
+        for w in workers:
+            w.start()
+        latencies = {'create_snap': [], 'remove_snap': []}
+        errors = {'create_snap': 0, 'remove_snap': 0}
+        for w in workers:
+            l, e = results.get()
+            for name in latencies:
+                latencies[name].extend(l[name])
+                errors[name] += e[name]
+        for w in workers:
+            w.join()
+        elapsed = time.time() - start_at
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    backend, journal_mode, busy_timeout, delay = config
+    print("%s backend, %s journal, %gs busy timeout, %d processes, %.1fs" %
+          (backend, journal_mode if backend == 'sqlite' else 'n/a', busy_timeout,
+           processes, elapsed))
+    for name in sorted(latencies):
+        values = sorted(latencies[name])
+        print("  %-12s %6d done %8.1f op/s  p50 %7.1f ms  p99 %7.1f ms  "
+              "%d lock timeouts" %
+              (name, len(values), len(values) / elapsed, percentile(values, 0.5),
+               percentile(values, 0.99), errors[name]))
+
+
+def get_option_parser():
+    '''
+    Returns argument parser
+    '''
+    parser = argparse.ArgumentParser(description="Core snapshot schedule benchmark")
+    parser.add_argument("--processes",
+                        type=int,
+                        nargs='+',
+                        default=[20, 50],
+                        help="driver processes started at the same time")
+    parser.add_argument("--requests",
+                        type=int,
+                        default=20,
+                        help="schedule rounds per process")
+    parser.add_argument("--backend",
+                        nargs='+',
+                        choices=('sqlite', 'journal'),
+                        default=['sqlite'],
+                        help="state store backends to run")
+    parser.add_argument("--journal-mode",
+                        nargs='+',
+                        default=[script_db.JOURNAL_MODE],
+                        help="SQLite journal modes to run, e.g. WAL DELETE")
+    parser.add_argument("--busy-timeout",
+                        type=float,
+                        default=script_db.BUSY_TIMEOUT,
+                        help="seconds a statement waits for the database lock")
+    parser.add_argument("--array-delay",
+                        type=float,
+                        default=0,
+                        help="milliseconds each simulated array call takes")
+    return parser
+
+
+def main():
+    args = get_option_parser().parse_args()
+    for backend in args.backend:
+        modes = args.journal_mode if backend == 'sqlite' else args.journal_mode[:1]
+        for journal_mode in modes:
+            for processes in args.processes:
+                config = (backend, journal_mode, args.busy_timeout, args.array_delay / 1000.0)
+                run(config, processes, args.requests)
+
+if __name__ == '__main__':
+    main()
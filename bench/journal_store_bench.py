@@ -0,0 +1,159 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Write throughput and recovery benchmark of the state store backends
+# Every process records and removes clones and snapshots as the drivers
+# do, against the SQLite store and against the append-only journal of
+# src/journal_store.py. Recovery is the time a new process takes to open
+# the state left behind by --rows records and answer its first lookup.
+#   python bench\journal_store_bench.py --processes 4 --requests 500 --rows 50000
+###############################################################################
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import journal_store
+from src import script_db
+
+BACKENDS = ('sqlite', 'journal')
+
+
+def open_tables(work_dir, backend):
+    # The tables alone, without the snapshot catalog the store feeds
+    if backend == 'journal':
+        base = os.path.join(work_dir, journal_store.JOURNAL_BASE)
+        return journal_store.JournalScriptDB(base), journal_store.JournalSnapToReplayDB(base)
+    path = os.path.join(work_dir, script_db.STORE_DB)
+    return script_db.ScriptDB(path), script_db.SnapToReplayDB(path)
+
+
+def request(sdb, rdb, worker, i):
+    serial = 'LUN-%d-%d' % (worker, i)
+    snap = 'snap-%d-%d' % (worker, i)
+    rdb.get_snap_info(snap)
+    with sdb.transaction():
+        sdb.insert_clone_info(serial, 'clone', snap, 'group')
+    rdb.insert_snap_info(snap, 'replay', serial)
+    sdb.get_clone_info(serial)
+    sdb.delete_clone_info(serial)
+    rdb.delete_snap_info(snap)
+
+
+def worker_main(work_dir, backend, worker, requests, start_at, results):
+    sdb, rdb = open_tables(work_dir, backend)
+    while time.time() < start_at:
+        time.sleep(0.001)
+    started = time.time()
+    for i in range(requests):
+        request(sdb, rdb, worker, i)
+    results.put(time.time() - started)
+
+
+def run_writes(backend, processes, requests):
+    work_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(work_dir, 'var'))
+    try:
+        open_tables(work_dir, backend)
+        script_db.close_all()
+        journal_store.close_all()
+        results = multiprocessing.Queue()
+        start_at = time.time() + 1
+        workers = [multiprocessing.Process(target=worker_main,
+                                           args=(work_dir, backend, i, requests,
+                                                 start_at, results))
+                   for i in range(processes)]
+        for w in workers:
+            w.start()
+        elapsed = max(results.get() for w in workers)
+        for w in workers:
+            w.join()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    done = processes * requests
+    print("%-8s writes   %6d requests %8.1f req/s" % (backend, done, done / elapsed))
+
+
+def run_recovery(backend, rows):
+    work_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(work_dir, 'var'))
+    try:
+        sdb, rdb = open_tables(work_dir, backend)
+        batch = 1000
+        for start in range(0, rows, batch):
+            sdb.insert_many([('LUN-%d' % i, 'clone', 'snap-%d' % i, 'group')
+                             for i in range(start, min(rows, start + batch))])
+        script_db.close_all()
+        journal_store.close_all()
+        code = ("import sys, time; sys.path.insert(0, %r); "
+                "import journal_store_bench as bench; started = time.time(); "
+                "sdb, rdb = bench.open_tables(%r, %r); sdb.get_clone_info('LUN-0'); "
+                "print(time.time() - started)" %
+                (os.path.abspath(os.path.dirname(__file__)), work_dir, backend))
+        elapsed = float(subprocess.check_output([sys.executable, '-c', code]).strip())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print("%-8s recovery %6d rows     %8.1f ms" % (backend, rows, elapsed * 1000))
+
+
+def get_option_parser():
+    '''
+    Returns argument parser
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes",
+                        type=int,
+                        default=4,
+                        help="driver processes writing at the same time")
+    parser.add_argument("--requests",
+                        type=int,
+                        default=500,
+                        help="requests per process")
+    parser.add_argument("--rows",
+                        type=int,
+                        default=50000,
+                        help="rows left behind for the recovery test")
+    parser.add_argument("--backend",
+                        choices=BACKENDS + ('both',),
+                        default='both',
+                        help="state store backend to run")
+    return parser
+
+
+def main():
+    args = get_option_parser().parse_args()
+    for backend in BACKENDS:
+        if args.backend in (backend, 'both'):
+            run_writes(backend, args.processes, args.requests)
+            run_recovery(backend, args.rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Benchmark of src/json_stream.py against decoding the whole reply
+# Builds a 3PAR getVolumes() style listing, every volume with its space,
+# policy and user data sub-dicts, and looks up one volume by wwn:
+#   full         json.loads of the whole reply, then a scan (requests .json())
+#   stream       iter_items() over the reply chunks, stops at the volume
+#   stream-all   iter_items() over all volumes keeping wwn and name, as a
+#                listing merged into the inventory cache does
+# Reports the time and the peak memory (Python 3) of each, e.g.
+#   python bench\json_stream_bench.py --volumes 1000 5000 --position 0.1 0.5 1
+###############################################################################
+
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import json_stream
+
+
+def make_listing(volumes):
+    members = []
+    for i in range(volumes):
+        members.append({
+            'id': i,
+            'name': 'vv_lun_%05d' % i,
+            'wwn': '60002AC%025X' % i,
+            'uuid': '%08x-0000-4000-8000-%012x' % (i, i),
+            'provisioningType': 2,
+            'copyType': 1,
+            'baseId': i,
+            'readOnly': False,
+            'state': 1,
+            'failedStates': [],
+            'degradedStates': [],
+            'additionalStates': [],
+            'adminSpace': {'reservedMiB': 384, 'rawReservedMiB': 1152,
+                           'usedMiB': 11, 'freeMiB': 373},
+            'snapshotSpace': {'reservedMiB': 2048, 'rawReservedMiB': 6144,
+                              'usedMiB': 512, 'freeMiB': 1536},
+            'userSpace': {'reservedMiB': 10240, 'rawReservedMiB': 30720,
+                          'usedMiB': 8192, 'freeMiB': 2048},
+            'sizeMiB': 102400,
+            'policies': {'staleSS': True, 'oneHost': False, 'zeroDetect': False,
+                         'system': False, 'caching': True, 'fsvc': False,
+                         'hostDIF': 3},
+            'userCPG': 'FC_r5',
+            'snapCPG': 'FC_r5',
+            'comment': 'SteelFusion LUN %d' % i,
+            'creationTime8601': '2016-03-01T10:%02d:%02d-08:00' % (i // 60 % 60, i % 60),
+            'creationTimeSec': 1456855200 + i,
+            'usrSpcAllocWarningPct': 0,
+            'usrSpcAllocLimitPct': 0,
+            'links': [{'href': 'https://array:8080/api/v1/volumes/vv_lun_%05d' % i,
+                       'rel': 'self'}],
+        })
+    body = json.dumps({'total': volumes, 'members': members})
+    return body.encode('utf-8')
+
+
+def chunks(body):
+    for i in range(0, len(body), json_stream.CHUNK_SIZE):
+        yield body[i:i + json_stream.CHUNK_SIZE]
+
+
+def full(body, wwn):
+    volumes = json.loads(body.decode('utf-8'))
+    for volume in volumes['members']:
+        if volume['wwn'] == wwn:
+            return volume['name']
+
+
+def stream(body, wwn):
+    volume = json_stream.find_item(json_stream.iter_items(chunks(body), 'members'),
+                                   lambda volume: volume['wwn'] == wwn)
+    return volume['name']
+
+
+def stream_all(body, wwn):
+    names = dict((volume['wwn'], volume['name'])
+                 for volume in json_stream.iter_items(chunks(body), 'members'))
+    return names[wwn]
+
+
+def measure(func, body, wwn, repeat):
+    best = None
+    for i in range(repeat):
+        started = time.time()
+        name = func(body, wwn)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func(body, wwn)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return name, best, peak
+
+
+def get_option_parser():
+    '''
+    Returns argument parser
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--volumes",
+                        type=int,
+                        nargs='+',
+                        default=[1000, 5000],
+                        help="volumes in the listing")
+    parser.add_argument("--position",
+                        type=float,
+                        nargs='+',
+                        default=[0.1, 0.5, 1.0],
+                        help="where the volume looked up is in the listing, 0 to 1")
+    parser.add_argument("--repeat",
+                        type=int,
+                        default=5,
+                        help="runs of each decoder, the best time is reported")
+    return parser
+
+
+def main():
+    args = get_option_parser().parse_args()
+    print("%8s %8s %10s %-10s %10s %10s" %
+          ('volumes', 'position', 'reply', 'decoder', 'time', 'peak mem'))
+    for volumes in args.volumes:
+        body = make_listing(volumes)
+        for position in args.position:
+            index = min(volumes - 1, int(volumes * position))
+            wwn = '60002AC%025X' % index
+            for label, func in (('full', full), ('stream', stream),
+                                ('stream-all', stream_all)):
+                name, best, peak = measure(func, body, wwn, args.repeat)
+                assert name == 'vv_lun_%05d' % index
+                print("%8d %8.2f %9.1fK %-10s %8.1fms %9s" %
+                      (volumes, position, len(body) / 1024.0, label, best * 1000,
+                       '%.1fM' % (peak / 1048576.0) if peak is not None else '-'))
+
+if __name__ == '__main__':
+    main()
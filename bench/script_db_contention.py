@@ -0,0 +1,200 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Multi-process contention benchmark for src/script_db.py
+# Every process plays driver requests against the same database files:
+# credential lookup, duplicate snapshot check, clone insert, clone lookup
+# and cleanup. Run it against the script_db layer and against a copy of
+# the original layer (connection per object, commit per statement,
+# rollback journal) with:
+#   python bench\script_db_contention.py --processes 8 --requests 200
+###############################################################################
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import script_db
+
+
+class LegacyDB(object):
+    '''
+    The database layer as it was: a connection per object, default
+    5 second timeout, rollback journal and a commit after every statement
+    '''
+
+    def __init__(self, path):
+        self.conn_ = sqlite3.connect(path)
+
+    def execute(self, sql, params=()):
+        c = self.conn_.cursor()
+        c.execute(sql, params)
+        data = c.fetchone()
+        self.conn_.commit()
+        return data
+
+    def close(self):
+        self.conn_.close()
+
+
+def legacy_request(work_dir, worker, i):
+    cdb = LegacyDB(os.path.join(work_dir, 'cred.db'))
+    sdb = LegacyDB(os.path.join(work_dir, 'script.db'))
+    rdb = LegacyDB(os.path.join(work_dir, 'replay.db'))
+    serial = 'LUN-%d-%d' % (worker, i)
+    snap = 'snap-%d-%d' % (worker, i)
+    cdb.execute("SELECT user, pass FROM pwd where host=?", ('array',))
+    rdb.execute("SELECT snap_name, replay FROM snap_to_replay_info where snap_name=?", (snap,))
+    sdb.execute("INSERT INTO clone_info VALUES (?, ?, ?, ?)", (serial, 'clone', snap, 'group'))
+    rdb.execute("INSERT INTO snap_to_replay_info VALUES (?, ?)", (snap, 'replay'))
+    sdb.execute("SELECT clone, snap_name, access_group FROM clone_info where lun=?", (serial,))
+    sdb.execute("DELETE FROM clone_info where lun=?", (serial,))
+    rdb.execute("DELETE FROM snap_to_replay_info where snap_name=?", (snap,))
+    cdb.close()
+    sdb.close()
+    rdb.close()
+
+
+def current_request(work_dir, worker, i):
+    cdb = script_db.CredDB(os.path.join(work_dir, 'cred.db'))
+    sdb = script_db.ScriptDB(os.path.join(work_dir, 'script.db'))
+    rdb = script_db.SnapToReplayDB(os.path.join(work_dir, 'replay.db'))
+    serial = 'LUN-%d-%d' % (worker, i)
+    snap = 'snap-%d-%d' % (worker, i)
+    cdb.get_enc_info('array')
+    rdb.get_snap_info(snap)
+    with script_db.transaction(sdb, rdb):
+        sdb.insert_clone_info(serial, 'clone', snap, 'group')
+        rdb.insert_snap_info(snap, 'replay')
+    sdb.get_clone_info(serial)
+    sdb.delete_clone_info(serial)
+    rdb.delete_snap_info(snap)
+    cdb.close()
+    sdb.close()
+    rdb.close()
+
+
+def setup(work_dir, layer):
+    if layer == 'legacy':
+        for name, sql in (('cred.db', 'CREATE TABLE pwd (host text, user text, pass text)'),
+                          ('script.db', 'CREATE TABLE clone_info (lun text, clone text, '
+                                        'snap_name text, access_group text)'),
+                          ('replay.db', 'CREATE TABLE snap_to_replay_info '
+                                        '(snap_name text, replay text)')):
+            conn = sqlite3.connect(os.path.join(work_dir, name))
+            conn.execute(sql)
+            conn.commit()
+            conn.close()
+        return
+    script_db.CredDB(os.path.join(work_dir, 'cred.db')).setup()
+    script_db.ScriptDB(os.path.join(work_dir, 'script.db')).setup()
+    script_db.SnapToReplayDB(os.path.join(work_dir, 'replay.db')).setup()
+    script_db.close_all()
+
+
+def worker_main(work_dir, layer, worker, requests, start_at, results):
+    request = legacy_request if layer == 'legacy' else current_request
+    while time.time() < start_at:
+        time.sleep(0.001)
+    latencies = []
+    errors = 0
+    for i in range(requests):
+        started = time.time()
+        try:
+            request(work_dir, worker, i)
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.time() - started)
+    results.put((latencies, errors))
+
+
+def run(layer, processes, requests):
+    work_dir = tempfile.mkdtemp()
+    try:
+        setup(work_dir, layer)
+        results = multiprocessing.Queue()
+        start_at = time.time() + 1
+        workers = [multiprocessing.Process(target=worker_main,
+                                           args=(work_dir, layer, i, requests,
+                                                 start_at, results))
+                   for i in range(processes)]
+        for w in workers:
+            w.start()
+        latencies = []
+        errors = 0
+        for w in workers:
+            l, e = results.get()
+            latencies.extend(l)
+            errors += e
+        for w in workers:
+            w.join()
+        elapsed = time.time() - start_at
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    latencies.sort()
+    done = len(latencies)
+    print("%-8s %6d requests %8.1f req/s  p50 %7.1f ms  p99 %7.1f ms  "
+          "%d locked errors" %
+          (layer, done, done / elapsed,
+           latencies[done // 2] * 1000 if done else 0,
+           latencies[min(done - 1, int(done * 0.99))] * 1000 if done else 0,
+           errors))
+
+
+def get_option_parser():
+    '''
+    Returns argument parser
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes",
+                        type=int,
+                        default=8,
+                        help="driver processes running at the same time")
+    parser.add_argument("--requests",
+                        type=int,
+                        default=200,
+                        help="requests per process")
+    parser.add_argument("--layer",
+                        choices=('legacy', 'current', 'both'),
+                        default='both',
+                        help="database layer to run")
+    return parser
+
+
+def main():
+    args = get_option_parser().parse_args()
+    for layer in ('legacy', 'current'):
+        if args.layer in (layer, 'both'):
+            run(layer, args.processes, args.requests)
+
+if __name__ == '__main__':
+    main()
@@ -28,12 +28,10 @@ import src.script_db
 import sys
 import os
 
-DB_NAME = r'\var\cred.db'
-
 if __name__ == '__main__':
-    # Create DB
-    print(os.getcwd() + DB_NAME)
-    db = src.script_db.CredDB(os.getcwd() + DB_NAME)
+    # Credentials of the handoff state store in the work dir
+    db = src.script_db.StateStore(os.getcwd()).creds
+    print(db.path)
 
     done = False
     while not done:
@@ -34,7 +34,10 @@ __author__ = 'Laurynas Kavaliauskas'
 import sys
 import argparse
 import os
-import subprocess
+
+from src import dispatch
+from src import handoff_service
+from src import lazy
 
 def get_option_parser():
     '''
@@ -52,30 +55,51 @@ def get_option_parser():
                       required=True,
                       default="localhost",
                       help="storage array manager ip address or dns name")
+    parser.add_argument("--profile-startup",
+                      action="store_true",
+                      default=False,
+                      help="print driver import and database open times")
     return parser
 
 def main():
     #TODO:
     # 1. Run setup.py to check whether all required components are in place
-    # 2. In the future we should be calling main() for apropriate api library instead of suing subprocess.call()
+
+    # Batch mode takes its operations from a JSONL file instead
+    if [arg for arg in sys.argv[1:] if arg.split('=')[0] == "--batch"]:
+        from src import batch
+        sys.exit(batch.main(sys.argv[1:]))
 
     args, argsleft = get_option_parser().parse_known_args()
-    api_path = "%s/src/libs/%s/SteelFusionHandoff.py" % (os.path.abspath(os.path.dirname(sys.argv[0])), args.array_model)
-    if not(os.path.isfile(api_path)):
+    if not dispatch.driver_exists(args.array_model):
         if args.array_model is not None:
             print("Array type '%s' is unknown." % args.array_model)
         else:
             print("--array-model parameter is missing.")
         exit (1)
+    # Cleaning up arguments used only by this module
+    argv = dispatch.strip_model_args(sys.argv[1:])
+    if args.profile_startup:
+        argv.remove("--profile-startup")
+        # Inherited by the driver when it runs in a child interpreter
+        os.environ[lazy.PROFILE_ENV] = '1'
+        lazy.enable_profile(args.array_model)
+
+    # Hand the request over to the resident handoff service if it is running,
+    # startup profiling always runs the driver here
+    result = None
+    if not args.profile_startup:
+        result = handoff_service.call_service(args.array_model, argv)
+    if result is not None:
+        retcode, out, err = result
+        sys.stdout.write(out)
+        sys.stderr.write(err)
+        sys.exit(retcode)
+
+    # Call the driver main() in this interpreter, falls back to
+    # running the driver script when it cannot be imported here
     try:
-        # Cleaning up arguments used only by this module
-        if args.array_model is not None:
-            arg_ind = sys.argv.index("--array-model")
-            nbin = sys.argv[arg_ind+1]
-            sys.argv.remove(nbin)
-        sys.argv.remove("--array-model")
-        path_list =[sys.executable] + [api_path] + sys.argv[1:]
-        retcode = subprocess.call(path_list, shell=False)
+        retcode, out, err = dispatch.run(args.array_model, argv, capture=False)
         sys.exit(retcode)
     except OSError as e:
         print("Execution failed %s" % e)
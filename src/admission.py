@@ -0,0 +1,278 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Host-wide admission control per storage array
+# Every driver run takes a token from the array's token bucket
+# (var\admission.db), then one of the array's session slots (lock files under
+# var\admission), before it talks to the array. Requests over the limits
+# wait in line.
+# The slots bound the sessions open at the same time, the bucket bounds how
+# fast new sessions are started. Show the queues with:
+#   python src\admission.py
+###############################################################################
+
+import argparse
+import contextlib
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import filelock
+from src import registry
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+ADMISSION_DIR = os.path.join(ROOT_DIR, 'var', 'admission')
+ADMISSION_DB = os.path.join(ROOT_DIR, 'var', 'admission.db')
+
+# Configuration defaults
+# Set to False to let every request through immediately
+ADMISSION_CONTROL = True
+# Sessions at the same time per array, {array: sessions}. Arrays not
+# listed here get the max_concurrency their driver declares.
+ARRAY_CONCURRENCY = {}
+# New sessions per second per array and the burst allowed above that rate
+RATE = 1.0
+BURST = 5
+# {array: (rate, burst)} overriding RATE and BURST
+RATE_LIMITS = {}
+# Seconds a request waits for admission before it fails
+ADMISSION_TIMEOUT = 1800
+# Seconds between attempts while waiting for a slot
+POLL_INTERVAL = 0.2
+# Waiters which did not check in for this many seconds are gone
+WAITER_EXPIRY = 10
+
+
+def _connect():
+    conn = sqlite3.connect(ADMISSION_DB, timeout=30, isolation_level=None)
+    conn.execute('CREATE TABLE IF NOT EXISTS bucket (array text PRIMARY KEY, '
+                 'tokens real, updated real)')
+    conn.execute('CREATE TABLE IF NOT EXISTS waiter (id text PRIMARY KEY, '
+                 'array text, since real, updated real)')
+    conn.execute('CREATE TABLE IF NOT EXISTS stats (array text PRIMARY KEY, '
+                 'slots integer, admitted integer, total_wait real, '
+                 'max_wait real, last_wait real)')
+    return conn
+
+
+def _slot_path(array, index):
+    digest = hashlib.sha1(array.encode('utf-8')).hexdigest()
+    return os.path.join(ADMISSION_DIR, '%s.%d.slot' % (digest, index))
+
+
+def get_limits(array_model, array):
+    '''
+    Returns (sessions, rate, burst) for the array
+    '''
+    sessions = ARRAY_CONCURRENCY.get(array) or \
+        registry.get_capability(array_model, 'max_concurrency')
+    rate, burst = RATE_LIMITS.get(array, (RATE, BURST))
+    return max(1, sessions), float(rate), max(1, burst)
+
+
+def _try_slot(array, sessions):
+    for index in range(sessions):
+        lock = filelock.FileLock(_slot_path(array, index))
+        if lock.acquire(blocking=False):
+            return lock
+    return None
+
+
+def _reserve_token(conn, array, rate, burst):
+    '''
+    Takes a token from the array's bucket, letting it go below zero.
+
+    Returns the seconds to wait before the token may be used
+    '''
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('SELECT tokens, updated FROM bucket WHERE array=?',
+                           (array,)).fetchone()
+        tokens = float(burst) if row is None else \
+            min(float(burst), row[0] + (now - row[1]) * rate)
+        tokens -= 1
+        conn.execute('INSERT OR REPLACE INTO bucket VALUES (?, ?, ?)',
+                     (array, tokens, now))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return 0 if tokens >= 0 else -tokens / rate
+
+
+def _record_wait(conn, array, sessions, waited):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('INSERT OR IGNORE INTO stats VALUES (?, ?, 0, 0, 0, 0)',
+                     (array, sessions))
+        conn.execute('UPDATE stats SET slots=?, admitted=admitted+1, '
+                     'total_wait=total_wait+?, max_wait=max(max_wait, ?), '
+                     'last_wait=? WHERE array=?',
+                     (sessions, waited, waited, waited, array))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+@contextlib.contextmanager
+def admit(array_model, array, timeout=None):
+    '''
+    Waits until the array may take another session and holds its slot, e.g.
+        with admission.admit(array_model, array):
+            run the driver
+
+    Raises filelock.LockTimeout if the request was not admitted within
+    timeout, ADMISSION_TIMEOUT seconds by default.
+    '''
+    if not ADMISSION_CONTROL or not array:
+        yield
+        return
+    timeout = ADMISSION_TIMEOUT if timeout is None else timeout
+    sessions, rate, burst = get_limits(array_model, array)
+    if not os.path.isdir(ADMISSION_DIR):
+        try:
+            os.makedirs(ADMISSION_DIR)
+        except OSError:
+            pass
+    start = time.time()
+    slot = None
+    conn = _connect()
+    try:
+        # The token comes first, a request held back by the rate does not
+        # keep a session slot from the array's other requests
+        ready = start + _reserve_token(conn, array, rate, burst)
+        if time.time() >= ready:
+            slot = _try_slot(array, sessions)
+        if slot is None:
+            # Queue up, the waiter row lets the status show the queue depth
+            waiter_id = '%d.%s.%f' % (os.getpid(), id(conn), start)
+            conn.execute('INSERT INTO waiter VALUES (?, ?, ?, ?)',
+                         (waiter_id, array, start, start))
+            try:
+                while True:
+                    now = time.time()
+                    if now >= ready:
+                        slot = _try_slot(array, sessions)
+                        if slot is not None:
+                            break
+                    if now - start >= timeout:
+                        raise filelock.LockTimeout(
+                            "Timed out waiting for admission to array %s" % array)
+                    time.sleep(POLL_INTERVAL if now >= ready else
+                               min(POLL_INTERVAL, ready - now))
+                    conn.execute('UPDATE waiter SET updated=? WHERE id=?',
+                                 (time.time(), waiter_id))
+            finally:
+                conn.execute('DELETE FROM waiter WHERE id=?', (waiter_id,))
+        _record_wait(conn, array, sessions, time.time() - start)
+    except Exception:
+        if slot is not None:
+            slot.release()
+        raise
+    finally:
+        conn.close()
+    try:
+        yield
+    finally:
+        slot.release()
+
+
+def get_status():
+    '''
+    Returns one dict per array with the sessions running, the requests
+    queued and the admission wait times in seconds
+    '''
+    if not os.path.exists(ADMISSION_DB):
+        return []
+    conn = _connect()
+    try:
+        now = time.time()
+        queued = {}
+        oldest = {}
+        for array, since in conn.execute(
+                'SELECT array, since FROM waiter WHERE updated > ?',
+                (now - WAITER_EXPIRY,)):
+            queued[array] = queued.get(array, 0) + 1
+            oldest[array] = max(oldest.get(array, 0), now - since)
+        status = []
+        for array, slots, admitted, total_wait, max_wait, last_wait in conn.execute(
+                'SELECT array, slots, admitted, total_wait, max_wait, last_wait '
+                'FROM stats ORDER BY array'):
+            running = 0
+            for index in range(slots):
+                lock = filelock.FileLock(_slot_path(array, index))
+                if lock.acquire(blocking=False):
+                    lock.release()
+                else:
+                    running += 1
+            status.append({'array': array,
+                           'slots': slots,
+                           'running': running,
+                           'queued': queued.get(array, 0),
+                           'queued_wait': oldest.get(array, 0),
+                           'admitted': admitted,
+                           'avg_wait': total_wait / admitted if admitted else 0,
+                           'max_wait': max_wait,
+                           'last_wait': last_wait})
+        return status
+    finally:
+        conn.close()
+
+
+def get_option_parser():
+    '''
+    Returns argument parser
+    '''
+    parser = argparse.ArgumentParser(description="Shows the admission queue of each array")
+    parser.add_argument("--reset",
+                        action="store_true",
+                        default=False,
+                        help="clear the wait time statistics")
+    return parser
+
+
+def main():
+    args = get_option_parser().parse_args()
+    if args.reset:
+        conn = _connect()
+        conn.execute('DELETE FROM stats')
+        conn.close()
+        return
+    print("%-30s %8s %8s %8s %10s %10s %10s" %
+          ('array', 'running', 'queued', 'admitted', 'avg wait', 'max wait',
+           'oldest'))
+    for row in get_status():
+        print("%-30s %4d/%-3d %8d %8d %9.1fs %9.1fs %9.1fs" %
+              (row['array'], row['running'], row['slots'], row['queued'],
+               row['admitted'], row['avg_wait'], row['max_wait'],
+               row['queued_wait']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# asyncio driver runtime
+# Event loop and thread pool the batch runner schedules its operations on.
+# Each driver request runs as a blocking dispatch.run() call on a pool
+# thread, where it waits for its LUN locks and array session slot; the
+# event loop only applies the batch concurrency limits.
+# Drivers keep their state in module globals and write to the process
+# stdout, so drivers run in-process still run one at a time
+# (dispatch._driver_lock); only drivers run in a child interpreter
+# (registry in_process off, IN_PROCESS_DISPATCH off) run in parallel.
+# Requires Python 3.5 or later.
+###############################################################################
+
+import asyncio
+import concurrent.futures
+import functools
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import dispatch
+
+# Configuration defaults
+# Threads available to driver requests
+MAX_THREADS = 8
+
+
+class DriverRuntime(object):
+    '''
+    Event loop and thread pool shared by all driver requests of a process
+
+    max_threads : threads available to driver requests
+    '''
+
+    def __init__(self, max_threads=MAX_THREADS):
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max(1, max_threads))
+        self.loop.set_default_executor(self.executor)
+
+    def run(self, coro):
+        '''
+        Runs a coroutine to completion and returns its result
+        '''
+        return self.loop.run_until_complete(coro)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.loop.close()
+
+    async def call(self, func, *args, **kwargs):
+        '''
+        Awaits a synchronous function run in the thread pool
+        '''
+        return await self.loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def run_driver(self, array_model, argv):
+        '''
+        Awaitable version of dispatch.run(). Every request holds a pool
+        thread: waiting for a duplicate request, a LUN lock or an array
+        session slot blocks on a file lock.
+
+        Returns (exit status, stdout, stderr)
+        '''
+        return await self.call(dispatch.run, array_model, argv)
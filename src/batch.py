@@ -0,0 +1,280 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Batch operation mode
+# Reads one operation per line (JSONL) from a file or stdin, runs them with a
+# global and a per-array concurrency limit and writes one JSONL result line
+# per operation as soon as it finishes. Invoked as:
+#   python run.py --batch operations.jsonl
+#   python src\batch.py --batch - < operations.jsonl
+#
+# An operation line holds the driver options with '_' or '-' separators:
+#   {"id": "1", "array_model": "hpeva", "array": "10.1.1.1", "system": "EVA1",
+#    "serial": "6001...", "operation": "CREATE_SNAP", "snap_name": "snap1"}
+# or the driver arguments as they would be given to run.py:
+#   {"array_model": "hpeva", "argv": ["--array", "10.1.1.1", ...]}
+###############################################################################
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import aio_runtime
+from src import dispatch
+from src import driver_args
+from src import registry
+
+# Configuration defaults
+# Operations running at the same time for the whole batch
+MAX_WORKERS = 8
+# Operations running at the same time against one storage array
+MAX_PER_ARRAY = 4
+
+# Keys of an operation line which are not driver options
+BATCH_KEYS = ('id', 'array_model', 'model', 'argv')
+
+
+def operation_model(op):
+    return op.get('array_model') or op.get('model')
+
+
+def operation_argv(op):
+    '''
+    Converts an operation line into driver arguments
+
+    op : decoded operation line
+    '''
+    if 'argv' in op:
+        return [str(arg) for arg in op['argv']]
+    argv = []
+    for key, value in op.items():
+        if key in BATCH_KEYS or value is None:
+            continue
+        argv.append('--' + key.replace('_', '-'))
+        argv.append(str(value))
+    return argv
+
+
+def printed_output(out):
+    '''
+    Returns the last line the driver printed, for example the snapshot
+    name after CREATE_SNAP or OK after HELLO
+    '''
+    lines = [line.strip() for line in out.splitlines() if line.strip()]
+    return lines[-1] if lines else ''
+
+
+class BatchRunner(object):
+    '''
+    Runs batch operations on the asyncio driver runtime with a global and a
+    per-array concurrency limit. Operations against a busy array wait for
+    their array without taking a global slot, so they do not hold up
+    operations against other arrays.
+
+    write_result : called with each result dict
+    max_workers : operations running at the same time
+    max_per_array : operations running at the same time per array, lowered
+                    to the max_concurrency the driver declares
+    run_func : synchronous function(array_model, argv) returning
+               (status, out, err), run in the thread pool; by default
+               the drivers are run by the runtime itself
+    runtime : aio_runtime.DriverRuntime to run on
+    '''
+
+    def __init__(self, write_result, max_workers=MAX_WORKERS,
+                 max_per_array=MAX_PER_ARRAY, run_func=None, runtime=None):
+        self.write_result = write_result
+        self.max_workers = max(1, max_workers)
+        self.max_per_array = max(1, max_per_array)
+        self.run_func = run_func
+        self.runtime = runtime or aio_runtime.DriverRuntime(self.max_workers)
+        self.failed = 0
+        self._workers = None
+        self._arrays = {}
+
+    def new_item(self, index, op):
+        item = {'index': index, 'op': op, 'queued': time.time()}
+        try:
+            item['array_model'] = operation_model(op)
+            item['argv'] = operation_argv(op)
+            item['array'] = driver_args.get_option(item['argv'], '--array')
+        except (AttributeError, TypeError) as e:
+            self.finish(item, 1, '', 'Invalid operation: %s\n' % e)
+            return None
+        if not dispatch.driver_exists(item['array_model']):
+            self.finish(item, 1, "Array type '%s' is unknown.\n" %
+                        item['array_model'], '')
+            return None
+        return item
+
+    def reject(self, index, message):
+        '''
+        Reports an input line which could not be read as failed
+        '''
+        self.finish({'index': index, 'op': {}, 'queued': time.time()},
+                    1, '', message)
+
+    async def run_operation(self, item):
+        key = (item['array_model'], item['array'])
+        if key not in self._arrays:
+            limit = min(self.max_per_array, registry.get_capability(
+                item['array_model'], 'max_concurrency'))
+            self._arrays[key] = asyncio.Semaphore(max(1, limit))
+        async with self._arrays[key]:
+            async with self._workers:
+                item['started'] = time.time()
+                try:
+                    if self.run_func is not None:
+                        result = await self.runtime.call(
+                            self.run_func, item['array_model'], item['argv'])
+                    else:
+                        result = await self.runtime.run_driver(
+                            item['array_model'], item['argv'])
+                except Exception as e:
+                    result = 1, '', 'Execution failed %s\n' % e
+        self.finish(item, *result)
+
+    async def run_stream(self, stream):
+        '''
+        Starts each operation as soon as its line is read from stream
+        and waits for all of them to finish
+        '''
+        self._workers = asyncio.Semaphore(self.max_workers)
+        operations = read_operations(stream)
+        tasks = []
+        while True:
+            # stdin may block, read it in the thread pool
+            entry = await self.runtime.call(next, operations, None)
+            if entry is None:
+                break
+            index, op = entry
+            if isinstance(op, ValueError):
+                self.reject(index, 'Invalid JSON: %s\n' % op)
+                continue
+            item = self.new_item(index, op)
+            if item is not None:
+                tasks.append(asyncio.ensure_future(self.run_operation(item)))
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def finish(self, item, status, out, err):
+        finished = time.time()
+        started = item.get('started', finished)
+        op = item['op'] if isinstance(item['op'], dict) else {}
+        result = collections.OrderedDict()
+        result['id'] = op.get('id', item['index'])
+        result['array_model'] = item.get('array_model')
+        result['array'] = item.get('array')
+        argv = item.get('argv', [])
+        result['serial'] = driver_args.get_option(argv, '--serial')
+        result['operation'] = driver_args.get_option(argv, '--operation')
+        result['status'] = status
+        result['output'] = printed_output(out)
+        result['stdout'] = out
+        result['stderr'] = err
+        result['queued_ms'] = int((started - item['queued']) * 1000)
+        result['run_ms'] = int((finished - started) * 1000)
+        if status:
+            self.failed += 1
+        self.write_result(result)
+
+
+def read_operations(stream):
+    '''
+    Yields (line number, operation) for each non-empty line of stream.
+    Lines which are not valid JSON are yielded as the error message.
+    '''
+    for index, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield index, json.loads(line)
+        except ValueError as e:
+            yield index, e
+
+
+def run_batch(stream, out, max_workers=MAX_WORKERS, max_per_array=MAX_PER_ARRAY,
+              run_func=None):
+    '''
+    Runs all operations read from stream and writes the results to out
+
+    Returns the number of failed operations
+    '''
+    def write_result(result):
+        out.write(json.dumps(result) + '\n')
+        out.flush()
+
+    # One extra thread reads the input stream
+    runtime = aio_runtime.DriverRuntime(max_workers + 1)
+    runner = BatchRunner(write_result, max_workers, max_per_array, run_func,
+                         runtime)
+    try:
+        runtime.run(runner.run_stream(stream))
+    finally:
+        runtime.close()
+    return runner.failed
+
+
+def get_option_parser():
+    '''
+    Returns argument parser
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch",
+                        required=True,
+                        help="JSONL file with one operation per line, - for stdin")
+    parser.add_argument("--batch-workers",
+                        type=int,
+                        default=MAX_WORKERS,
+                        help="operations running at the same time")
+    parser.add_argument("--batch-per-array",
+                        type=int,
+                        default=MAX_PER_ARRAY,
+                        help="operations running at the same time per array")
+    return parser
+
+
+def main(argv=None):
+    '''
+    Returns the exit status, 1 if any operation failed
+    '''
+    args = get_option_parser().parse_args(argv)
+    if args.batch == '-':
+        failed = run_batch(sys.stdin, sys.stdout, args.batch_workers,
+                           args.batch_per_array)
+    else:
+        with open(args.batch) as stream:
+            failed = run_batch(stream, sys.stdout, args.batch_workers,
+                               args.batch_per_array)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
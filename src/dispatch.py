@@ -0,0 +1,260 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Driver dispatch library
+# Runs src/libs/<array model>/SteelFusionHandoff.py for a single Core request,
+# either inside the current interpreter or in a child interpreter.
+###############################################################################
+
+import contextlib
+import errno
+import importlib
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LIBS_DIR = os.path.join(ROOT_DIR, 'src', 'libs')
+DRIVER_SCRIPT = 'SteelFusionHandoff.py'
+DRIVER_MODULE = 'src.libs.%s.SteelFusionHandoff'
+
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+from src import admission
+from src import driver_args
+from src import filelock
+from src import hello_cache
+from src import inflight
+from src import lazy
+from src import lun_locks
+from src import registry
+
+# Set to False to always run drivers in a child interpreter
+IN_PROCESS_DISPATCH = True
+# Set to False to run retried Core requests again instead of
+# attaching them to the attempt which is still running
+COALESCE_REQUESTS = True
+
+# Drivers keep their state in module globals and talk to the Core through
+# stdout and stderr, so only one of them may run in-process at a time.
+_driver_lock = threading.Lock()
+_drivers = {}
+
+
+def get_driver_path(array_model):
+    '''
+    Returns the path of the driver script for the array model
+    '''
+    return os.path.join(LIBS_DIR, array_model, DRIVER_SCRIPT)
+
+
+def driver_exists(array_model):
+    '''
+    Checks whether the registry has a driver for the array model
+    '''
+    return registry.get_driver(array_model) is not None
+
+
+def load_driver(array_model):
+    '''
+    Imports the driver module once and keeps it loaded.
+
+    Returns None if the driver cannot run in this interpreter, for
+    example drivers the registry marks as not in_process or drivers
+    without a main() function.
+    '''
+    if array_model in _drivers:
+        return _drivers[array_model]
+    info = registry.get_driver(array_model)
+    module = None
+    if info is not None and info.in_process:
+        start = time.time()
+        try:
+            module = importlib.import_module(DRIVER_MODULE % array_model)
+        except (ImportError, SyntaxError):
+            module = None
+        else:
+            lazy.record('import', DRIVER_MODULE % array_model, time.time() - start)
+    if module is not None and not callable(getattr(module, 'main', None)):
+        module = None
+    _drivers[array_model] = module
+    return module
+
+
+def exit_status(code):
+    '''
+    Converts a SystemExit code to a process exit status the
+    same way the interpreter does.
+    '''
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write(str(code) + "\n")
+    return 1
+
+
+def run_in_process(module, argv, capture=True):
+    '''
+    Runs the driver main(argv) in this interpreter
+
+    module : driver module returned by load_driver()
+    argv : driver arguments without the program name
+    capture : collect stdout and stderr instead of writing them out
+
+    Returns (exit status, stdout, stderr)
+    '''
+    out = io.StringIO() if capture else sys.stdout
+    err = io.StringIO() if capture else sys.stderr
+    with _driver_lock:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                module.main(list(argv))
+                status = 0
+            except SystemExit as e:
+                status = exit_status(e.code)
+            except Exception:
+                traceback.print_exc()
+                status = 1
+    if capture:
+        return status, out.getvalue(), err.getvalue()
+    return status, '', ''
+
+
+def get_driver_command(array_model, argv):
+    '''
+    Returns the command line running the driver script in a child interpreter
+    '''
+    info = registry.get_driver(array_model)
+    interpreter = info.get_interpreter() if info is not None else sys.executable
+    return [interpreter, get_driver_path(array_model)] + list(argv)
+
+
+def run_subprocess(array_model, argv, capture=True):
+    '''
+    Runs the driver script in a child interpreter
+
+    Returns (exit status, stdout, stderr)
+    '''
+    path_list = get_driver_command(array_model, argv)
+    if not capture:
+        return subprocess.call(path_list, shell=False), '', ''
+    proc = subprocess.Popen(path_list, shell=False,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    return (proc.returncode,
+            out.decode('utf-8', 'replace'),
+            err.decode('utf-8', 'replace'))
+
+
+def request_key(array_model, argv):
+    '''
+    Returns the single-flight key of a Core request:
+    (array model, array, serial, operation, snap name),
+    or None if the request has no operation.
+    '''
+    operation = driver_args.get_option(argv, '--operation')
+    if not operation:
+        return None
+    return (array_model, driver_args.get_option(argv, '--array'),
+            driver_args.get_option(argv, '--serial'), operation,
+            driver_args.get_option(argv, '--snap-name'))
+
+
+def run_driver(array_model, argv, capture=True):
+    '''
+    Runs the driver main(argv) in-process when the driver can be imported
+    here, the driver script in a child interpreter otherwise. The LUN and
+    access group locks of the operation and a session slot of the array
+    are held while it runs.
+
+    Returns (exit status, stdout, stderr)
+    '''
+    array = driver_args.get_option(argv, '--array')
+    try:
+        # LUN locks first, a request holds an array session slot only
+        # while it can use it
+        with lun_locks.operation_locks(array_model, argv), \
+                admission.admit(array_model, array):
+            module = load_driver(array_model) if IN_PROCESS_DISPATCH else None
+            if module is not None:
+                return run_in_process(module, argv, capture)
+            return run_subprocess(array_model, argv, capture)
+    except filelock.LockTimeout as e:
+        err = "%s\n" % e
+        if capture:
+            return errno.EBUSY, '', err
+        sys.stderr.write(err)
+        return errno.EBUSY, '', ''
+
+
+def _run_once(array_model, argv):
+    key = request_key(array_model, argv) if COALESCE_REQUESTS else None
+    if key is None:
+        return run_driver(array_model, argv, True)
+    result = inflight.single_flight(key, lambda: run_driver(array_model, argv, True))
+    inflight.maybe_prune()
+    return result
+
+
+def run(array_model, argv, capture=True):
+    '''
+    Runs a single Core request against the array model driver.
+    A request identical to one still running, in this or another
+    process, waits for it and returns its result. HELLO is answered
+    from the hello_cache while the cached result is fresh.
+
+    array_model : driver directory name under src/libs
+    argv : driver arguments, --array-model already removed
+    capture : collect stdout and stderr instead of writing them out
+
+    Returns (exit status, stdout, stderr)
+    '''
+    key = request_key(array_model, argv) if COALESCE_REQUESTS else None
+    if key is None and not hello_cache.applies(argv):
+        return run_driver(array_model, argv, capture)
+    # The result may be handed to another request or cached, so it is
+    # always captured
+    status, out, err = hello_cache.cached(array_model, argv,
+                                          lambda: _run_once(array_model, argv))
+    if capture:
+        return status, out, err
+    sys.stdout.write(out)
+    sys.stdout.flush()
+    sys.stderr.write(err)
+    return status, '', ''
+
+
+def strip_model_args(argv):
+    '''
+    Removes --array-model and its value from the argument list
+    '''
+    return driver_args.remove_option(argv, '--array-model')
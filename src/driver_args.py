@@ -0,0 +1,68 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Driver argument lookup
+# dispatch, lun_locks, hello_cache and batch read a few options of a driver
+# request (array, serial, operation, ...) before the driver parses them.
+# They read them the way the drivers' option parsers do, so requests are
+# keyed, locked and cached on the values the driver actually runs with.
+###############################################################################
+
+
+def get_option(argv, name):
+    '''
+    Returns the value of the option in argv, given either as
+    "--name value" or as "--name=value", None if it is missing.
+    The last value wins when the option is repeated, as in optparse.
+    '''
+    value = None
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == name:
+            if i + 1 < len(argv):
+                value = argv[i + 1]
+            i += 2
+            continue
+        if arg.startswith(name + '='):
+            value = arg[len(name) + 1:]
+        i += 1
+    return value
+
+
+def remove_option(argv, name):
+    '''
+    Returns a copy of argv without the option and its value
+    '''
+    args = []
+    i = 0
+    while i < len(argv):
+        if argv[i] == name:
+            i += 2
+            continue
+        if not argv[i].startswith(name + '='):
+            args.append(argv[i])
+        i += 1
+    return args
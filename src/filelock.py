@@ -0,0 +1,152 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Exclusive file locks shared by all handoff processes on the host
+# msvcrt on Windows, fcntl elsewhere. The lock is released by the operating
+# system when the holding process dies, so a crashed run.py never leaves a
+# lock behind. Kept Python 2 compatible.
+###############################################################################
+
+import errno
+import os
+import time
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+# Seconds between attempts while waiting for a lock held by someone else
+POLL_INTERVAL = 0.1
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class FileLock(object):
+    '''
+    Exclusive lock on a file, e.g.
+        with FileLock(path):
+            ...
+
+    path : lock file, created if missing
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def _try_lock(self):
+        try:
+            if msvcrt is not None:
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EACCES, errno.EAGAIN, errno.EDEADLK):
+                return False
+            raise
+
+    def acquire(self, blocking=True, timeout=None):
+        '''
+        Takes the lock
+
+        blocking : wait for the lock if someone else holds it
+        timeout : seconds to wait, forever if None
+
+        Returns False if the lock is held by someone else and blocking is
+        False, raises LockTimeout if it was not free within timeout.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self.fd is None:
+                self._open()
+            if msvcrt is None and blocking and timeout is None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            else:
+                while not self._try_lock():
+                    if not blocking:
+                        self._close()
+                        return False
+                    if deadline is not None and time.time() >= deadline:
+                        self._close()
+                        raise LockTimeout("Timed out waiting for lock %s" % self.path)
+                    time.sleep(POLL_INTERVAL)
+            # The file may have been removed while this process waited for
+            # it (inflight.prune), the lock then belongs to the new file
+            if self._is_current():
+                return True
+            self._close()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+
+    def _is_current(self):
+        '''
+        Checks whether the locked file is still the one at the path
+        '''
+        samestat = getattr(os.path, 'samestat', None)
+        if samestat is None:
+            # Python 2 on Windows, where an open file can not be removed
+            return True
+        try:
+            return samestat(os.fstat(self.fd), os.stat(self.path))
+        except OSError:
+            return False
+
+    def release(self):
+        if self.fd is None:
+            return
+        if msvcrt is not None:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self._close()
+
+    def _close(self):
+        os.close(self.fd)
+        self.fd = None
+
+    def locked(self):
+        return self.fd is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
@@ -0,0 +1,244 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Resident handoff service
+# Keeps drivers loaded between Core requests. run.py forwards each request
+# over a loopback socket and relays stdout, stderr and exit code back to the
+# Core. Every request carries the token the service writes to SERVICE_FILE,
+# which only the user running the service can read, so other local users
+# can not run drivers through it. Start it on the handoff host with:
+#   python src\handoff_service.py
+###############################################################################
+
+import argparse
+import binascii
+import hmac
+import ipaddress
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import dispatch
+from src import worker_pool
+
+# Configuration defaults
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 7879
+# run.py only contacts the service when this file exists
+SERVICE_FILE = os.path.join(dispatch.ROOT_DIR, 'var', 'handoff_service.json')
+# Seconds run.py waits for the service to accept the connection
+CONNECT_TIMEOUT = 2
+# Random bytes in the request token
+TOKEN_BYTES = 32
+
+
+class HandoffRequestHandler(socketserver.StreamRequestHandler):
+    '''
+    Reads one JSON request per connection:
+        {"token": "...", "array_model": "hpeva", "argv": ["--array", ...]}
+    and writes back one JSON response:
+        {"status": 0, "stdout": "...", "stderr": "..."}
+    '''
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            token = str(request.get('token', ''))
+            array_model = request['array_model']
+            argv = request['argv']
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send_response(1, '', 'Invalid request: %s\n' % e)
+            return
+        if self.server.token is None or \
+                not hmac.compare_digest(token.encode('utf-8'), self.server.token.encode('ascii')):
+            self.send_response(1, '', 'Handoff service request refused: invalid token\n')
+            return
+        if not dispatch.driver_exists(array_model):
+            self.send_response(1, "Array type '%s' is unknown.\n" % array_model, '')
+            return
+        status, out, err = self.server.run(array_model, argv)
+        self.send_response(status, out, err)
+
+    def send_response(self, status, out, err):
+        response = {'status': status, 'stdout': out, 'stderr': err}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class HandoffService(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    # On Windows SO_REUSEADDR lets a second process bind the same port
+    allow_reuse_address = os.name != 'nt'
+    # worker_pool.WorkerPool, requests run in the service process if None
+    pool = None
+    # Token every request must carry, see write_service_file()
+    token = None
+
+    def run(self, array_model, argv):
+        if self.pool is not None:
+            return self.pool.run(array_model, argv)
+        return dispatch.run(array_model, argv)
+
+
+def new_token():
+    return binascii.hexlify(os.urandom(TOKEN_BYTES)).decode('ascii')
+
+
+def write_service_file(host, port, token):
+    '''
+    Writes the service address and request token, readable by the owner only
+    '''
+    remove_service_file()
+    # A file left behind may be readable by others, so it is created anew
+    fd = os.open(SERVICE_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'host': host, 'port': port, 'pid': os.getpid(), 'token': token}, f)
+
+
+def remove_service_file():
+    try:
+        os.remove(SERVICE_FILE)
+    except OSError:
+        pass
+
+
+def is_loopback(host):
+    '''
+    Checks whether every address the host name resolves to is a loopback
+    address
+    '''
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return bool(infos) and all(
+        ipaddress.ip_address(info[4][0].split('%')[0]).is_loopback for info in infos)
+
+
+def get_service_address():
+    '''
+    Returns (host, port, token) of the running service or None
+    '''
+    try:
+        with open(SERVICE_FILE) as f:
+            info = json.load(f)
+        return info['host'], int(info['port']), info['token']
+    except (OSError, IOError, ValueError, KeyError, TypeError):
+        return None
+
+
+def call_service(array_model, argv):
+    '''
+    Forwards a Core request to the resident service
+
+    array_model : driver directory name under src/libs
+    argv : driver arguments, --array-model already removed
+
+    Returns (exit status, stdout, stderr), or None if the service is not
+    running, in which case the caller must run the request itself.
+    '''
+    address = get_service_address()
+    if address is None:
+        return None
+    host, port, token = address
+    try:
+        sock = socket.create_connection((host, port), CONNECT_TIMEOUT)
+    except (OSError, socket.error):
+        return None
+    # The request may already be running on the array from here on, so
+    # failures are reported to the Core instead of retried locally.
+    try:
+        sock.settimeout(None)
+        request = {'token': token, 'array_model': array_model, 'argv': list(argv)}
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        response = json.loads(sock.makefile('rb').readline().decode('utf-8'))
+        return response['status'], response['stdout'], response['stderr']
+    except (OSError, socket.error, ValueError, KeyError) as e:
+        return 1, '', 'Handoff service request failed: %s\n' % e
+    finally:
+        sock.close()
+
+
+def get_option_parser():
+    '''
+    Returns argument parser
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host",
+                        default=SERVICE_HOST,
+                        help="loopback address to listen on")
+    parser.add_argument("--port",
+                        type=int,
+                        default=SERVICE_PORT,
+                        help="port to listen on")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=worker_pool.POOL_SIZE,
+                        help="worker processes, 0 runs requests in the service process")
+    parser.add_argument("--affinity",
+                        action="append",
+                        metavar="ARRAY=WORKER",
+                        help="pin an array to a worker, may be repeated")
+    return parser
+
+
+def handle_sigterm(signum, frame):
+    sys.exit(0)
+
+
+def main():
+    parser = get_option_parser()
+    args = parser.parse_args()
+    # Requests run drivers with the service's credentials, and the token
+    # travels in cleartext, so they must not come from other hosts
+    if not is_loopback(args.host):
+        parser.error("--host must be a loopback address, not %s" % args.host)
+    try:
+        affinity = worker_pool.parse_affinity(args.affinity)
+    except ValueError as e:
+        parser.error(str(e))
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    server = HandoffService((args.host, args.port), HandoffRequestHandler)
+    server.token = new_token()
+    if args.workers > 0:
+        server.pool = worker_pool.WorkerPool(args.workers, affinity or None)
+        server.pool.start()
+    write_service_file(args.host, server.server_address[1], server.token)
+    print("Handoff service listening on %s:%d" % (args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        remove_service_file()
+        server.server_close()
+        if server.pool is not None:
+            server.pool.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# HELLO result cache
+# The Core polls HELLO for every LUN, and each HELLO lists the whole array
+# to find the LUN. The dispatcher keeps the result of a HELLO in the state
+# store (hello_cache table) by (array model, array, serial) for HELLO_TTL
+# seconds, NEGATIVE_TTL seconds when the LUN was not found, and answers the
+# next polls from it. CREATE_SNAP and REMOVE_SNAP drop the results cached
+# for their array when they finish.
+###############################################################################
+
+import errno
+import os
+import sqlite3
+
+from src import driver_args
+from src import script_db
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Configuration defaults
+# Set to False to run every HELLO against the array
+HELLO_CACHE = True
+# Seconds a successful HELLO is answered from the cache
+HELLO_TTL = 30
+# Seconds a failed HELLO is answered from the cache, 0 disables
+# negative caching
+NEGATIVE_TTL = 10
+# Operations after which the results cached for their array are dropped
+INVALIDATING_OPERATIONS = ('CREATE_SNAP', 'REMOVE_SNAP')
+
+
+def applies(argv):
+    '''
+    Checks whether the request reads or invalidates the cache
+    '''
+    operation = driver_args.get_option(argv, '--operation')
+    return HELLO_CACHE and (operation == 'HELLO' or operation in INVALIDATING_OPERATIONS)
+
+
+def _open(argv):
+    work_dir = driver_args.get_option(argv, '--work-dir') or ROOT_DIR
+    return script_db.StateStore(work_dir).hello
+
+
+def _cacheable(result):
+    status, out, err = result
+    if status == 0:
+        return HELLO_TTL
+    # Lock and admission timeouts and driver crashes say nothing about the LUN
+    if status == errno.EBUSY or 'Traceback' in err:
+        return 0
+    return NEGATIVE_TTL
+
+
+def cached(array_model, argv, func):
+    '''
+    Runs func() for the request, answering HELLO from the cache and
+    dropping the array's results after CREATE_SNAP and REMOVE_SNAP
+
+    func : runs the request, returns (exit status, stdout, stderr)
+
+    Returns (exit status, stdout, stderr)
+    '''
+    if not applies(argv):
+        return func()
+    operation = driver_args.get_option(argv, '--operation')
+    array = driver_args.get_option(argv, '--array')
+    serial = (driver_args.get_option(argv, '--serial') or '').upper()
+    if operation != 'HELLO':
+        try:
+            return func()
+        finally:
+            try:
+                _open(argv).invalidate(array_model, array)
+            except sqlite3.Error:
+                pass
+    try:
+        hit = _open(argv).get(array_model, array, serial)
+    except sqlite3.Error:
+        hit = None
+    if hit is not None:
+        return tuple(hit)
+    result = tuple(func())
+    ttl = _cacheable(result)
+    if ttl > 0:
+        try:
+            _open(argv).put(array_model, array, serial, result, ttl)
+        except sqlite3.Error:
+            # The cache never fails a HELLO
+            pass
+    return result
@@ -0,0 +1,309 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Shared HTTP transport for the REST drivers (HP MSA, HP RMC, FreeNAS, 3PAR)
+# Requests to one array endpoint (scheme://host:port) go through one
+# requests.Session, so the TCP connection and its TLS session stay open
+# between the calls of a driver run instead of a new handshake per call.
+# Every request gets the default connect and read timeouts unless the caller
+# passes its own, and gzip replies are accepted. Requests, new connections,
+# errors and reply bytes are counted per endpoint and added to
+# var\http_transport.db every STATS_INTERVAL seconds and at exit. Show them
+# with:
+#   python src\http_transport.py
+# Used by the Python 2 _v1 drivers as well, keep it Python 2 compatible.
+###############################################################################
+
+import argparse
+import atexit
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import lazy
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+STATS_DB = os.path.join(ROOT_DIR, 'var', 'http_transport.db')
+
+# Configuration defaults
+# Keep-alive connections per array endpoint, a driver run mostly needs one
+POOL_SIZE = 4
+# {host: connections} overriding POOL_SIZE
+ARRAY_POOL_SIZES = {}
+# Seconds to open a connection and to wait for a reply, used when a call
+# passes no timeout of its own
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 600
+# Verify the array certificates, most arrays run with self-signed ones
+VERIFY_TLS = False
+# Seconds between writes of the statistics to STATS_DB, 0 to only write them
+# at exit
+STATS_INTERVAL = 10
+
+
+def _loaded(module):
+    if not VERIFY_TLS:
+        module.packages.urllib3.disable_warnings()
+
+requests = lazy.lazy_import('requests', on_load=_loaded)
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+_last_flush = [time.time()]
+
+
+class Endpoint(object):
+    '''
+    Keep-alive session to one array endpoint and its counters
+    '''
+
+    def __init__(self, endpoint, host):
+        self.endpoint = endpoint
+        self.pool_size = ARRAY_POOL_SIZES.get(host, POOL_SIZE)
+        self.session = requests.Session()
+        self.session.verify = VERIFY_TLS
+        # One pool per TLS setting, a session normally uses a single one
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=2,
+                                                     pool_maxsize=self.pool_size)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        # Counters already written to STATS_DB
+        self.flushed = (0, 0, 0, 0, 0.0)
+
+    def connections(self):
+        '''
+        Returns the connections opened so far, requests over this number
+        reused an open connection
+        '''
+        pools = self.adapter.poolmanager.pools
+        total = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                total += pool.num_connections
+        return total
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        started = time.time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self.lock:
+                self.requests += 1
+                self.errors += 1
+            raise
+        # Bytes on the wire, compressed if the array sent gzip
+        length = response.headers.get('Content-Length', '')
+        with self.lock:
+            self.requests += 1
+            self.seconds += time.time() - started
+            if length.isdigit():
+                self.bytes += int(length)
+        return response
+
+    def counters(self):
+        with self.lock:
+            return (self.requests, self.connections(), self.errors, self.bytes,
+                    self.seconds)
+
+    def close(self):
+        self.session.close()
+
+
+def get_endpoint(url):
+    '''
+    Returns the Endpoint for the scheme, host and port of url
+    '''
+    parts = urlsplit(url)
+    endpoint = '%s://%s' % (parts.scheme.lower(), parts.netloc.lower())
+    with _endpoints_lock:
+        ep = _endpoints.get(endpoint)
+        if ep is None:
+            ep = _endpoints[endpoint] = Endpoint(endpoint, parts.hostname)
+        return ep
+
+
+def request(method, url, **kwargs):
+    '''
+    Sends a request over the endpoint's keep-alive session, takes the
+    arguments of requests.request(). Returns the response.
+    '''
+    response = get_endpoint(url).request(method, url, **kwargs)
+    if STATS_INTERVAL and time.time() - _last_flush[0] > STATS_INTERVAL:
+        flush_stats()
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
+
+
+def _connect():
+    if not os.path.isdir(os.path.dirname(STATS_DB)):
+        os.makedirs(os.path.dirname(STATS_DB))
+    conn = sqlite3.connect(STATS_DB, timeout=30, isolation_level=None)
+    conn.execute('CREATE TABLE IF NOT EXISTS stats (endpoint text PRIMARY KEY, '
+                 'pool_size integer, requests integer, connections integer, '
+                 'errors integer, bytes integer, seconds real, updated real)')
+    return conn
+
+
+def flush_stats():
+    '''
+    Adds the counters of this process since the last flush to STATS_DB
+    '''
+    _last_flush[0] = time.time()
+    with _endpoints_lock:
+        endpoints = list(_endpoints.values())
+    deltas = []
+    for ep in endpoints:
+        counters = ep.counters()
+        delta = tuple(now - then for now, then in zip(counters, ep.flushed))
+        if delta[0]:
+            deltas.append((ep, counters, delta))
+    if not deltas:
+        return
+    try:
+        conn = _connect()
+    except (OSError, sqlite3.Error):
+        # Statistics are best effort, a driver run never fails on them
+        return
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for ep, counters, delta in deltas:
+            conn.execute('INSERT OR IGNORE INTO stats VALUES (?, ?, 0, 0, 0, 0, 0, 0)',
+                         (ep.endpoint, ep.pool_size))
+            conn.execute('UPDATE stats SET pool_size=?, requests=requests+?, '
+                         'connections=connections+?, errors=errors+?, '
+                         'bytes=bytes+?, seconds=seconds+?, updated=? '
+                         'WHERE endpoint=?',
+                         (ep.pool_size,) + delta + (_last_flush[0], ep.endpoint))
+        conn.execute('COMMIT')
+        for ep, counters, delta in deltas:
+            ep.flushed = counters
+    except sqlite3.Error:
+        pass
+    finally:
+        conn.close()
+
+
+def close_all():
+    '''
+    Writes the statistics and closes the connections of every endpoint
+    '''
+    flush_stats()
+    with _endpoints_lock:
+        endpoints = list(_endpoints.values())
+        _endpoints.clear()
+    for ep in endpoints:
+        ep.close()
+
+atexit.register(close_all)
+
+
+def get_status():
+    '''
+    Returns one dict per endpoint with the requests sent, the connections
+    opened and how many requests reused an open connection
+    '''
+    if not os.path.exists(STATS_DB):
+        return []
+    conn = _connect()
+    try:
+        status = []
+        for (endpoint, pool_size, requests_, connections, errors, bytes_,
+             seconds, updated) in conn.execute(
+                'SELECT endpoint, pool_size, requests, connections, errors, '
+                'bytes, seconds, updated FROM stats ORDER BY endpoint'):
+            reused = max(0, requests_ - connections)
+            status.append({'endpoint': endpoint,
+                           'pool_size': pool_size,
+                           'requests': requests_,
+                           'connections': connections,
+                           'reused': reused,
+                           'reuse_ratio': float(reused) / requests_ if requests_ else 0,
+                           'errors': errors,
+                           'bytes': bytes_,
+                           'avg_time': seconds / requests_ if requests_ else 0,
+                           'updated': updated})
+        return status
+    finally:
+        conn.close()
+
+
+def get_option_parser():
+    '''
+    Returns argument parser
+    '''
+    parser = argparse.ArgumentParser(description="Shows the connection reuse of "
+                                                 "each array endpoint")
+    parser.add_argument("--reset",
+                        action="store_true",
+                        default=False,
+                        help="clear the statistics")
+    return parser
+
+
+def main():
+    args = get_option_parser().parse_args()
+    if args.reset:
+        conn = _connect()
+        conn.execute('DELETE FROM stats')
+        conn.close()
+        return
+    print("%-40s %5s %8s %8s %7s %6s %10s %9s" %
+          ('endpoint', 'pool', 'requests', 'conns', 'reused', 'errors', 'received',
+           'avg time'))
+    for row in get_status():
+        print("%-40s %5d %8d %8d %6.0f%% %6d %9.1fK %8.0fms" %
+              (row['endpoint'], row['pool_size'], row['requests'],
+               row['connections'], row['reuse_ratio'] * 100, row['errors'],
+               row['bytes'] / 1024.0, row['avg_time'] * 1000))
+
+if __name__ == '__main__':
+    main()
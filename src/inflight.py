@@ -0,0 +1,241 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Single-flight registry of in-flight Core requests
+# When the Core retries a request while the first attempt is still running
+# (a long clone + proxy mount for example), the retry waits for the first
+# attempt and gets its result instead of doing the same work on the array.
+#
+# Requests are keyed on (array model, array, serial, operation, snap name).
+# Threads of one process wait on the in-process registry, other processes
+# wait on a lock file under var\inflight and read the result file the
+# running request leaves behind.
+###############################################################################
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from src import filelock
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+INFLIGHT_DIR = os.path.join(ROOT_DIR, 'var', 'inflight')
+# Lock and result files not used for this many seconds are removed
+PRUNE_AGE = 24 * 3600
+# Seconds between two prune runs
+PRUNE_INTERVAL = 3600
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class _Flight(object):
+    '''
+    A request running in this process and the threads waiting for it
+    '''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+def key_name(key):
+    '''
+    Returns the file name prefix used for the key
+    '''
+    text = json.dumps([str(part) for part in key])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _result_path(key):
+    return os.path.join(INFLIGHT_DIR, key_name(key) + '.result')
+
+
+def _lock_path(key):
+    return os.path.join(INFLIGHT_DIR, key_name(key) + '.lock')
+
+
+def _write_result(key, result):
+    # Written to a temporary file first so a reader never sees half of it
+    path = _result_path(key)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'key': [str(part) for part in key],
+                   'result': list(result),
+                   'finished': time.time()}, f)
+    try:
+        os.replace(tmp_path, path)
+    except AttributeError:
+        # Python 2
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+
+
+def _read_result(key, since):
+    '''
+    Returns the result recorded for key after since, or None
+    '''
+    try:
+        with open(_result_path(key)) as f:
+            info = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if info.get('finished', 0) < since:
+        return None
+    return tuple(info['result'])
+
+
+def _run_across_processes(key, func):
+    '''
+    Runs func unless another process is running the same request,
+    in which case its result is returned once it finishes.
+    '''
+    lock = filelock.FileLock(_lock_path(key))
+    # Taken before trying the lock: the running request may write its
+    # result and release the lock right after the attempt
+    arrived = time.time()
+    if not lock.acquire(blocking=False):
+        lock.acquire()
+        try:
+            result = _read_result(key, arrived)
+            if result is not None:
+                return result
+            # The other process died without a result, run it here
+            result = func()
+            _write_result(key, result)
+            return result
+        finally:
+            lock.release()
+    try:
+        result = func()
+        _write_result(key, result)
+        return result
+    finally:
+        lock.release()
+
+
+def single_flight(key, func):
+    '''
+    Runs func() for the request key, or waits for the same request
+    which is already running and returns its result instead.
+
+    key : tuple identifying the request
+    func : function running the request, returns a JSON serializable tuple
+
+    Returns the result of func()
+    '''
+    with _registry_lock:
+        flight = _registry.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight()
+            _registry[key] = flight
+    if not leader:
+        flight.done.wait()
+        if flight.result is not None:
+            return flight.result
+        # The running request raised, try it here
+        return single_flight(key, func)
+    try:
+        flight.result = _run_across_processes(key, func)
+        return flight.result
+    finally:
+        with _registry_lock:
+            del _registry[key]
+        flight.done.set()
+
+
+def in_flight(key):
+    '''
+    Checks whether the request is running in this or another process
+    '''
+    with _registry_lock:
+        if key in _registry:
+            return True
+    lock = filelock.FileLock(_lock_path(key))
+    if not lock.acquire(blocking=False):
+        return True
+    lock.release()
+    return False
+
+
+def prune(max_age=PRUNE_AGE):
+    '''
+    Removes lock and result files of requests not seen for max_age seconds
+    '''
+    try:
+        names = os.listdir(INFLIGHT_DIR)
+    except OSError:
+        return
+    now = time.time()
+    for name in names:
+        path = os.path.join(INFLIGHT_DIR, name)
+        if name == 'pruned':
+            continue
+        try:
+            if now - os.path.getmtime(path) < max_age:
+                continue
+            if name.endswith('.lock'):
+                # Removed only while locked here; a process which opened the
+                # file meanwhile sees it gone once it gets the lock and locks
+                # the new file instead (FileLock.acquire)
+                lock = filelock.FileLock(path)
+                if not lock.acquire(blocking=False):
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Windows removes no open file, this one's included. It
+                    # is removed after the release instead, which Windows
+                    # refuses in turn if another process opened it meanwhile
+                    lock.release()
+                    os.remove(path)
+                finally:
+                    lock.release()
+                continue
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def maybe_prune(interval=PRUNE_INTERVAL):
+    '''
+    Runs prune() if it has not run for interval seconds on this host
+    '''
+    marker = os.path.join(INFLIGHT_DIR, 'pruned')
+    try:
+        if time.time() - os.path.getmtime(marker) < interval:
+            return
+    except OSError:
+        pass
+    try:
+        with open(marker, 'w'):
+            pass
+    except (IOError, OSError):
+        return
+    prune()
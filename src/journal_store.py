@@ -0,0 +1,646 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Append-only journal backend for the clone and snapshot tables
+# Every change is one JSON line appended to <base>.<generation>.log, and
+# every process keeps all rows in memory, indexed, catching up with the
+# lines other processes appended before each access. The log is compacted
+# into <base>.snap when it grows over COMPACT_BYTES.
+#
+# Appends are written to the file right away, so a crashed process loses
+# nothing. fsync is batched: it runs once FSYNC_BATCH records are written,
+# at the latest FSYNC_INTERVAL seconds after a write (from a timer thread
+# if no other commit comes) and when the process exits, so a power loss may
+# lose the last FSYNC_INTERVAL seconds of changes.
+#
+# Select it with script_db.STATE_BACKEND = 'journal'. Credentials, the
+# operation journal and the snapshot catalog stay in SQLite. A process may
+# take the journal lock while it holds the SQLite store lock, never the
+# other way round, so catalog changes are queued with after_commit() and
+# written once the outermost journal transaction committed and released
+# the lock. They are dropped if it rolls back.
+# Used by the Python 2 _v1 drivers as well, keep it Python 2 compatible.
+###############################################################################
+
+import atexit
+import contextlib
+import errno
+import functools
+import json
+import operator
+import os
+import threading
+import time
+
+from src import filelock
+from src import script_db
+
+# Records written before the log is fsync'ed
+FSYNC_BATCH = 64
+# Seconds a written record may wait for its fsync, 0 syncs every commit
+FSYNC_INTERVAL = 0.05
+# Log size which triggers a compaction into the snapshot file
+COMPACT_BYTES = 4 * 1024 * 1024
+
+# Journal files base name, relative to the work directory
+JOURNAL_BASE = os.path.join('var', 'handoff.journal')
+
+# Rows of each table: (primary key columns, indexed columns)
+TABLES = {'clone_info': ((0, 1), (0, 2, 3)),
+          'snap_to_replay_info': ((0,), (2,))}
+
+_BINARY = getattr(os, 'O_BINARY', 0)
+
+
+def _replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+        return
+    # Python 2 on Windows can not rename over an existing file
+    if os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+class TableIndex(object):
+    '''
+    Rows of one table by primary key, with an index per indexed column.
+    Each row keeps the sequence number of its first insert, which orders
+    the rows like the rowid of the SQLite tables.
+    '''
+
+    def __init__(self, key, indexed):
+        self.key = key
+        self.rows = {}
+        self.indexes = dict((column, {}) for column in indexed)
+        # (column, index) pairs, put() runs for every record replayed
+        self.index_items = list(self.indexes.items())
+        if len(key) == 1:
+            column = key[0]
+            self.row_key = lambda row: (row[column],)
+        else:
+            self.row_key = operator.itemgetter(*key)
+
+    def put(self, seq, row):
+        key = self.row_key(row)
+        old = self.rows.get(key)
+        if old is not None:
+            self._unindex(key, old[1])
+            seq = old[0]
+        self.rows[key] = (seq, row)
+        for column, index in self.index_items:
+            keys = index.get(row[column])
+            if keys is None:
+                index[row[column]] = set([key])
+            else:
+                keys.add(key)
+
+    def delete(self, key):
+        old = self.rows.pop(tuple(key), None)
+        if old is not None:
+            self._unindex(tuple(key), old[1])
+
+    def _unindex(self, key, row):
+        for column, index in self.index_items:
+            keys = index.get(row[column])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[row[column]]
+
+    def get(self, key):
+        entry = self.rows.get(tuple(key))
+        return entry[1] if entry else None
+
+    def select(self, column=None, values=None):
+        '''
+        Returns the rows with column in values, all rows if column is
+        None, in insert order
+        '''
+        if column is None:
+            entries = self.rows.values()
+        elif column in self.indexes:
+            keys = set()
+            for value in values:
+                keys.update(self.indexes[column].get(value, ()))
+            entries = [self.rows[key] for key in keys]
+        else:
+            values = set(values)
+            entries = [e for e in self.rows.values() if e[1][column] in values]
+        return [row for _, row in sorted(entries, key=lambda e: e[0])]
+
+
+class JournalLog(object):
+    '''
+    The journal files of one store, shared by the tables in this process
+
+    base : journal files path without extension
+    '''
+
+    def __init__(self, base):
+        self.base = base
+        self.snap_path = base + '.snap'
+        self.lock = threading.RLock()
+        self.file_lock = filelock.FileLock(base + '.lock')
+        self.depth = 0
+        self.pending = []
+        # Functions to run after the outermost transaction commits
+        self.committed = []
+        self.fd = None
+        self.unsynced = 0
+        self.synced_at = time.time()
+        # Timer syncing the records of the last commits
+        self.sync_timer = None
+        self.stale = True
+
+    def log_path(self, generation=None):
+        return '%s.%d.log' % (self.base, self.generation if generation is None else generation)
+
+    def _load(self):
+        # Reads the snapshot and replays its log from the start
+        self.tables = dict((name, TableIndex(*spec)) for name, spec in TABLES.items())
+        self.generation = 0
+        self.seq = 0
+        self.snap_signature = _signature(self.snap_path)
+        if self.snap_signature is not None:
+            with open(self.snap_path, 'rb') as f:
+                snapshot = json.loads(f.read().decode('utf-8'))
+            self.generation = snapshot['generation']
+            self.seq = snapshot['seq']
+            for name, entries in snapshot['tables'].items():
+                table = self.tables[name]
+                for seq, row in entries:
+                    table.put(seq, tuple(row))
+        self.offset = 0
+        self._close_fd()
+        self.stale = False
+        self._read_tail()
+
+    def _read_tail(self):
+        # Applies the complete lines appended since the last read
+        try:
+            with open(self.log_path(), 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        end = data.rfind(b'\n') + 1
+        loads = json.loads
+        for line in data[:end].decode('utf-8').splitlines():
+            try:
+                record = loads(line)
+            except ValueError:
+                # Torn write of a process which crashed while appending
+                continue
+            self._apply(record)
+        self.offset += end
+
+    def _apply(self, record):
+        table = self.tables[record[1]]
+        if record[0] == 'p':
+            table.put(self.seq, tuple(record[2]))
+        else:
+            table.delete(record[2])
+        self.seq += 1
+
+    def refresh(self):
+        '''
+        Catches up with the changes of the other processes
+        '''
+        if self.stale or _signature(self.snap_path) != self.snap_signature:
+            self._load()
+        else:
+            log = _signature(self.log_path())
+            if log is None:
+                if self.offset:
+                    # Compacted by another process
+                    self._load()
+            elif log[1] != self.offset:
+                self._read_tail()
+
+    @contextlib.contextmanager
+    def reading(self):
+        with self.lock:
+            if self.depth == 0:
+                self.refresh()
+            yield self.tables
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''
+        Holds the journal lock and writes the records of the block in
+        one append when it ends. Transactions nest.
+        '''
+        committed = ()
+        with self.lock:
+            if self.depth == 0:
+                self.file_lock.acquire()
+                try:
+                    self.refresh()
+                except Exception:
+                    self.file_lock.release()
+                    raise
+            self.depth += 1
+            try:
+                yield self.tables
+            except Exception:
+                self.depth -= 1
+                if self.depth == 0:
+                    # The rows in memory already have the changes, read them again
+                    self.pending = []
+                    self.committed = []
+                    self.stale = True
+                    self.file_lock.release()
+                raise
+            self.depth -= 1
+            if self.depth == 0:
+                committed, self.committed = self.committed, []
+                try:
+                    self._commit()
+                finally:
+                    self.file_lock.release()
+        # With no journal lock held, they may wait for the SQLite store
+        for func in committed:
+            func()
+
+    def after_commit(self, func):
+        '''
+        Runs func() once the outermost transaction committed and released
+        the journal lock, never if it rolls back
+        '''
+        assert self.depth > 0, "after_commit() must be called in a transaction"
+        self.committed.append(func)
+
+    def put(self, table, row):
+        self._record(['p', table, list(row)])
+
+    def delete(self, table, key):
+        self._record(['d', table, list(key)])
+
+    def _record(self, record):
+        assert self.depth > 0, "journal changes must be made in a transaction"
+        self._apply(record)
+        self.pending.append(record)
+
+    def _open_fd(self):
+        if self.fd is None:
+            self.fd = os.open(self.log_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT | _BINARY)
+        return self.fd
+
+    def _close_fd(self):
+        if self.fd is not None:
+            self.sync()
+            os.close(self.fd)
+            self.fd = None
+
+    def _commit(self):
+        records, self.pending = self.pending, []
+        if not records:
+            return
+        data = b''.join(json.dumps(r, separators=(',', ':')).encode('utf-8') + b'\n'
+                        for r in records)
+        fd = self._open_fd()
+        size = os.fstat(fd).st_size
+        if size > self.offset:
+            # Partial line left by a crashed writer, end it
+            data = b'\n' + data
+        written = 0
+        while written < len(data):
+            written += os.write(fd, data[written:])
+        self.offset = size + len(data)
+        self.unsynced += len(records)
+        if self.unsynced >= FSYNC_BATCH or time.time() - self.synced_at >= FSYNC_INTERVAL:
+            self.sync()
+        elif self.sync_timer is None:
+            # The resident service may not commit again for hours
+            self.sync_timer = threading.Timer(FSYNC_INTERVAL, self._timed_sync)
+            self.sync_timer.daemon = True
+            self.sync_timer.start()
+        if self.offset >= COMPACT_BYTES:
+            self._compact()
+
+    def sync(self):
+        '''
+        Flushes the records written so far to disk
+        '''
+        with self.lock:
+            if self.fd is not None and self.unsynced:
+                os.fsync(self.fd)
+            self.unsynced = 0
+            self.synced_at = time.time()
+
+    def compact(self):
+        '''
+        Writes all rows to the snapshot file and starts an empty log
+        '''
+        with self.transaction():
+            self._compact()
+
+    def _compact(self):
+        # Called with the journal lock held and the log read to its end
+        old = self.generation
+        snapshot = {'generation': old + 1,
+                    'seq': self.seq,
+                    'tables': dict((name, sorted([seq, list(row)]
+                                                 for seq, row in table.rows.values()))
+                                   for name, table in self.tables.items())}
+        tmp = self.snap_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(snapshot, separators=(',', ':')).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp, self.snap_path)
+        self._close_fd()
+        self.generation = old + 1
+        self.offset = 0
+        self.snap_signature = _signature(self.snap_path)
+        prefix = os.path.basename(self.base) + '.'
+        directory = os.path.dirname(self.base) or '.'
+        for name in os.listdir(directory):
+            if not (name.startswith(prefix) and name.endswith('.log')):
+                continue
+            try:
+                generation = int(name[len(prefix):-len('.log')])
+            except ValueError:
+                continue
+            if generation < self.generation:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    # Open by a reader on Windows, the next compaction removes it
+                    pass
+
+    def _timed_sync(self):
+        with self.lock:
+            self.sync_timer = None
+            self.sync()
+
+    def close(self):
+        with self.lock:
+            if self.sync_timer is not None:
+                self.sync_timer.cancel()
+                self.sync_timer = None
+            self._close_fd()
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def get_log(base):
+    '''
+    Returns the shared JournalLog of the journal files
+    '''
+    key = os.path.abspath(base)
+    with _logs_lock:
+        log = _logs.get(key)
+        if log is None:
+            directory = os.path.dirname(key)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    pass
+            log = JournalLog(key)
+            _logs[key] = log
+    return log
+
+
+def close_all():
+    '''
+    Syncs and closes all journals of this process
+    '''
+    with _logs_lock:
+        for log in _logs.values():
+            log.close()
+        _logs.clear()
+
+atexit.register(close_all)
+
+
+class JournalTable(object):
+    '''
+    Base class of the journal tables, same interface as script_db.Database
+
+    base : journal files path without extension
+    store_path : SQLite store keeping the operation journals, next to
+        the journal files by default
+    '''
+
+    TABLE = None
+
+    def __init__(self, base, store_path=None):
+        self.log_ = get_log(base)
+        self.store_path = store_path or os.path.join(os.path.dirname(base),
+                                                     os.path.basename(script_db.STORE_DB))
+
+    def setup(self):
+        '''
+        Nothing to create, the journal files are created on the first write
+        '''
+        pass
+
+    def transaction(self):
+        return self.log_.transaction()
+
+    def _table(self, tables):
+        return tables[self.TABLE]
+
+    def _delete_rows(self, rows):
+        with self.transaction() as tables:
+            table = self._table(tables)
+            for row in rows:
+                self.log_.delete(self.TABLE, table.row_key(row))
+        return len(rows)
+
+    def close(self):
+        '''
+        The journal is shared with other users in this process
+        and closed when the process exits
+        '''
+        pass
+
+
+class JournalScriptDB(JournalTable):
+    '''
+    script_db.ScriptDB on the journal
+    '''
+
+    TABLE = 'clone_info'
+
+    def insert_clone_info(self, lun, clone, snap_name, group):
+        self.insert_many([(lun, clone, snap_name, group)])
+
+    def insert_many(self, rows):
+        '''
+        Inserts or updates (lun, clone, snap_name, access_group) rows
+        in one transaction
+        '''
+        with self.transaction():
+            for row in rows:
+                self.log_.put(self.TABLE, tuple(script_db._text(v) for v in row))
+
+    def get_clone_info(self, lun_serial):
+        with self.log_.reading() as tables:
+            rows = self._table(tables).select(0, [script_db._text(lun_serial)])
+        return tuple(rows[0][1:]) if rows else ('', '', '')
+
+    def _select(self, tables, luns, access_group, snap_name):
+        table = self._table(tables)
+        if luns is not None:
+            rows = table.select(0, [script_db._text(lun) for lun in luns])
+        elif snap_name is not None:
+            rows = table.select(2, [script_db._text(snap_name)])
+        elif access_group is not None:
+            rows = table.select(3, [script_db._text(access_group)])
+        else:
+            rows = table.select()
+        return [row for row in rows
+                if (access_group is None or row[3] == script_db._text(access_group)) and
+                (snap_name is None or row[2] == script_db._text(snap_name))]
+
+    def get_many(self, luns=None, access_group=None, snap_name=None):
+        '''
+        Returns the (lun, clone, snap_name, access_group) rows matching
+        all the filters given
+        '''
+        with self.log_.reading() as tables:
+            return self._select(tables, luns, access_group, snap_name)
+
+    def delete_clone_info(self, lun_serial):
+        self.delete_many([lun_serial])
+
+    def delete_many(self, luns=None, access_group=None, snap_name=None):
+        '''
+        Deletes the rows get_many() would return, in one transaction
+
+        Returns the number of rows deleted
+        '''
+        if luns is None and access_group is None and snap_name is None:
+            raise ValueError("delete_many() needs at least one filter")
+        with self.transaction() as tables:
+            return self._delete_rows(self._select(tables, luns, access_group, snap_name))
+
+    def begin_operation(self, *key):
+        '''
+        Returns the journal of an operation, kept in the SQLite store
+        '''
+        return script_db.Operation(script_db.OpJournal(self.store_path), key)
+
+
+class JournalSnapToReplayDB(JournalTable):
+    '''
+    script_db.SnapToReplayDB on the journal, rows are
+    (snap_name, replay, serial, created)
+    '''
+
+    TABLE = 'snap_to_replay_info'
+
+    # SnapCatalog recording the snapshots inserted and deleted, set by StateStore
+    catalog = None
+
+    def insert_snap_info(self, snap_name, replay, serial=None):
+        self.insert_many([(snap_name, replay, serial)])
+
+    def insert_many(self, rows):
+        '''
+        Inserts or updates (snap_name, replay) or (snap_name, replay, serial)
+        rows in one transaction
+        '''
+        now = time.time()
+        values = []
+        with self.transaction() as tables:
+            table = self._table(tables)
+            for row in rows:
+                snap_name = script_db._text(row[0])
+                serial = script_db._text(row[2]) if len(row) > 2 else None
+                old = table.get((snap_name,))
+                if old is not None:
+                    # The first replay recorded is kept, as in the SQLite table
+                    replay = old[1] if old[1] is not None else script_db._text(row[1])
+                    serial = serial if serial is not None else old[2]
+                    now_row = (snap_name, replay, serial, old[3])
+                else:
+                    now_row = (snap_name, script_db._text(row[1]), serial, now)
+                self.log_.put(self.TABLE, now_row)
+                values.append(now_row)
+            if self.catalog is not None:
+                self.log_.after_commit(functools.partial(
+                    self.catalog.record_created, [(v[2], v[0], v[1]) for v in values]))
+
+    def get_snap_info(self, snap_name):
+        with self.log_.reading() as tables:
+            row = self._table(tables).get((script_db._text(snap_name),))
+        return tuple(row[:2]) if row else ('', '')
+
+    def _select(self, tables, snap_names, serial, older_than):
+        table = self._table(tables)
+        if snap_names is not None:
+            rows = [table.get((script_db._text(s),)) for s in snap_names]
+            rows = [row for row in rows if row is not None]
+        elif serial is not None:
+            rows = table.select(2, [script_db._text(serial)])
+        else:
+            rows = table.select()
+        return [row for row in rows
+                if (serial is None or row[2] == script_db._text(serial)) and
+                (older_than is None or row[3] < older_than)]
+
+    def get_many(self, snap_names=None, serial=None, older_than=None):
+        '''
+        Returns the (snap_name, replay) rows matching all the filters given
+        '''
+        with self.log_.reading() as tables:
+            return [tuple(row[:2]) for row in
+                    self._select(tables, snap_names, serial, older_than)]
+
+    def delete_snap_info(self, snap_name):
+        self.delete_many([snap_name])
+
+    def delete_many(self, snap_names=None, serial=None, older_than=None):
+        '''
+        Deletes the rows get_many() would return, in one transaction
+
+        Returns the number of rows deleted
+        '''
+        if snap_names is None and serial is None and older_than is None:
+            raise ValueError("delete_many() needs at least one filter")
+        with self.transaction() as tables:
+            rows = self._select(tables, snap_names, serial, older_than)
+            self._delete_rows(rows)
+            if self.catalog is not None:
+                self.log_.after_commit(functools.partial(
+                    self.catalog.record_removed, [row[0] for row in rows]))
+        return len(rows)
@@ -0,0 +1,198 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Streaming JSON decoder for array listings
+# Array REST APIs return collections as one JSON document, e.g.
+#   {"total": 2000, "members": [{...}, {...}, ...]}
+# iter_items() decodes the members of such a collection one at a time as the
+# reply arrives, so a driver holds one member instead of the whole document
+# and can stop reading once it found the member it looks for. Each member is
+# decoded by the standard json module, only the framing is scanned here.
+# Works with Python 2 and 3, the Python 2 drivers use it as well.
+###############################################################################
+
+import codecs
+import json
+
+# Bytes read from the reply at a time
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+
+class _Reader(object):
+    '''
+    Text buffer over an iterable of byte or text chunks
+    '''
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json = json.JSONDecoder()
+        self.buf = u''
+        self.pos = 0
+
+    def more(self):
+        '''
+        Appends the next chunk to the buffer, False at the end of the reply
+        '''
+        for chunk in self.chunks:
+            if isinstance(chunk, bytes):
+                chunk = self.decoder.decode(chunk)
+            if not chunk:
+                continue
+            if self.pos > CHUNK_SIZE:
+                self.buf = self.buf[self.pos:]
+                self.pos = 0
+            self.buf += chunk
+            return True
+        return False
+
+    def peek(self):
+        '''
+        Returns the next character which is not whitespace, '' at the end
+        '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expected %r at offset %d, found %r" %
+                             (chars, self.pos, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        '''
+        Decodes the JSON value at the current position
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.more():
+                    continue
+                raise
+            # A number at the end of the buffer may go on in the next chunk
+            if end == len(self.buf) and self.more():
+                continue
+            self.pos = end
+            return value
+
+
+def _find_array(reader, key):
+    # Moves the reader into the array, returns False if there is none
+    char = reader.expect('{[')
+    if char == '[':
+        if key is not None:
+            raise ValueError("Expected an object holding %r, found an array" % key)
+        return True
+    if key is None:
+        raise ValueError("Expected an array, found an object")
+    if reader.peek() == '}':
+        return False
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == key:
+            if reader.peek() == 'n':
+                reader.value()
+                return False
+            reader.expect('[')
+            return True
+        # Other members of the object, e.g. the total count, are skipped
+        reader.value()
+        if reader.expect(',}') == '}':
+            return False
+
+
+def iter_items(chunks, key=None):
+    '''
+    Yields the members of a JSON array one at a time
+
+    chunks : iterable of byte (UTF-8) or text chunks of the document
+    key : name of the array in the top level object, e.g. 'members',
+          None if the document is the array itself
+
+    Yields nothing if the object has no such key. Raises ValueError if
+    the document is not valid JSON.
+    '''
+    reader = _Reader(chunks)
+    if not _find_array(reader, key):
+        return
+    if reader.peek() == ']':
+        return
+    while True:
+        yield reader.value()
+        if reader.expect(',]') == ']':
+            return
+
+
+def iter_response(response, key=None, done=None):
+    '''
+    Yields the members of the JSON array in a requests response opened
+    with stream=True, see iter_items(). The response is closed when the
+    caller stops iterating.
+
+    done : called with the number of bytes read from the response once
+           it is closed, a chunked reply has no Content-Length to log
+    '''
+    size = [0]
+
+    def chunks():
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size[0] += len(chunk)
+            yield chunk
+
+    try:
+        for item in iter_items(chunks(), key):
+            yield item
+    finally:
+        response.close()
+        if done is not None:
+            done(size[0])
+
+
+def find_item(items, match):
+    '''
+    Returns the first item for which match(item) is true, None if there is
+    none. The rest of the items are not decoded.
+    '''
+    try:
+        for item in items:
+            if match(item):
+                return item
+        return None
+    finally:
+        # Closes the reply of iter_response() right away
+        if hasattr(items, 'close'):
+            items.close()
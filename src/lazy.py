@@ -0,0 +1,217 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Lazy loading helpers for the array drivers
+# Heavy libraries and the script databases are only loaded by the operation
+# that uses them, so a HELLO does not pay for a full snapshot setup.
+# Used by the Python 2 _v1 drivers as well, keep it Python 2 compatible.
+###############################################################################
+
+import atexit
+import importlib
+import os
+import sys
+import time
+
+# Set by run.py --profile-startup, inherited by driver processes
+PROFILE_ENV = 'HANDOFF_PROFILE_STARTUP'
+
+_timings = []
+_profile_title = None
+# Only a profiled run records timings, the handoff service and its workers
+# would keep them for their whole lifetime
+_profiling = False
+
+
+def record(kind, name, seconds):
+    '''
+    Records how long an import or open took for the startup profile,
+    nothing unless enable_profile() was called
+    '''
+    if _profiling:
+        _timings.append((kind, name, seconds))
+
+
+def timings():
+    return list(_timings)
+
+
+def report(stream=None, title=None):
+    '''
+    Writes the startup profile to stream, stderr by default
+    '''
+    stream = stream or sys.stderr
+    title = title or _profile_title or \
+        os.path.basename(os.path.dirname(os.path.abspath(sys.argv[0])))
+    stream.write("Startup profile for %s:\n" % title)
+    total = 0.0
+    for kind, name, seconds in _timings:
+        stream.write("  %-8s %-40s %8.1f ms\n" % (kind, name, seconds * 1000))
+        total += seconds
+    stream.write("  %-49s %8.1f ms\n" % ('total', total * 1000))
+
+
+def enable_profile(title=None):
+    '''
+    Prints the startup profile when the process exits
+    '''
+    global _profile_title, _profiling
+    _profiling = True
+    if title:
+        _profile_title = title
+    if not getattr(enable_profile, 'registered', False):
+        atexit.register(_report_at_exit)
+        enable_profile.registered = True
+
+
+def _report_at_exit():
+    # Nothing was loaded here when the driver ran in a child interpreter,
+    # the child prints its own report
+    if _timings:
+        report()
+
+
+class LazyModule(object):
+    '''
+    Stands in for a module and imports it on first attribute access
+
+    name : module name as passed to import
+    on_load : optional function called with the module once imported
+    '''
+
+    def __init__(self, name, on_load=None):
+        self.__dict__['_name'] = name
+        self.__dict__['_on_load'] = on_load
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            start = time.time()
+            module = importlib.import_module(self._name)
+            if self._on_load is not None:
+                self._on_load(module)
+            record('import', self._name, time.time() - start)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+
+class LazyAttribute(object):
+    '''
+    Stands in for a class or function of a lazily imported module,
+    the replacement for "from module import name", or for an attribute
+    of a LazyObject.
+    '''
+
+    def __init__(self, module, name):
+        self._module = module
+        self._name = name
+
+    def _load(self):
+        return getattr(self._module, self._name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+class LazyObject(object):
+    '''
+    Stands in for an object that is expensive to create, for example
+    a database connection, and creates it on first attribute access.
+
+    name : name shown in the startup profile
+    factory : function returning the object
+    '''
+
+    def __init__(self, name, factory):
+        self.__dict__['_name'] = name
+        self.__dict__['_factory'] = factory
+        self.__dict__['_obj'] = None
+
+    def _load(self):
+        obj = self.__dict__['_obj']
+        if obj is None:
+            start = time.time()
+            obj = self._factory()
+            record('open', self._name, time.time() - start)
+            self.__dict__['_obj'] = obj
+        return obj
+
+    def is_loaded(self):
+        return self.__dict__['_obj'] is not None
+
+    def close(self):
+        '''
+        Closes the object only if it was ever opened
+        '''
+        if self.is_loaded():
+            self._obj.close()
+            self.__dict__['_obj'] = None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+def lazy_import(name, on_load=None):
+    '''
+    Returns a stand-in for module name that imports it on first use
+    '''
+    return LazyModule(name, on_load)
+
+
+def lazy_from(name, attr):
+    '''
+    Returns a stand-in for "from name import attr"
+    '''
+    return LazyAttribute(lazy_import(name), attr)
+
+
+def lazy_open(cls, path, setup=False, **kwargs):
+    '''
+    Returns a stand-in for cls(path, **kwargs) that opens it on first use
+
+    cls : database class, e.g. script_db.ScriptDB
+    path : database file path
+    setup : call setup() right after opening
+    '''
+    def factory():
+        db = cls(path, **kwargs)
+        if setup:
+            db.setup()
+        return db
+    return LazyObject(path.replace('\\', '/').rsplit('/', 1)[-1], factory)
+
+
+if os.environ.get(PROFILE_ENV):
+    enable_profile()
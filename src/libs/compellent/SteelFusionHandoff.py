@@ -38,12 +38,10 @@ import os
 # information and the credentials
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
 from src import script_db
+from src import lazy
 
 
 # Configuration defaults
-CRED_DB = r'\var\cred.db'
-SCRIPT_DB = r'\var\script.db'
-SNAP_DB = r'\var\replay.db'
 WORK_DIR =  r'C:\rvbd_handoff_scripts'
 HANDOFF_LOG_FILE = r'\log\handoff.log'
 
@@ -150,27 +148,36 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
     # Check for duplicate requests, these are possible
     # if Granite Core Crashes or the Handoff host itself crashed
     script_log('Starting create_snap')
-    rdb_snap_name, replay = rdb.get_snap_info(snap_name)
-    if rdb_snap_name:
-        script_log("Duplicate request")
-        print (snap_name)
-        return
+    # A proxy backup of this request that did not finish resumes after
+    # its last completed step, its snapshot is already recorded
+    op = sdb.begin_operation('CREATE_SNAP', server, serial, snap_name)
+    if op.resuming() and category == protect_category:
+        script_log("Resuming proxy backup after step %s" % op.last_step())
+    else:
+        rdb_snap_name, replay = rdb.get_snap_info(snap_name)
+        if rdb_snap_name:
+            script_log("Duplicate request")
+            print (snap_name)
+            return
 
     # Run proxy backup on this snapshot if its category matches
     # protected snapshot category
     if category == protect_category:
         # Un-mount the previously mounted cloned lun from proxy host
-        if unmount_proxy_backup(cdb, sdb, serial, proxy_host, datacenter, include_hosts, exclude_hosts) :
+        if op.step('unmount_proxy', unmount_proxy_backup, cdb, sdb, serial, proxy_host, datacenter, include_hosts, exclude_hosts):
             # Delete the cloned snapshot
-            delete_cloned_lun(cdb, sdb, server, serial, access_group)
+            op.step('delete_clone', delete_cloned_lun, cdb, sdb, server, serial, access_group)
             # Create a cloned snapshot lun form the snapshot
-            cloned_lun_serial = create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, access_group)
+            cloned_lun_serial = op.step('create_clone', create_snap_clone, cdb, sdb, rdb, server, serial, snap_name, access_group)
             # Mount the snapshot on the proxy host
-            mount_proxy_backup(cdb, sdb, cloned_lun_serial, snap_name,
-                               access_group, proxy_host, datacenter,
-                               include_hosts, exclude_hosts) 
+            op.step('mount_proxy', mount_proxy_backup, cdb, sdb, cloned_lun_serial, snap_name,
+                    access_group, proxy_host, datacenter,
+                    include_hosts, exclude_hosts)
+            op.finish()
             print (snap_name)
             return
+        # The unmount failed, take a plain snapshot
+        op.finish()
 
     # Else, either the snapshot is not protected
     # or the proxy unmount operation failed. In such a case
@@ -186,7 +193,7 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
     out_split = decoded.strip().split('\n')[0].split(":")[-1]
     script_log("Created snapshot successfully, index is " + str(out_split))
     # Script finished successfully
-    rdb.insert_snap_info(snap_name, out_split)
+    rdb.insert_snap_info(snap_name, out_split, serial)
     print (snap_name)
     sys.exit(0)
 
@@ -284,8 +291,10 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
     # the script must find out which cloned lun needs to me un-mapped.
     script_log('Inserting serial: %s, cloned_lun_serial: %s, snap_name: %s, group: %s' %\
                (serial, cloned_lun_serial, snap_name, accessgroup))
-    sdb.insert_clone_info(serial, cloned_lun_serial, snap_name, accessgroup)
-    rdb.insert_snap_info(snap_name, index)
+    # Roll back both records if either insert fails
+    with script_db.transaction(sdb, rdb):
+        sdb.insert_clone_info(serial, cloned_lun_serial, snap_name, accessgroup)
+        rdb.insert_snap_info(snap_name, index, serial)
     script_log("Index is:" + str(index))
     return cloned_lun_serial        
 
@@ -499,25 +508,24 @@ def get_option_parser():
     return parser
 
 
-def main():
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
     set_logger()
-    script_log("Running script with args: %s" % str(sys.argv))
-    options, argsleft = get_option_parser().parse_args()
+    script_log("Running script with args: %s" % str(argv))
+    options, argsleft = get_option_parser().parse_args(argv)
 
     # Set the working dir prefix
     set_script_path(options.work_dir)
 
     # Credentials db must be initialized by running the setup.py file in the root
+    # All handoff state is kept in one store, opened on first use
+    store = lazy.lazy_open(script_db.StateStore, options.work_dir,
+                           array=options.array, issue_time=options.issue_time)
     global cdb
-    cdb = script_db.CredDB(options.work_dir + CRED_DB)
-
-    # Initialize the script database
-    sdb = script_db.ScriptDB(options.work_dir + SCRIPT_DB)
-    sdb.setup()
-
-    # Create snap to replay mapping database
-    rdb = script_db.SnapToReplayDB(options.work_dir + SNAP_DB)
-    rdb.setup()
+    cdb = lazy.LazyAttribute(store, 'creds')
+    sdb = lazy.LazyAttribute(store, 'clones')
+    rdb = lazy.LazyAttribute(store, 'snaps')
     
     # Setup server/lun info
     conn = options.array
@@ -550,14 +558,10 @@ def main():
                     options.exclude_hosts)
     else:
         print ('Invalid operation: %s' % str(options.operation))
-        cdb.close()
-        sdb.close()
-        rdb.close()
+        store.close()
         sys.exit(errno.EINVAL)
 
-    sdb.close()
-    cdb.close()
-    rdb.close()
+    store.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -38,21 +38,21 @@ import os
 # Script DB is used to store/load the cloned lun
 # information and the credentials
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
+from src import http_transport
 from src import script_db
-from src.libs.hpeva import hpeva_api
+from src import lazy
+hpeva_api = lazy.lazy_import('src.libs.hpeva.hpeva_api')
 
 # import time
 # import re
-import requests
 import json
-requests.packages.urllib3.disable_warnings()
+# Requests go through src/http_transport.py, requests is only needed for
+# its exception classes
+requests = lazy.lazy_import('requests')
 # import hashlib
 #from lxmletree # import etree
 
 # Configuration defaults
-CRED_DB = r'\var\cred.db'
-SCRIPT_DB = r'\var\script.db'
-SNAP_DB = r'\var\replay.db'
 WORK_DIR =  r'C:\rvbd_handoff_scripts'
 HANDOFF_LOG_FILE = r'\log\handoff.log'
 
@@ -68,6 +68,8 @@ SKIP_VM_REGISTRATION = '1'
 
 # Generic parameters
 REQUEST_TIMEOUT = 600
+# Extents asked for per request, the API returns 20 when no limit is given
+EXTENT_PAGE = 100
 
 def set_logger():
     logging.basicConfig(filename=(WORK_DIR + HANDOFF_LOG_FILE), level=logging.DEBUG,
@@ -165,10 +167,11 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
     user, pwd = cdb.get_enc_info(server)
     base_url = 'http://' + server + '/api/v1.0/storage/snapshot/'
     try:
-        result = requests.post(base_url,
-                               data=json.dumps(request_data),
-                               auth=(user, pwd),
-                               headers={'content-type':'application/json'})
+        result = http_transport.post(base_url,
+                                     data=json.dumps(request_data),
+                                     auth=(user, pwd),
+                                     headers={'content-type':'application/json'},
+                                     timeout=REQUEST_TIMEOUT)
     except requests.exceptions.RequestException as e:
         print(e)
         sys.exit(1)
@@ -177,7 +180,7 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
         sys.exit(1)
     item = result.json()
     if 'id' in item:
-        rdb.insert_snap_info(snap_name, item['id'])
+        rdb.insert_snap_info(snap_name, item['id'], serial)
         print(snap_name)
         sys.exit(0)
     sys.exit(1)
@@ -228,7 +231,7 @@ def remove_snap(cdb, sdb, rdb, server, serial, snap_name, proxy_host,
     user, pwd = cdb.get_enc_info(server)
     base_url = 'http://' + server + '/api/v1.0/storage/snapshot/' + vdisk_snapname
     try:
-        result = requests.delete(base_url, auth=(user, pwd))
+        result = http_transport.delete(base_url, auth=(user, pwd), timeout=REQUEST_TIMEOUT)
     except requests.exceptions.RequestException as e:
         print(e)
         sys.exit(1)
@@ -276,7 +279,7 @@ def create_lun(cdb, sdb, rdb, server, serial,  snap_name, accessgroup):
     # Wait until Snap is created
     command = "WAIT_UNTIL VDISK %s GOOD" % vdisk_snapname
     hpeva_api.hp_sssu(server, user, pwd).run_sssu(command)
-    rdb.insert_snap_info(snap_name, vdisk_snapname)
+    rdb.insert_snap_info(snap_name, vdisk_snapname, serial)
 
     #Get parent Disk LUN number
     command = "ls vdisk %s" % vdisk_path
@@ -320,8 +323,10 @@ def create_lun(cdb, sdb, rdb, server, serial,  snap_name, accessgroup):
     # the script must find out which cloned lun needs to me un-mapped.
     script_log('Inserting serial: %s, cloned_lun_serial: %s, snap_name: %s, group: %s' %\
                (serial, lun_serial, snap_name, accessgroup))
-    sdb.insert_clone_info(serial, lun_serial, snap_name, accessgroup)
-    rdb.insert_snap_info(snap_name, vdisk_snapname)
+    # Roll back both records if either insert fails
+    with script_db.transaction(sdb, rdb):
+        sdb.insert_clone_info(serial, lun_serial, snap_name, accessgroup)
+        rdb.insert_snap_info(snap_name, vdisk_snapname, serial)
     return lun_serial
 
 
@@ -567,40 +572,59 @@ def get_vdisk_name(server, serial):
     server : HP EVA Management appliance hostname/ip address
     wwnid : lun wwn id
 
-    returns vdisk path
+    returns vdisk path. The extent list is kept in the inventory cache,
+    so only the first lookup after the list expired lists the extents.
+    Snapshots do not change the extents. Extents are asked for a page at
+    a time, and no more pages once the serial is found.
     '''
+    path = idb.get(server, 'extent', serial)
+    if path is not None:
+        return path
     user, pwd = cdb.get_enc_info(server)
     base_url = 'http://' + server + '/api/v1.0/services/iscsi/extent/'
-    try:
-        result = requests.get(base_url, auth=(user, pwd),)
-    except requests.exceptions.RequestException as e:
-        print(e)
-        sys.exit(1)
-    # print(result.text)
-    for item in result.json():
-        if item['iscsi_target_extent_serial'] == serial:
-            return item['iscsi_target_extent_path']
-    return ""
+    extents = {}
+    offset = 0
+    complete = False
+    while serial not in extents:
+        try:
+            result = http_transport.get(base_url, auth=(user, pwd),
+                                        params={'limit': EXTENT_PAGE, 'offset': offset},
+                                        timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            print(e)
+            sys.exit(1)
+        script_log("Extents from %d returned %d bytes" % (offset, len(result.content)))
+        page = result.json()
+        found = len(extents)
+        for item in page:
+            extents[item['iscsi_target_extent_serial']] = item['iscsi_target_extent_path']
+        # A short page is the last one, servers which do not page return all
+        if len(page) != EXTENT_PAGE or len(extents) == found:
+            complete = True
+            break
+        offset += len(page)
+    idb.sync(server, 'extent', extents, complete=complete)
+    return extents.get(serial, "")
 
-def main():
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
     set_logger()
-    script_log("Running script with args: %s" % str(sys.argv))
-    options, argsleft = get_option_parser().parse_args()
+    script_log("Running script with args: %s" % str(argv))
+    options, argsleft = get_option_parser().parse_args(argv)
 
     # Set the working dir prefix
     set_script_path(options.work_dir)
 
     # Credentials db must be initialized by running the setup.py file in the root
-    global cdb
-    cdb = script_db.CredDB(options.work_dir + CRED_DB)
-
-    # Initialize the script database
-    sdb = script_db.ScriptDB(options.work_dir + SCRIPT_DB)
-    sdb.setup()
-
-    # Create snap to replay mapping database
-    rdb = script_db.SnapToReplayDB(options.work_dir + SNAP_DB)
-    rdb.setup()
+    # All handoff state is kept in one store, opened on first use
+    store = lazy.lazy_open(script_db.StateStore, options.work_dir,
+                           array=options.array, issue_time=options.issue_time)
+    global cdb, idb
+    cdb = lazy.LazyAttribute(store, 'creds')
+    sdb = lazy.LazyAttribute(store, 'clones')
+    rdb = lazy.LazyAttribute(store, 'snaps')
+    idb = lazy.LazyAttribute(store, 'inventory')
 
     # Get credentials for the proxy host
     # username, password = cdb.get_enc_info(options.array)
@@ -625,14 +649,10 @@ def main():
                     options.exclude_hosts)
     else:
         print ('Invalid operation: %s' % str(options.operation))
-        cdb.close()
-        sdb.close()
-        rdb.close()
+        store.close()
         sys.exit(errno.EINVAL)
 
-    sdb.close()
-    cdb.close()
-    rdb.close()
+    store.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,6 @@
+###############################################################################
+# FreeNAS driver capabilities, see src/registry.py
+###############################################################################
+CAPABILITIES = {
+    'proxy_backup': True,
+}
@@ -37,16 +37,20 @@ import subprocess
 import string
 import random
 import logging
-
-# Script DB is used to store/load the cloned lun
-# information and the credentials
-import script_db
+import json
 
 # For setting up PATH
 import os
 
-import hp3parclient
-from hp3parclient import client, exceptions
+# Heavy modules and the databases are loaded on first use
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
+from src import http_transport
+from src import json_stream
+from src import lazy
+from src import script_db
+
+client = lazy.lazy_import('hp3parclient.client')
+exceptions = lazy.lazy_import('hp3parclient.exceptions')
 
 
 # Paths for VADP scripts
@@ -55,6 +59,11 @@ WORK_DIR =  r'C:\rvbd_handoff_scripts'
 VADP_CLEANUP = WORK_DIR + r'\vadp_cleanup.pl'
 VADP_SETUP = WORK_DIR + r'\vadp_setup.pl'
 HANDOFF_LOG_FILE = WORK_DIR + r'\handoff.txt'
+# WSAPI query for the volume with a wwn, set to '' for arrays without queries
+VOLUME_QUERY = '/volumes?query="wwn EQ %s"'
+# Decode the volume listing one volume at a time as it arrives, False to
+# use getVolumes() which decodes the whole listing at once
+STREAM_LISTINGS = True
 
 def set_logger():
     logging.basicConfig(filename= HANDOFF_LOG_FILE, level=logging.DEBUG,
@@ -106,6 +115,118 @@ def check_lun(conn, serial):
     u'60002AC000000000000000090000299F'
 
         '''
+    volname = find_volume(conn, serial)
+
+#If the name doesn't exist, will need to error with LUN serial not found.    
+    if volname is None:
+        print("Unable to find LUN.")
+        sys.exit(1)
+    script_log('Volume for LUN ' + serial + " is " + volname + '.\n')
+    script_log ("OK\n")
+    sys.exit(0)
+
+def find_volume(server, serial):
+    '''
+    Returns the name of the volume whose wwn contains the lun serial,
+    None if there is none
+
+    The array's volumes are kept in the inventory cache, so only the first
+    lookup after the listing expired lists them all. Volumes created since
+    are found by listing again on a miss, remove_snap drops the volumes
+    it deletes.
+    '''
+    volname = idb.get(server, 'volume', serial)
+    if volname is None:
+        volname = idb.get(server, 'volume-serial', serial)
+    if volname is not None:
+        return volname
+    volname = query_volume(server, serial)
+    if volname is not None:
+        return volname
+    names = refresh_volumes(server)
+    volname = names.get(serial)
+    if volname is None:
+        for wwn in names:
+            if serial in wwn :
+                volname = names[wwn]
+        if volname is not None:
+            idb.put(server, 'volume-serial', serial, volname)
+    return volname
+
+def query_volume(server, serial):
+    '''
+    Asks the array for the volume with the lun serial as its wwn only.
+    Returns its name, None if no volume matched or the array can not run
+    the query, the caller then lists all volumes.
+    '''
+    if not VOLUME_QUERY:
+        return None
+    try:
+        # Arrays which ignore the query return every volume, check the wwn
+        # here; a streamed reply is read up to the matching volume only
+        if STREAM_LISTINGS:
+            response = http_transport.get(cl.http.api_url + VOLUME_QUERY % serial, stream=True,
+                                          headers={cl.http.SESSION_COOKIE_NAME: cl.http.session_key})
+            if response.status_code != 200:
+                response.close()
+                raise Exception("status " + str(response.status_code))
+            volumes = json_stream.iter_response(response, 'members', log_query_size)
+        else:
+            response, body = cl.http.get(VOLUME_QUERY % serial)
+            log_query_size(len(response.content))
+            volumes = body.get('members', [])
+        volume = json_stream.find_item(volumes, lambda volume: volume['wwn'] == serial)
+    except Exception as ex:
+        script_log("Volume query failed, listing all volumes: " + str(ex))
+        return None
+    if volume is None:
+        return None
+    idb.sync(server, 'volume', {volume['wwn']: volume['name']},
+             {volume['wwn']: '%s:%s' % (volume['name'], volume.get('creationTimeSec'))},
+             complete=False)
+    return volume['name']
+
+def log_query_size(size):
+    script_log("Volume query returned " + str(size) + " bytes")
+
+def refresh_volumes(server):
+    '''
+    Lists the array's volumes and merges them into the inventory cache,
+    only the volumes which changed since the last listing are written
+
+    Returns {wwn: volume name}
+    '''
+    names = {}
+    fingerprints = {}
+    for volume in iter_volumes():
+        names[volume['wwn']] = volume['name']
+        fingerprints[volume['wwn']] = '%s:%s' % (volume['name'], volume.get('creationTimeSec'))
+    changed, dropped = idb.sync(server, 'volume', names, fingerprints)
+    script_log("Volume listing merged, %d changed, %d gone\n" % (changed, dropped))
+    return names
+
+def log_listing_size(size):
+    script_log("Volume listing returned " + str(size) + " bytes")
+
+def iter_volumes():
+    '''
+    Returns an iterator over the array's volumes. With STREAM_LISTINGS the
+    WSAPI reply is decoded one volume at a time, so the space and policy
+    details of thousands of volumes are never held at once. getVolumes()
+    is used if the streamed request fails.
+    '''
+    if STREAM_LISTINGS:
+        try:
+            response = http_transport.get(cl.http.api_url + '/volumes', stream=True,
+                                          headers={cl.http.SESSION_COOKIE_NAME: cl.http.session_key})
+        except Exception as ex:
+            script_log("Streamed volume listing failed, using getVolumes: " + str(ex))
+        else:
+            if response.status_code == 200:
+                return json_stream.iter_response(response, 'members', log_listing_size)
+            script_log("Streamed volume listing returned " + str(response.status_code) +
+                       ", using getVolumes")
+            response.close()
     try:
         volumes = cl.getVolumes()
     except exceptions.HTTPUnauthorized as ex:
@@ -114,19 +235,8 @@ def check_lun(conn, serial):
         print "Unable to get volumes."
         print ex
         sys.exit(1)
-    for volume in volumes['members']:
-        if serial in volume['wwn'] :
-            volname = volume['name']
-
-#If the name doesn't exist, will need to error with LUN serial not found.    
-    try:
-        script_log('Volume for LUN ' + serial + " is " + volname + '.\n')
-    except NameError:
-        print("Unable to find LUN.")
-        sys.exit(1)
-    else:
-        script_log ("OK\n")
-    sys.exit(0)
+    script_log("Volume listing returned about " + str(len(json.dumps(volumes))) + " bytes")
+    return iter(volumes['members'])
 
 def create_snap(cdb, sdb, rdb, server, serial, snap_name, 
                 access_group, proxy_host, datacenter,
@@ -161,48 +271,46 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
     # if Granite Core Crashes or the Handoff host itself crashed
     script_log('Starting create_snap')
 
-    rdb_snap_name, array_volname = rdb.get_snap_info(snap_name)
-    if rdb_snap_name:
-        script_log("Duplicate request")
-        print (snap_name)
-        return
+    # A proxy backup of this request that did not finish resumes after
+    # its last completed step, its snapshot is already recorded
+    op = sdb.begin_operation('CREATE_SNAP', server, serial, snap_name)
+    if op.resuming() and category == protect_category:
+        script_log("Resuming proxy backup after step %s" % op.last_step())
+    else:
+        rdb_snap_name, array_volname = rdb.get_snap_info(snap_name)
+        if rdb_snap_name:
+            script_log("Duplicate request")
+            print (snap_name)
+            return
 
     # Run proxy backup on this snapshot if its category matches
     # protected snapshot category
     
     if category == protect_category:
         # Un-mount the previously mounted cloned lun from proxy host
-        if unmount_proxy_backup(cdb, sdb, serial, proxy_host, datacenter, include_hosts, exclude_hosts) :
+        if op.step('unmount_proxy', unmount_proxy_backup, cdb, sdb, serial, proxy_host, datacenter, include_hosts, exclude_hosts):
             # Delete the cloned snapshot
-            delete_cloned_lun(cdb, sdb, server, snap_name)
+            op.step('delete_clone', delete_cloned_lun, cdb, sdb, server, snap_name)
             # Create a cloned snapshot lun form the snapshot
-            cloned_lun_serial = create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, access_group)
+            cloned_lun_serial = op.step('create_clone', create_snap_clone, cdb, sdb, rdb, server, serial, snap_name, access_group)
             # Mount the snapshot on the proxy host
-            mount_proxy_backup(cdb, sdb, cloned_lun_serial, snap_name,
-                               access_group, proxy_host, datacenter,
-                               include_hosts, exclude_hosts) 
+            op.step('mount_proxy', mount_proxy_backup, cdb, sdb, cloned_lun_serial, snap_name,
+                    access_group, proxy_host, datacenter,
+                    include_hosts, exclude_hosts)
+            op.finish()
             print (snap_name)
             return
+        # The unmount failed, take a plain snapshot
+        op.finish()
             
     # Creating a snapshot and no backup
-    try:
-        volumes = cl.getVolumes()
-    except exceptions.HTTPUnauthorized as ex:
-        print "You must login first"
-    except Exception as ex:
-        print "Unable to get volumes."
-        print ex
-        sys.exit(1)
-    for volume in volumes['members']:
-        if serial in volume['wwn'] :
-            volname = volume['name']
+    volname = find_volume(server, serial)
     #   script_log('Volume for LUN ' + serial + " is " + name + '.\n')
     #If the name doesn't exist, will need to error with LUN serial not found.    
-    try:
-        script_log("Creating snapshot with volume: " + volname + '.\n')
-    except NameError:
+    if volname is None:
         script_log("Unable to find LUN.")
         sys.exit(1)
+    script_log("Creating snapshot with volume: " + volname + '.\n')
     #Create snapshot
     # The array snapshot name will be rvbd_xxxxxxxx.
     # will take the first 8 characters of the snap_name for the random characters.
@@ -215,7 +323,7 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
         print ex
         sys.exit(1)
     #putting the info into the database so we know what to remove when we want to.
-    rdb.insert_snap_info(snap_name, array_volname)
+    rdb.insert_snap_info(snap_name, array_volname, serial)
     print (snap_name)
     return
 
@@ -267,8 +375,10 @@ def remove_snap(cdb, sdb, rdb, server, serial, snap_name, proxy_host,
         print "Unable to delete snapshot."
         print ex
         sys.exit(1)
+    idb.drop(server, 'volume', array_volname)
+    idb.drop(server, 'volume-serial', array_volname)
     script_log ("SnapshotSet removed\n")
-    rdb.delete_clone_info(snap_name)
+    rdb.delete_snap_info(snap_name)
     sys.exit(0)
 
 
@@ -288,24 +398,13 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
     '''
     script_log('Starting create_snap_clone')
 
-    try:
-        volumes = cl.getVolumes()
-    except exceptions.HTTPUnauthorized as ex:
-        print "You must login first"
-    except Exception as ex:
-        print "Unable to get volumes."
-        print ex
-        sys.exit(1)
-    for volume in volumes['members']:
-        if serial in volume['wwn'] :
-            volname = volume['name']
+    volname = find_volume(server, serial)
     #   script_log('Volume for LUN ' + serial + " is " + name + '.\n')
     #If the name doesn't exist, will need to error with LUN serial not found.    
-    try:
-        script_log("Creating snapshot with volume: " + volname + '.\n')
-    except NameError:
+    if volname is None:
         script_log("Unable to find LUN.")
         sys.exit(1)
+    script_log("Creating snapshot with volume: " + volname + '.\n')
     #Create snapshot
     # The array snapshot name will be rvbd_xxxxxxxx.
     # will take the first 8 characters of the snap_name for the random characters.
@@ -318,7 +417,7 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
         sys.exit(1)
 
     #putting the info into the database so we know what to remove when we want to.
-    rdb.insert_snap_info(snap_name, volname)
+    rdb.insert_snap_info(snap_name, volname, serial)
     
     #Create VLUN from the snapshot.
     try:
@@ -350,8 +449,10 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
     # the script must find out which cloned lun needs to me un-mapped.
     script_log('Inserting serial: %s, cloned_lun_serial: %s, snap_name: %s, group: %s' %\
                (serial, cloned_lun_serial, snap_name, accessgroup))
-    sdb.insert_clone_info(serial, cloned_lun_serial, snap_name, accessgroup)
-    rdb.insert_snap_info(snap_name, volname)
+    # Roll back both records if either insert fails
+    with script_db.transaction(sdb, rdb):
+        sdb.insert_clone_info(serial, cloned_lun_serial, snap_name, accessgroup)
+        rdb.insert_snap_info(snap_name, volname, serial)
     #script_log("Index is:" + str(index))
     return cloned_lun_serial        
 
@@ -585,24 +686,25 @@ def get_option_parser():
     return parser
 
 
-if __name__ == '__main__':
+def main(argv=None):
+    global cl, idb
+    if argv is None:
+        argv = sys.argv[1:]
     set_logger()
-    script_log("Running script with args: %s" % str(sys.argv))
-    options, argsleft = get_option_parser().parse_args()
+    script_log("Running script with args: %s" % str(argv))
+    options, argsleft = get_option_parser().parse_args(argv)
 
     # Set the working dir prefix
     set_script_path(options.work_dir)
 
     # Credentials db must be initialized using the cred_mgmt.py file
-    cdb = script_db.CredDB(options.work_dir + r'\cred_db')
-	
-    # Initialize the script database
-    sdb = script_db.ScriptDB(options.work_dir + r'\script_db')
-    sdb.setup()
-
-    # Create snap to replay mapping database
-    rdb = script_db.SnapToReplayDB(options.work_dir + r'\replay_db')
-    rdb.setup()
+    # All handoff state is kept in one store, opened on first use
+    store = lazy.lazy_open(script_db.StateStore, options.work_dir,
+                           array=options.array, issue_time=options.issue_time)
+    cdb = lazy.LazyAttribute(store, 'creds')
+    sdb = lazy.LazyAttribute(store, 'clones')
+    rdb = lazy.LazyAttribute(store, 'snaps')
+    idb = lazy.LazyAttribute(store, 'inventory')
     
     # Setup server/lun info
     conn = options.array
@@ -641,11 +743,10 @@ if __name__ == '__main__':
                     options.exclude_hosts)
     else:
         print ('Invalid operation: %s' % str(options.operation))
-        cdb.close()
-        sdb.close()
-        rdb.close()
+        store.close()
         sys.exit(errno.EINVAL)
 
-    sdb.close()
-    cdb.close()
-    rdb.close()
+    store.close()
+
+if __name__ == '__main__':
+    main()
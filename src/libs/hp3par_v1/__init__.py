@@ -0,0 +1,10 @@
+###############################################################################
+# HP 3PAR driver capabilities, see src/registry.py
+###############################################################################
+# hp3parclient only works with Python 2.x. The driver runs in a new
+# Python 2 process per request, so its client login (cl) is not reused.
+CAPABILITIES = {
+    'interpreter': 'python2',
+    'in_process': False,
+    'proxy_backup': True,
+}
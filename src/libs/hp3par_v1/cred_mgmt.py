@@ -24,14 +24,15 @@
 
 # Script DB is used to store/load the cloned lun
 # information and the credentials
-import script_db
+import os
 import sys
 
-DB_NAME = 'cred_db'
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
+from src import script_db
 
 if __name__ == '__main__':
-    # Create DB
-    db = script_db.CredDB('cred_db')
+    # Credentials of the handoff state store in the current directory
+    db = script_db.StateStore(os.getcwd()).creds
 
     done = False
     while not done:
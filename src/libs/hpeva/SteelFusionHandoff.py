@@ -39,12 +39,10 @@ import os
 # information and the credentials
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
 from src import script_db
-from src.libs.hpeva import hpeva_api
+from src import lazy
+hpeva_api = lazy.lazy_import('src.libs.hpeva.hpeva_api')
 
 # Configuration defaults
-CRED_DB = r'\var\cred.db'
-SCRIPT_DB = r'\var\script.db'
-SNAP_DB = r'\var\replay.db'
 WORK_DIR =  r'C:\rvbd_handoff_scripts'
 HANDOFF_LOG_FILE = r'\log\handoff.log'
 
@@ -114,27 +112,36 @@ def create_snap(cdb, sdb, rdb, server, system, serial, snap_name,
     # Check for duplicate requests, these are possible
     # if Granite Core Crashes or the Handoff host itself crashed
     script_log('Starting create_snap')
-    rdb_snap_name, replay = rdb.get_snap_info(snap_name)
-    if rdb_snap_name:
-        script_log("Duplicate request")
-        print (snap_name)
-        return
+    # A proxy backup of this request that did not finish resumes after
+    # its last completed step, its snapshot is already recorded
+    op = sdb.begin_operation('CREATE_SNAP', server, serial, snap_name)
+    if op.resuming() and category == protect_category:
+        script_log("Resuming proxy backup after step %s" % op.last_step())
+    else:
+        rdb_snap_name, replay = rdb.get_snap_info(snap_name)
+        if rdb_snap_name:
+            script_log("Duplicate request")
+            print (snap_name)
+            return
     wwnid = convert_serial(serial)
     # Run proxy backup on this snapshot if its category matches
     # protected snapshot category
     if category == protect_category:
         # Un-mount the previously mounted cloned lun from proxy host
-        if unmount_proxy_backup(cdb, sdb, serial, proxy_host, datacenter, include_hosts, exclude_hosts) :
+        if op.step('unmount_proxy', unmount_proxy_backup, cdb, sdb, serial, proxy_host, datacenter, include_hosts, exclude_hosts):
             # Delete the cloned snapshot
-            delete_lun(cdb, sdb, rdb, server, system, serial)
+            op.step('delete_clone', delete_lun, cdb, sdb, rdb, server, system, serial)
             # Create a cloned snapshot lun form the snapshot
-            lun_serial = create_lun(cdb, sdb, rdb, server, system, serial, snap_name, access_group)
+            lun_serial = op.step('create_clone', create_lun, cdb, sdb, rdb, server, system, serial, snap_name, access_group)
             # Mount the snapshot on the proxy host
-            mount_proxy_backup(cdb, sdb, lun_serial, snap_name,
-                               access_group, proxy_host, datacenter,
-                               include_hosts, exclude_hosts)
+            op.step('mount_proxy', mount_proxy_backup, cdb, sdb, lun_serial, snap_name,
+                    access_group, proxy_host, datacenter,
+                    include_hosts, exclude_hosts)
+            op.finish()
             print (snap_name)
             return
+        # The unmount failed, take a plain snapshot
+        op.finish()
 
     # Else, either the snapshot is not protected
     # or the proxy unmount operation failed. In such a case
@@ -152,10 +159,11 @@ def create_snap(cdb, sdb, rdb, server, system, serial, snap_name,
     user, pwd = cdb.get_enc_info(server)
 
     out, err, status = hpeva_api.hp_sssu(server, system, user, pwd).run_sssu(command)
+    idb.invalidate('%s/%s' % (server, system))
     if status != 0:
         print ("Failed to create snapshot " + str(err))
         sys.exit(1)
-    rdb.insert_snap_info(snap_name, vdisk_snapname)
+    rdb.insert_snap_info(snap_name, vdisk_snapname, serial)
     print (snap_name)
     sys.exit(0)
 
@@ -204,6 +212,7 @@ def remove_snap(cdb, sdb, rdb, server, system, serial, snap_name, proxy_host,
     command = 'DELETE VDISK "%s" ' % vdisk_snapname
     user, pwd = cdb.get_enc_info(server)
     out, err, status = hpeva_api.hp_sssu(server, system, user, pwd).run_sssu(command)
+    idb.invalidate('%s/%s' % (server, system))
     if status != 0:
         print ("Snapshot delete operation failed " + str(err))
         sys.exit(1)
@@ -248,6 +257,7 @@ def create_lun(cdb, sdb, rdb, server, system, serial,  snap_name, accessgroup):
     command = 'ADD SNAPSHOT %s VDISK="%s" ALLOCATION_POLICY=DEMAND' % (vdisk_snapname, vdisk_path)
     user, pwd = cdb.get_enc_info(server)
     out, err, status = hpeva_api.hp_sssu(server, system, user, pwd).run_sssu(command)
+    idb.invalidate('%s/%s' % (server, system))
     if status != 0:
         print ("Failed to create snapshot " + str(err))
         sys.exit(1)
@@ -255,7 +265,7 @@ def create_lun(cdb, sdb, rdb, server, system, serial,  snap_name, accessgroup):
     # Wait until Snap is created
     command = "WAIT_UNTIL VDISK %s GOOD" % vdisk_snapname
     hpeva_api.hp_sssu(server, system, user, pwd).run_sssu(command)
-    rdb.insert_snap_info(snap_name, vdisk_snapname)
+    rdb.insert_snap_info(snap_name, vdisk_snapname, serial)
 
     #Get parent Disk LUN number
     command = "ls vdisk %s" % vdisk_path
@@ -299,8 +309,10 @@ def create_lun(cdb, sdb, rdb, server, system, serial,  snap_name, accessgroup):
     # the script must find out which cloned lun needs to me un-mapped.
     script_log('Inserting serial: %s, cloned_lun_serial: %s, snap_name: %s, group: %s' %\
                (serial, lun_serial, snap_name, accessgroup))
-    sdb.insert_clone_info(serial, lun_serial, snap_name, accessgroup)
-    rdb.insert_snap_info(snap_name, vdisk_snapname)
+    # Roll back both records if either insert fails
+    with script_db.transaction(sdb, rdb):
+        sdb.insert_clone_info(serial, lun_serial, snap_name, accessgroup)
+        rdb.insert_snap_info(snap_name, vdisk_snapname, serial)
     return lun_serial
 
 
@@ -564,8 +576,13 @@ def get_vdisk_name(server, system, wwnid):
     system : HP EVA Storage System Name
     wwnid : lun wwn id
 
-    returns vdisk path
+    returns vdisk path, served from the inventory cache when it is
+    there so a lookup does not start sssu
     '''
+    array = '%s/%s' % (server, system)
+    vdisk_name = idb.get(array, 'vdisk', wwnid)
+    if vdisk_name is not None:
+        return vdisk_name
     command = "find vdisk lunwwid=%s" % wwnid
     user, pwd = cdb.get_enc_info(server)
     objects, err, status = hpeva_api.hp_sssu(server, system, user, pwd).run_sssu(command)
@@ -574,27 +591,29 @@ def get_vdisk_name(server, system, wwnid):
     vdisk_name = ""
     for i in objects:
         vdisk_name = i['familyname']
+    if vdisk_name:
+        idb.put(array, 'vdisk', wwnid, vdisk_name)
     return vdisk_name
 
-def main():
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
     set_logger()
-    script_log("Running script with args: %s" % str(sys.argv))
-    options, argsleft = get_option_parser().parse_args()
+    script_log("Running script with args: %s" % str(argv))
+    options, argsleft = get_option_parser().parse_args(argv)
 
     # Set the working dir prefix
     set_script_path(options.work_dir)
 
     # Credentials db must be initialized by running the setup.py file in the root
-    global cdb
-    cdb = script_db.CredDB(options.work_dir + CRED_DB)
-
-    # Initialize the script database
-    sdb = script_db.ScriptDB(options.work_dir + SCRIPT_DB)
-    sdb.setup()
-
-    # Create snap to replay mapping database
-    rdb = script_db.SnapToReplayDB(options.work_dir + SNAP_DB)
-    rdb.setup()
+    # All handoff state is kept in one store, opened on first use
+    store = lazy.lazy_open(script_db.StateStore, options.work_dir,
+                           array=options.array, issue_time=options.issue_time)
+    global cdb, idb
+    cdb = lazy.LazyAttribute(store, 'creds')
+    sdb = lazy.LazyAttribute(store, 'clones')
+    rdb = lazy.LazyAttribute(store, 'snaps')
+    idb = lazy.LazyAttribute(store, 'inventory')
 
     # Setup server/lun info
     conn = options.array
@@ -614,14 +633,10 @@ def main():
                     options.exclude_hosts)
     else:
         print ('Invalid operation: %s' % str(options.operation))
-        cdb.close()
-        sdb.close()
-        rdb.close()
+        store.close()
         sys.exit(errno.EINVAL)
 
-    sdb.close()
-    cdb.close()
-    rdb.close()
+    store.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -38,19 +38,19 @@ import string
 import random
 import logging
 
-# Script DB is used to store/load the cloned lun
-# information and the credentials
-import script_db
-
 # For setting up PATH
 import os
 
+# Heavy modules and the databases are loaded on first use
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
+from src import http_transport
+from src import lazy
+from src import script_db
+
 import time
 import re
-import requests
-requests.packages.urllib3.disable_warnings()
-import hashlib
-from lxml import etree
+hashlib = lazy.lazy_import('hashlib')
+etree = lazy.lazy_import('lxml.etree')
 
 # Paths for VADP scripts
 PERL_EXE = r'"C:\Program Files (x86)\VMware\VMware vSphere CLI\Perl\bin\perl.exe" '
@@ -61,6 +61,9 @@ HANDOFF_LOG_FILE = WORK_DIR + r'\handoff.txt'
 
 # Generic paramaters
 REQUEST_TIMEOUT = 600
+# Seconds an MSA session key is reused by the handoff service, below the
+# array's default session timeout of 30 minutes
+SESSION_TTL = 600
 # Per KB: https://kb.vmware.com/selfservice/microsites/search.do?language=en_US&cmd=displayKC&externalId=1003955
 MAX_ESX_LUN_ID = 254
 
@@ -69,6 +72,12 @@ MAX_ESX_LUN_ID = 254
 # Set it to '0' to disable
 SKIP_VM_REGISTRATION = '1'
 
+_sessions = {}
+# (array, username, password) of the running request and whether its
+# session key was renewed after the array refused it
+session_key = None
+session_renewed = False
+
 def set_logger():
     logging.basicConfig(filename= HANDOFF_LOG_FILE, level=logging.DEBUG,
                         format='%(asctime)s : %(levelname)s: %(message)s',
@@ -93,6 +102,96 @@ def set_script_path(prefix):
     WORK_DIR = prefix
 
 
+def msa_get(url):
+    '''
+    Runs an API command and returns the reply, logging its size so the
+    cost of each command is visible
+    '''
+    reply = http_transport.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    if session_refused(reply) and renew_session_key():
+        reply = http_transport.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    script_log(url[len(base_url):] + " returned " + str(len(reply.content)) + " bytes")
+    return reply
+
+def session_refused(reply):
+    '''
+    Returns True if the array refused the session key of the request,
+    e.g. after a controller restart or a session timeout
+    '''
+    if reply.status_code in (401, 403):
+        return True
+    # Only replies mentioning the session are parsed
+    if b'session' not in reply.content.lower():
+        return False
+    try:
+        obj = etree.XML(reply.content)
+    except etree.XMLSyntaxError:
+        return False
+    for status in obj.iter("OBJECT"):
+        if status.get("basetype") != "status":
+            continue
+        code = response = None
+        for prop in status.iter("PROPERTY"):
+            if prop.get("name") == "return-code":
+                code = prop.text
+            elif prop.get("name") == "response":
+                response = prop.text or ''
+        return code != "0" and 'session' in (response or '').lower()
+    return False
+
+def login(array, username, password):
+    '''
+    Logs in to the MSA and returns the session key, None if the login
+    failed. The key is kept for SESSION_TTL seconds and reused by the
+    following requests while the driver stays loaded in the handoff service.
+    '''
+    key = (array, username, password)
+    if key in _sessions and time.time() - _sessions[key][1] < SESSION_TTL:
+        script_log('Reusing MSA session key.')
+        return _sessions[key][0]
+    login_string = "{0}_{1}".format(username, password)
+    login_hash = hashlib.md5(login_string.encode('utf-8')).hexdigest()
+    url_login = 'https://' + array + '/api' + "/login/{0}".format(login_hash)
+    req_login = http_transport.get(url_login, timeout=REQUEST_TIMEOUT)
+    sessionKey = None
+    obj = etree.XML(req_login.text.encode('utf-8')).find("OBJECT")
+    #assert_response_ok(obj)
+    for prop in obj.iter("PROPERTY"):
+        if prop.get("name") == "response":
+            sessionKey = prop.text
+            break
+    if sessionKey is not None:
+        _sessions[key] = (sessionKey, time.time())
+    return sessionKey
+
+def renew_session_key():
+    '''
+    Drops the session key the array refused and logs in again, once per
+    request. Returns False if it was renewed already or the login failed.
+    '''
+    global session_renewed
+    if session_renewed or session_key is None:
+        return False
+    session_renewed = True
+    script_log('MSA refused the session key, logging in again.')
+    _sessions.pop(session_key, None)
+    sessionKey = login(*session_key)
+    if sessionKey is None:
+        return False
+    headers['sessionKey'] = sessionKey
+    return True
+
+def response_code(obj):
+    '''
+    Returns the return code of the XML reply, None if it has no status
+    '''
+    for obj in obj.iter():
+        if obj.get("basetype") == "status":
+            for prop in obj.iter("PROPERTY"):
+                if prop.get("name") == "return-code":
+                    return prop.text
+    return None
+
 def assert_response_ok(obj):
     """Parses the XML returned by the device to check the return code.
     Raises an error if the return code is not 0.
@@ -130,28 +229,9 @@ def check_lun(conn, serial):
     '''
     script_log('just getting a handle on the LUN.')
 
-    requestvolumes = base_url + "/show/volume-names"
-    volumes = requests.get(requestvolumes, verify=False, headers=headers, timeout=REQUEST_TIMEOUT)
-    obj = etree.XML(volumes.text.encode('utf-8'))
-    assert_response_ok(obj)
-    #script_log(volumes.text.encode('utf-8'))
-    breakloop = False
-    for obj in obj.iter():
-        if breakloop:
-            break
-        for prop in obj.iter("PROPERTY"):
-            prop_name = prop.get("name")
-            if prop_name == "volume-name":
-                volume = prop.text
-            if prop_name == "serial-number":
-                lunserial = prop.text
-                if lunserial == serial:
-                    volname = volume
-                    script_log('Volume for LUN ' + serial + " is " + volname + '.\n')
-                    breakloop = True
-                    break
-                else:
-                    volname = ''
+    volname = find_volume(conn, serial)
+    if volname:
+        script_log('Volume for LUN ' + serial + " is " + volname + '.\n')
     #If the name doesn't exist, will need to error with LUN serial not found.
     if volname == '':
         script_log("Unable to find LUN.")
@@ -160,6 +240,78 @@ def check_lun(conn, serial):
         script_log ("OK\n")
     sys.exit(0)
 
+def list_volumes(server, volume_names=None):
+    '''
+    Lists the volumes of the array and merges them into its inventory
+    cache, only the volumes which changed since the last listing are written
+
+    server : hostname/ip address
+    volume_names : list only these volumes, names or serial numbers, e.g.
+                   a snapshot just created
+
+    Returns (volume name, serial number) pairs
+    '''
+    requestvolumes = base_url + "/show/volume-names"
+    if volume_names:
+        requestvolumes += "/" + ",".join(volume_names)
+    volumes = msa_get(requestvolumes)
+    obj = etree.XML(volumes.text.encode('utf-8'))
+    if volume_names and response_code(obj) != "0":
+        # No such volume, or firmware which does not take serial numbers
+        return []
+    assert_response_ok(obj)
+    pairs = []
+    volume = None
+    for prop in obj.iter("PROPERTY"):
+        prop_name = prop.get("name")
+        if prop_name == "volume-name":
+            volume = prop.text
+        elif prop_name == "serial-number":
+            pairs.append((volume, prop.text))
+    changed, dropped = idb.sync(server, 'volume',
+                                dict((lunserial, volume) for volume, lunserial in pairs),
+                                complete=not volume_names)
+    script_log("Volume listing merged, %d changed, %d gone\n" % (changed, dropped))
+    return pairs
+
+def find_volume(server, serial):
+    '''
+    Returns the name of the volume with the lun serial, '' if there is none.
+    Served from the inventory cache, on a miss the array is asked for the
+    volume by serial number and listed if that finds nothing.
+    '''
+    volname = idb.get(server, 'volume', serial)
+    if volname is not None:
+        return volname
+    for volume, lunserial in list_volumes(server, [serial]):
+        if lunserial == serial:
+            return volume
+    for volume, lunserial in list_volumes(server):
+        if lunserial == serial:
+            return volume
+    return ''
+
+def get_volume_lun(volname):
+    '''
+    Returns the LUN number the volume is mapped with, '' if it is not
+    mapped or the firmware can not show the maps of one volume
+    '''
+    maps = msa_get(base_url + "/show/volume-maps/" + volname)
+    obj = etree.XML(maps.text.encode('utf-8'))
+    if response_code(obj) != "0":
+        return ''
+    for object in obj.iter('OBJECT'):
+        if object.get("basetype") != "volume-view-mappings":
+            continue
+        access = object.find('PROPERTY[@name="access"]')
+        lunid = object.find('PROPERTY[@name="lun"]')
+        if access is not None and access.text == "not-mapped":
+            continue
+        if lunid is not None and lunid.text:
+            script_log('Parent LUN id: ' + lunid.text)
+            return lunid.text
+    return ''
+
 def create_snap(cdb, sdb, rdb, server, serial, snap_name,
                 access_group, proxy_host, datacenter,
                 include_hosts, exclude_hosts,
@@ -193,53 +345,42 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
     # if Granite Core Crashes or the Handoff host itself crashed
     script_log('Starting create_snap')
 
-    rdb_snap_name, array_volname = rdb.get_snap_info(snap_name)
-    if rdb_snap_name:
-        script_log("Duplicate request")
-        print (snap_name)
-        return
+    # A proxy backup of this request that did not finish resumes after
+    # its last completed step, its snapshot is already recorded
+    op = sdb.begin_operation('CREATE_SNAP', server, serial, snap_name)
+    if op.resuming() and category == protect_category:
+        script_log("Resuming proxy backup after step %s" % op.last_step())
+    else:
+        rdb_snap_name, array_volname = rdb.get_snap_info(snap_name)
+        if rdb_snap_name:
+            script_log("Duplicate request")
+            print (snap_name)
+            return
 
     # Run proxy backup on this snapshot if its category matches
     # protected snapshot category
 
     if category == protect_category:
         # Un-mount the previously mounted cloned lun from proxy host
-        if unmount_proxy_backup(cdb, sdb, serial, proxy_host, datacenter, include_hosts, exclude_hosts) :
+        if op.step('unmount_proxy', unmount_proxy_backup, cdb, sdb, serial, proxy_host, datacenter, include_hosts, exclude_hosts):
             # Delete the cloned snapshot
-            unmap_cloned_lun(cdb, sdb, server, serial)
+            op.step('delete_clone', unmap_cloned_lun, cdb, sdb, server, serial)
             # Create a cloned snapshot lun form the snapshot
-            cloned_lun_serial = create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, access_group)
+            cloned_lun_serial = op.step('create_clone', create_snap_clone, cdb, sdb, rdb, server, serial, snap_name, access_group)
             # Mount the snapshot on the proxy host
-            mount_proxy_backup(cdb, sdb, cloned_lun_serial, serial,
-                               access_group, proxy_host, datacenter,
-                               include_hosts, exclude_hosts)
+            op.step('mount_proxy', mount_proxy_backup, cdb, sdb, cloned_lun_serial, serial,
+                    access_group, proxy_host, datacenter,
+                    include_hosts, exclude_hosts)
+            op.finish()
             print (snap_name)
             return
+        # The unmount failed, take a plain snapshot
+        op.finish()
 
     # Creating a snapshot and no backup
-    requestvolumes = base_url + "/show/volume-names"
-    volumes = requests.get(requestvolumes, verify=False, headers=headers, timeout=REQUEST_TIMEOUT)
-    obj = etree.XML(volumes.text.encode('utf-8'))
-    assert_response_ok(obj)
-
-    breakloop = False
-    volname = ''
-    for obj in obj.iter():
-        if breakloop:
-            break
-        for prop in obj.iter("PROPERTY"):
-            prop_name = prop.get("name")
-            if prop_name == "volume-name":
-                volume = prop.text
-            if prop_name == "serial-number":
-                lunserial = prop.text
-                if lunserial == serial:
-                    volname = volume
-                    script_log("Creating snapshot with volume: " + volname + '.\n')
-                    breakloop = True
-                    break
-                else:
-                    volname = ''
+    volname = find_volume(server, serial)
+    if volname:
+        script_log("Creating snapshot with volume: " + volname + '.\n')
     #If the name doesn't exist, will need to error with LUN serial not found.
     if volname == '':
         script_log("Unable to find LUN.")
@@ -251,12 +392,12 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
 
     array_volname = "rvbd_" + snap_name[0:15]
     createsnapshot = base_url + "/create/snapshots" + "/" + "volumes/" + volname + "/" + array_volname
-    createsnap = requests.get(createsnapshot, verify=False, headers=headers, timeout=REQUEST_TIMEOUT)
+    createsnap = msa_get(createsnapshot)
     obj = etree.XML(createsnap.text.encode('utf-8')).find("OBJECT")
     assert_response_ok(obj)
 
     #putting the info into the database so we know what to remove when we want to.
-    rdb.insert_snap_info(snap_name, array_volname)
+    rdb.insert_snap_info(snap_name, array_volname, serial)
     print (snap_name)
     return
 
@@ -306,9 +447,10 @@ def remove_snap(cdb, sdb, rdb, server, serial, snap_name, proxy_host,
     if array_volname :
         script_log("The Array Volume name is " + array_volname + "\n.")
         deletesnapshot = base_url + "/delete/snapshot" + "/" + "cleanup" + "/" + array_volname
-        deletesnap = requests.get(deletesnapshot, verify=False, headers=headers, timeout=REQUEST_TIMEOUT)
+        deletesnap = msa_get(deletesnapshot)
+        idb.drop(server, 'volume', array_volname)
         script_log (array_volname + " snapshot removed\n")
-        rdb.delete_clone_info(snap_name)
+        rdb.delete_snap_info(snap_name)
         sys.exit(0)
     else:
         script_log("No array volume to delete.")
@@ -330,26 +472,9 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
     '''
     script_log('Starting create_snap_clone')
 
-    requestvolumes = base_url + "/show/volume-names"
-    volumes = requests.get(requestvolumes, verify=False, headers=headers, timeout=REQUEST_TIMEOUT)
-    obj = etree.XML(volumes.text.encode('utf-8'))
-
-    breakloop = False
-    volname = ''
-    for obj in obj.iter():
-        if breakloop:
-            break
-        for prop in obj.iter("PROPERTY"):
-            prop_name = prop.get("name")
-            if prop_name == "volume-name":
-                volume = prop.text
-            if prop_name == "serial-number":
-                lunserial = prop.text
-                if lunserial == serial:
-                    volname = volume
-                    script_log("Creating snapshot with volume: " + volname + '.\n')
-                    breakloop = True
-                    break
+    volname = find_volume(server, serial)
+    if volname:
+        script_log("Creating snapshot with volume: " + volname + '.\n')
 
     #If the name doesn't exist, will need to error with LUN serial not found.
 
@@ -366,7 +491,7 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
     # need to put in the , snap_name, volumes=volume_name)
 
     createsnapshot = base_url + "/create/snapshots" + "/" + "volumes/" + volname + "/" + array_volname
-    createsnap = requests.get(createsnapshot, verify=False, headers=headers, timeout=REQUEST_TIMEOUT)
+    createsnap = msa_get(createsnapshot)
     obj = etree.XML(createsnap.text.encode('utf-8')).find("OBJECT")
     # script_log('SreateSnap Returned object: ' + createsnap.text.encode('utf-8'))
     assert_response_ok(obj)
@@ -374,43 +499,45 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
     #time.sleep(1)
 
     #Check snapshot status:
-    gettask = base_url + "/show/snapshots"
-    snaps = requests.get(gettask, verify=False, headers=headers, timeout=REQUEST_TIMEOUT)
+    gettask = base_url + "/show/snapshots/" + array_volname
+    snaps = msa_get(gettask)
     obj = etree.XML(snaps.text.encode('utf-8')).find("OBJECT")
     # script_log('ShowSnapshots Returned object: ' + tasks.text.encode('utf-8'))
     # assert_response_ok(obj)
 
     #putting the info into the database so we know what to remove when we want to.
-    rdb.insert_snap_info(snap_name, array_volname)
+    rdb.insert_snap_info(snap_name, array_volname, serial)
 
     #Assign initiator to snapshot.
     #CLI would be: map volume access read-write host 50014380029baa82 lun 99 rvbd_test1
 
-    # Get parent volume LUN number.
-    getVLUN = base_url + "/show/host-maps"
-    tree = requests.get(getVLUN, verify=False, headers=headers, timeout=REQUEST_TIMEOUT)
-
-    obj = etree.XML(tree.text.encode('utf-8'))
-    parentLUN = ''
-    for object in obj.iter('OBJECT'):
-        foundLUN=False
-        for volumeName in object.iterfind('PROPERTY[@name="volume-name"]'):
-            # script_log('volume-name: ' + volumeName.text)
-            if volumeName.text == volname:
-                foundLUN=True
-        if foundLUN:
-            for lunid in object.iterfind('PROPERTY[@name="lun"]'):
-                parentLUN = lunid.text
-                script_log('Parent LUN id: ' + parentLUN)
+    # Get parent volume LUN number, from the maps of the parent volume only.
+    parentLUN = get_volume_lun(volname)
+    if parentLUN == '':
+        # All host maps are needed to pick a free LUN number anyway
+        getVLUN = base_url + "/show/host-maps"
+        tree = msa_get(getVLUN)
+
+        obj = etree.XML(tree.text.encode('utf-8'))
+        for object in obj.iter('OBJECT'):
+            foundLUN=False
+            for volumeName in object.iterfind('PROPERTY[@name="volume-name"]'):
+                # script_log('volume-name: ' + volumeName.text)
+                if volumeName.text == volname:
+                    foundLUN=True
+            if foundLUN:
+                for lunid in object.iterfind('PROPERTY[@name="lun"]'):
+                    parentLUN = lunid.text
+                    script_log('Parent LUN id: ' + parentLUN)
+                    break
                 break
-            break
 
     # Generate random LUN # if parent volume is not mapped.
     # Random LUN id also prevents same LUN id being assigned to concurrent snapshot requests
     if parentLUN == '':
         script_log("Unable to find parent volume LUN number. This may be due to Parent LUN not mapped for SteelFusion Core. Proceeding with random LUN number.")
         # sys.exit(1)
-        luns = range(1, MAX_ESX_LUN_ID)
+        luns = list(range(1, MAX_ESX_LUN_ID))
         for obj in obj.iter():
             if obj.get("basetype") != "host-view-mappings":
                 continue
@@ -428,7 +555,7 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
     mapLUN = base_url + "/map/volume/access/read-write/host/" + accessgroup + "/lun/" + parentLUN + "/" + array_volname
     script_log('mapping LUN with url: '+ mapLUN)
 
-    assignmapping = requests.get(mapLUN, verify=False, headers=headers, timeout=REQUEST_TIMEOUT)
+    assignmapping = msa_get(mapLUN)
     obj = etree.XML(assignmapping.text.encode('utf-8')).find("OBJECT")
     assert_response_ok(obj)
     #time.sleep(5)
@@ -436,28 +563,12 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
     script_log('Assigned mapping on MSA to ' + accessgroup + '.')
 
     #Getting the LUN serial number from the cloned LUN:
-    requestvolumes = base_url + "/show/volume-names"
-    volumes = requests.get(requestvolumes, verify=False, headers=headers, timeout=REQUEST_TIMEOUT)
-    obj = etree.XML(volumes.text.encode('utf-8'))
-    assert_response_ok(obj)
-
-    breakloop = False
-    lunserial == ''
-    for obj in obj.iter():
-        if breakloop:
+    lunserial = ''
+    for volume, volume_serial in list_volumes(server, [array_volname]):
+        if volume == array_volname:
+            lunserial = volume_serial
+            script_log("Serial Number for cloned LUN is: " + lunserial + '.\n')
             break
-        for prop in obj.iter("PROPERTY"):
-            prop_name = prop.get("name")
-            if prop_name == "volume-name":
-                volume = prop.text
-            if prop_name == "serial-number":
-                lunserial = prop.text
-                if volume == array_volname:
-                    script_log("Serial Number for cloned LUN is: " + lunserial + '.\n')
-                    breakloop = True
-                    break
-                else:
-                    volname = ''
     #If the name doesn't exist, will need to error with LUN serial not found.
     if lunserial == '':
         script_log("Unable to find LUN.")
@@ -473,7 +584,6 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
     script_log('Inserting serial: %s, cloned_lun_serial: %s, snap_name: %s, group: %s' %\
                (serial, cloned_lun_serial, snap_name, accessgroup))
     sdb.insert_clone_info(serial, cloned_lun_serial, snap_name, accessgroup)
-    rdb.insert_snap_info(snap_name, volname)
     #script_log("Index is:" + str(index))
     return cloned_lun_serial
 
@@ -505,12 +615,12 @@ def unmap_cloned_lun(cdb, sdb, server, lun_serial):
     array_volname = 'rvbd_' + snap_name[0:15]
     unmap = base_url + "/unmap/volume" + "/" + "host" + "/" + group + "/" + array_volname
     try:
-        unmap_lun = requests.get(unmap, verify=False, headers=headers, timeout=REQUEST_TIMEOUT)
+        unmap_lun = msa_get(unmap)
         # obj = etree.XML(deletesnap.text.encode('utf-8')).find("OBJECT")
     except Exception:
         pass
     script_log ("Snapshot " + array_volname + " unmapped from " + group + "\n")
-    #rdb.delete_clone_info(snap_name)
+    #rdb.delete_snap_info(snap_name)
     sdb.delete_clone_info(lun_serial)
 
     script_log("Cloned lun %s unmapped successfully" % clone_serial)
@@ -688,24 +798,25 @@ def get_option_parser():
     return parser
 
 
-if __name__ == '__main__':
+def main(argv=None):
+    global base_url, headers, idb, session_key, session_renewed
+    if argv is None:
+        argv = sys.argv[1:]
     set_logger()
-    script_log("Running script with args: %s" % str(sys.argv))
-    options, argsleft = get_option_parser().parse_args()
+    script_log("Running script with args: %s" % str(argv))
+    options, argsleft = get_option_parser().parse_args(argv)
 
     # Set the working dir prefix
     set_script_path(options.work_dir)
 
     # Credentials db must be initialized using the cred_mgmt.py file
-    cdb = script_db.CredDB(options.work_dir + r'\cred_db')
-
-    # Initialize the script database
-    sdb = script_db.ScriptDB(options.work_dir + r'\script_db')
-    sdb.setup()
-
-    # Create snap to replay mapping database
-    rdb = script_db.SnapToReplayDB(options.work_dir + r'\replay_db')
-    rdb.setup()
+    # All handoff state is kept in one store, opened on first use
+    store = lazy.lazy_open(script_db.StateStore, options.work_dir,
+                           array=options.array, issue_time=options.issue_time)
+    cdb = lazy.LazyAttribute(store, 'creds')
+    sdb = lazy.LazyAttribute(store, 'clones')
+    rdb = lazy.LazyAttribute(store, 'snaps')
+    idb = lazy.LazyAttribute(store, 'inventory')
 
     # Setup server/lun info
     conn = options.array
@@ -718,21 +829,11 @@ if __name__ == '__main__':
     # Get credentials for the proxy host
     username, password = cdb.get_enc_info(array)
 
-    def create_login_hash(username, password):
-        login_string = "{0}_{1}".format(username, password)
-        return hashlib.md5(login_string).hexdigest()
     base_url = 'https://' + array + '/api'
     # base_url = 'http://' + array + '/api'
-    login_hash = create_login_hash(username, password)
-    url_login = base_url + "/login/{0}".format(login_hash)
-    req_login = requests.get(url_login, verify=False)
-    sessionKey = None
-    obj = etree.XML(req_login.text.encode('utf-8')).find("OBJECT")
-    #assert_response_ok(obj)
-    for prop in obj.iter("PROPERTY"):
-        if prop.get("name") == "response":
-            sessionKey = prop.text
-            break
+    session_key = (array, username, password)
+    session_renewed = False
+    sessionKey = login(array, username, password)
     headers = {'datatype': 'api', 'sessionKey': sessionKey}
     if sessionKey is not None:
         script_log('Successfully logged into MSA array.')
@@ -755,11 +856,10 @@ if __name__ == '__main__':
                     options.exclude_hosts)
     else:
         print ('Invalid operation: %s' % str(options.operation))
-        cdb.close()
-        sdb.close()
-        rdb.close()
+        store.close()
         sys.exit(errno.EINVAL)
 
-    sdb.close()
-    cdb.close()
-    rdb.close()
+    store.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+###############################################################################
+# HP MSA driver capabilities, see src/registry.py
+###############################################################################
+CAPABILITIES = {
+    'proxy_backup': True,
+    'session_reuse': True,
+}
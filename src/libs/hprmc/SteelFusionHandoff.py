@@ -34,19 +34,18 @@ import os
 # Script DB is used to store/load the cloned lun
 # information and the credentials
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
+from src import http_transport
+from src import json_stream
 from src import script_db
+from src import lazy
 
 import logging
 
 import re
-import requests
-requests.packages.urllib3.disable_warnings()
 import json
+import urllib.parse
 
 # Configuration defaults
-CRED_DB = r'\var\cred.db'
-SCRIPT_DB = r'\var\script.db'
-SNAP_DB = r'\var\replay.db'
 WORK_DIR =  r'C:\rvbd_handoff_scripts'
 HANDOFF_LOG_FILE = r'\log\handoff.log'
 
@@ -58,6 +57,18 @@ REMOVE_BACKUP = '0'
 # The default behavior is to REMOVE the backup.
 REMOVE_SNAPSHOT = '1'
 
+# Seconds an RMC login token is reused by the handoff service
+SESSION_TTL = 600
+# Filter narrowing a collection to the members with a field value, sent
+# URL-encoded as ?filter=..., set to '' for RMC versions which do not
+# filter collections
+COLLECTION_FILTER = '%s eq "%s"'
+_sessions = {}
+# (array, username, password) of the running request and whether its
+# token was renewed after RMC refused it
+session_key = None
+session_renewed = False
+
 
 
 def set_logger():
@@ -83,29 +94,133 @@ def set_script_path(prefix):
     global WORK_DIR
     WORK_DIR = prefix
 
+def hprmchost_send (method, url, headers, **kwargs):
+    '''
+    Sends a request to HP RMC. If RMC refuses the session token, e.g.
+    after a restart, the token is dropped and the request is sent once
+    more after a new login.
+    '''
+    response = http_transport.request(method, url, headers=headers, **kwargs)
+    if response.status_code == 401 and 'X-Auth-Token' in headers and renew_session_token(headers):
+        response.close()
+        response = http_transport.request(method, url, headers=headers, **kwargs)
+    return response
+
 # Defining a function to do posts against HP RMC
 def hprmchost_call (hprmchost, info, headers, function):
     url_prefix = "https://" + hprmchost + '/rest/rm-central/v1/'
     url = (url_prefix + function + parameters)
-    return requests.post(url,verify=False, data=json.dumps(info), headers=headers)
+    return hprmchost_send('POST', url, headers, data=json.dumps(info))
 
 # Defining a function to do gets against HP RMC
-def hprmchost_get (hprmchost, headers, function):
+def hprmchost_get (hprmchost, headers, function, stream=False):
     url_prefix = "https://" + hprmchost + '/rest/rm-central/v1/'
     url = (url_prefix + function + parameters)
-    return requests.get(url,verify=False, headers=headers)
+    response = hprmchost_send('GET', url, headers, stream=stream)
+    # A streamed reply is logged once it is read, see size_logger()
+    if not stream:
+        script_log("GET " + function + " returned " + str(len(response.content)) + " bytes\n")
+    return response
+
+def size_logger (function):
+    '''
+    Returns the json_stream.iter_response() callback logging the bytes
+    read from a streamed GET
+    '''
+    def done(size):
+        script_log("GET " + function + " returned " + str(size) + " bytes\n")
+    return done
+
+def hprmchost_stream (hprmchost, headers, function, collection, field=None, value=None):
+    '''
+    Returns an iterator over the members of a collection, e.g. the
+    snapshotSets of snapshot-sets, decoded one member at a time as the
+    reply arrives. Given a field and value, the RMC is asked for the
+    matching members only; the whole collection is fetched if the RMC
+    refuses the filter, so the caller checks each member with
+    member_matches().
+    '''
+    response = None
+    if field and COLLECTION_FILTER:
+        path = function + '?filter=' + urllib.parse.quote(COLLECTION_FILTER % (field, value), safe='')
+        response = hprmchost_get (hprmchost, headers, path, stream=True)
+        if response.status_code != 200:
+            script_log ("Filtered " + function + " request refused, getting all of them\n")
+            response.close()
+            response = None
+    if response is None:
+        path = function
+        response = hprmchost_get (hprmchost, headers, path, stream=True)
+    return json_stream.iter_response(response, collection, size_logger(path))
+
+def member_matches (member, field, value):
+    return str(member.get(field)).strip("'[]") == value
+
+def hprmchost_list (hprmchost, headers, function, collection, field=None, value=None):
+    '''
+    Returns the members of a collection, only the ones matching when given
+    a field and value. Long snapshot and backup histories are never held
+    at once, see hprmchost_stream().
+    '''
+    members = []
+    for member in hprmchost_stream (hprmchost, headers, function, collection, field, value):
+        if not field or member_matches(member, field, value):
+            members.append(member)
+    return members
+
+def hprmchost_find (hprmchost, headers, function, collection, field, value):
+    '''
+    Returns the first member of a collection matching the field and value,
+    None if there is none. The rest of the reply is not read.
+    '''
+    members = hprmchost_stream (hprmchost, headers, function, collection, field, value)
+    return json_stream.find_item(members, lambda member: member_matches(member, field, value))
 
 # Defining a function to do gets against HP RMC
 def hprmchost_gettask (hprmchost, headers, function):
     url_prefix = "https://" + hprmchost
     url = (url_prefix + function + parameters)
-    return requests.get(url,verify=False, headers=headers)
+    return hprmchost_send('GET', url, headers)
 
 # Defining a function to do gets against HP RMC
 def hprmchost_del (hprmchost, headers, function, parameters):
     url_prefix = "https://" + hprmchost + '/rest/rm-central/v1/'
     url = (url_prefix + function + "/" + parameters)
-    return requests.delete(url,verify=False, headers=headers)
+    return hprmchost_send('DELETE', url, headers)
+
+def get_session_token(array, username, password):
+    '''
+    Logs in to HP RMC and returns the session token. The token is kept
+    for SESSION_TTL seconds and reused by the following requests while
+    the driver stays loaded in the handoff service.
+    '''
+    key = (array, username, password)
+    if key in _sessions and time.time() - _sessions[key][1] < SESSION_TTL:
+        script_log("Reusing RMC session token\n")
+        return _sessions[key][0]
+    creds = {'auth': {'passwordCredentials': {'username': username, 'password': password}}}
+    headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
+    auth = hprmchost_call (array, creds, headers, "login-sessions")
+    script_log (auth.text)
+    token = auth.json()
+    token = token["loginSession"]["access"]["token"]["id"]
+    script_log  ("Authenticated with RMC with token " + token + "\n")
+    _sessions[key] = (token, time.time())
+    return token
+
+def renew_session_token(headers):
+    '''
+    Drops the session token RMC refused and puts a new one in headers,
+    once per request. Returns False if it was renewed already.
+    '''
+    global session_renewed
+    if session_renewed or session_key is None:
+        return False
+    session_renewed = True
+    script_log ("RMC refused the session token, logging in again\n")
+    _sessions.pop(session_key, None)
+    headers['X-Auth-Token'] = get_session_token(*session_key)
+    return True
 
 def check_lun(conn, serial):
     '''
@@ -128,11 +243,10 @@ def check_lun(conn, serial):
     9-251b-45b4-a8d4-6f8979ebb36e", "id": "ddc3476c-acf7-4261-9115-d0dd64df2695", "c
     reatedAt": "2015-04-29T06:10:43.415731Z", "name": "jdoe1234"}]}'
     '''
-    getrecoverysets = hprmchost_get (array, headers, "recovery-sets")
-    getrecoverysets = getrecoverysets.json()
+    getrecoverysets = hprmchost_list (array, headers, "recovery-sets", 'recoverySets')
     # Using counter to show number of RecoverySets found.
     counter = 0
-    for recoveryset in getrecoverysets['recoverySets']:
+    for recoveryset in getrecoverysets:
         wwn = str(recoveryset.get('wwnlist')).strip("'[]")
         recoverysetid = str(recoveryset.get('id'))
         if serial in wwn :
@@ -251,11 +365,10 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
 
     # SnapshotSet is = ['task']['associatedResource']['resourceUri']
 
-    getrecoverysets = hprmchost_get (array, headers, "recovery-sets")
-    getrecoverysets = getrecoverysets.json()
+    getrecoverysets = hprmchost_list (array, headers, "recovery-sets", 'recoverySets')
     # Using counter to show successes.
     counter = 0
-    for recoveryset in getrecoverysets['recoverySets']:
+    for recoveryset in getrecoverysets:
         wwn = str(recoveryset.get('wwnlist')).strip("'[]")
         recoverysetid = str(recoveryset.get('id'))
 
@@ -286,7 +399,7 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
             time.sleep(10)
 
     counter = 0
-    for recoveryset in getrecoverysets['recoverySets']:
+    for recoveryset in getrecoverysets:
         wwn = str(recoveryset.get('wwnlist')).strip("'[]")
         recoverysetid = str(recoveryset.get('id'))
 
@@ -422,44 +535,39 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
                 # Run proxy backup on this snapshot if its category matches
                 # protected snapshot category
             if category == protect_category:
-                backuppolicyfound = False
                 if backuppolicy == "":
                     script_log("Please provide RMC Backup Policy Id with --backuppolicy")
                     sys.exit(1)
                 else:
                     script_log("Setting up Backup using policy: "+ backuppolicy + "\n")
-                    getbackuppolicies = hprmchost_get(array, headers, "backup-policies")
-                    getbackuppolicies = getbackuppolicies.json()
-                    for backupPolicy in getbackuppolicies['backupPolicies']:
-                        backuppolicyname = str(backupPolicy.get('name')).strip("'[]")
+                    backupPolicy = hprmchost_find(array, headers, "backup-policies", 'backupPolicies',
+                                                  'name', backuppolicy)
+                    if backupPolicy is not None:
                         backupPolicyId = str(backupPolicy.get('id')).strip("'[]")
-                        if backuppolicyname == backuppolicy :
-                            script_log ("Attaching Backup to " + backuppolicy + ".\n")
-                            if previoussnapshot == "":
-                                backupattrib = {"backupSet": {"name": snap_name, "description": "Riverbed backup", "snapshotSetId": snapshotset, "backupPolicyId":backupPolicyId }}
-                                script_log ("Creating Full backup.")
-                            else:
-                                backupattrib = {"backupSet": {"name": snap_name, "description": "Riverbed backup", "snapshotSetId": previoussnapshot, "backupPolicyId":backupPolicyId, "incremental":True }}
-                                script_log ("Creating Incremental backup.")
-                            script_log ("backupattrib is "+str(backupattrib)+" \n")
+                        script_log ("Attaching Backup to " + backuppolicy + ".\n")
+                        if previoussnapshot == "":
+                            backupattrib = {"backupSet": {"name": snap_name, "description": "Riverbed backup", "snapshotSetId": snapshotset, "backupPolicyId":backupPolicyId }}
+                            script_log ("Creating Full backup.")
+                        else:
+                            backupattrib = {"backupSet": {"name": snap_name, "description": "Riverbed backup", "snapshotSetId": previoussnapshot, "backupPolicyId":backupPolicyId, "incremental":True }}
+                            script_log ("Creating Incremental backup.")
+                        script_log ("backupattrib is "+str(backupattrib)+" \n")
+                        createbackup = hprmchost_call (array, backupattrib, headers, "backup-sets")
+                        script_log ("createbackup response is "+str(createbackup.text)+" \n")
+                        script_log ('Create Backup Status code: '+str(createbackup.status_code))
+                        if createbackup.status_code != int(202):
+                            backupattrib = {"backupSet": {"name": snap_name, "description": "Riverbed backup", "snapshotSetId": snapshotset, "backupPolicyId":backupPolicyId }}
+                            script_log ("Incremental Backup Failed. Creating Full backup.")
                             createbackup = hprmchost_call (array, backupattrib, headers, "backup-sets")
-                            script_log ("createbackup response is "+str(createbackup.text)+" \n")
-                            script_log ('Create Backup Status code: '+str(createbackup.status_code))
+                            createbackup2 = createbackup.json()
+                            script_log ("createbackup is "+str(createbackup2)+" \n")
+                            backuptaskfile = open(WORK_DIR + '\\var\\' + recoverysetid+'_backup.txt','w')
+                            backuptaskfile.write(createbackup2['taskUri'])
+                            backuptaskfile.close()
                             if createbackup.status_code != int(202):
-                                backupattrib = {"backupSet": {"name": snap_name, "description": "Riverbed backup", "snapshotSetId": snapshotset, "backupPolicyId":backupPolicyId }}
-                                script_log ("Incremental Backup Failed. Creating Full backup.")
-                                createbackup = hprmchost_call (array, backupattrib, headers, "backup-sets")
-                                createbackup2 = createbackup.json()
-                                script_log ("createbackup is "+str(createbackup2)+" \n")
-                                backuptaskfile = open(WORK_DIR + '\\var\\' + recoverysetid+'_backup.txt','w')
-                                backuptaskfile.write(createbackup2['taskUri'])
-                                backuptaskfile.close()
-                                if createbackup.status_code != int(202):
-                                    script_log ('Backup failed. Please check HP RMC log for details.')
-                                    sys.exit(1)
-                            backuppolicyfound = True
-                            break
-                    if not backuppolicyfound:
+                                script_log ('Backup failed. Please check HP RMC log for details.')
+                                sys.exit(1)
+                    else:
                         script_log("Backup Policy not found on the RMC. Please provide the correct RMC Backup Policy Id with --backuppolicy")
                         sys.exit(1)
 
@@ -471,7 +579,7 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
         sys.exit(1)
     else:
         # Script finished successfully - If removing snapshots, we will keep a database of them.
-        rdb.insert_snap_info(snap_name, recoverysetid)
+        rdb.insert_snap_info(snap_name, recoverysetid, serial)
         sys.exit(0)
 
 
@@ -505,11 +613,11 @@ c3476c-acf7-4261-9115-d0dd64df2695", "id": "1e5adc4f-fa92-42ef-9d75-ae11c698487a
     if REMOVE_SNAPSHOT == '1' :
         script_log('Removing SnapshotSets' + snap_name + '\n')
         #Getting list of all snapshot sets
-        getsnapshotsets = hprmchost_get (array, headers, "snapshot-sets")
-        getsnapshotsets = getsnapshotsets.json()
+        getsnapshotsets = hprmchost_list (array, headers, "snapshot-sets", 'snapshotSets',
+                                          'name', snap_name)
         # Using counter to show number of SnapshotSets found.
         counter = 0
-        for snapshotset in getsnapshotsets['snapshotSets']:
+        for snapshotset in getsnapshotsets:
             rvbdsnapshotsetname = str(snapshotset.get('name')).strip("'[]")
             hprmcsnapshotsetid = str(snapshotset.get('id')).strip("'[]")
             #script_log (rvbdsnapshotsetname)
@@ -533,9 +641,9 @@ c3476c-acf7-4261-9115-d0dd64df2695", "id": "1e5adc4f-fa92-42ef-9d75-ae11c698487a
         script_log('Removing BackupSets' + snap_name + '\n')
         # Using counter to show number of SnapshotSets found.
         counter = 0
-        getbackupsets = hprmchost_get (array, headers, "backup-sets")
-        getbackupsets = getbackupsets.json()
-        for backupset in getbackupsets['backupSets']:
+        getbackupsets = hprmchost_list (array, headers, "backup-sets", 'backupSets',
+                                        'name', snap_name)
+        for backupset in getbackupsets:
             rvbdbackupsetname = str(backupset.get('name')).strip("'[]")
             hprmcbackupsetid = str(backupset.get('id')).strip("'[]")
             #script_log (rvbdsnapshotsetname)
@@ -605,25 +713,24 @@ def get_option_parser():
     return parser
 
 
-if __name__ == '__main__':
+def main(argv=None):
+    global cdb, array, headers, parameters, session_key, session_renewed
+    if argv is None:
+        argv = sys.argv[1:]
     set_logger()
-    script_log("Running script with args: %s" % str(sys.argv))
-    options, argsleft = get_option_parser().parse_args()
+    script_log("Running script with args: %s" % str(argv))
+    options, argsleft = get_option_parser().parse_args(argv)
 
     # Set the working dir prefix
     set_script_path(options.work_dir)
 
     # Credentials db must be initialized by running the setup.py file in the root
-    global cdb
-    cdb = script_db.CredDB(options.work_dir + CRED_DB)
-
-    # Initialize the script database
-    sdb = script_db.ScriptDB(options.work_dir + SCRIPT_DB)
-    sdb.setup()
-
-    # Create snap to replay mapping database
-    rdb = script_db.SnapToReplayDB(options.work_dir + SNAP_DB)
-    rdb.setup()
+    # All handoff state is kept in one store, opened on first use
+    store = lazy.lazy_open(script_db.StateStore, options.work_dir,
+                           array=options.array, issue_time=options.issue_time)
+    cdb = lazy.LazyAttribute(store, 'creds')
+    sdb = lazy.LazyAttribute(store, 'clones')
+    rdb = lazy.LazyAttribute(store, 'snaps')
 
     # Setup server/lun info
     conn = options.array
@@ -634,16 +741,10 @@ if __name__ == '__main__':
     #Connect to db to get creds.
     username, password = cdb.get_enc_info(array)
 
-    creds = {'auth': {'passwordCredentials': {'username': username, 'password': password}}}
-    headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
-    function = 'login-sessions'
     parameters = ''
-    auth = hprmchost_call (array, creds, headers, "login-sessions")
-    script_log (auth.text)
-    token = auth.json()
-    #print (token)
-    token = token["loginSession"]["access"]["token"]["id"]
-    script_log  ("Authenticated with RMC with token " + token + "\n")
+    session_key = (array, username, password)
+    session_renewed = False
+    token = get_session_token(array, username, password)
     headers = {'Content-type': 'application/json', 'Accept': 'text/plain', 'X-Auth-Token': token}
 
     if options.operation == 'HELLO':
@@ -655,11 +756,10 @@ if __name__ == '__main__':
         remove_snap(cdb, sdb, rdb, conn, serial, options.snap_name)
     else:
         print ('Invalid operation: %s' % str(options.operation))
-        cdb.close()
-        sdb.close()
-        rdb.close()
+        store.close()
         sys.exit(errno.EINVAL)
 
-    sdb.close()
-    cdb.close()
-    rdb.close()
\ No newline at end of file
+    store.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+###############################################################################
+# HP RMC driver capabilities, see src/registry.py
+###############################################################################
+CAPABILITIES = {
+    'native_async_tasks': True,
+    'session_reuse': True,
+}
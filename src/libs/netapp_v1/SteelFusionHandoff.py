@@ -32,17 +32,19 @@ import sys
 import errno
 import subprocess
 
-# Script DB is used to store/load the cloned lun
-# information and the credentials
-import script_db
-
 # For setting up PATH
 import os
 
+# Heavy modules and the databases are loaded on first use
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
+from src import lazy
+from src import script_db
+
 # Netapp sdk path. This is the path to which you installed the 
 # Netapp managebility SDK.
 sys.path.append(r"C:\netapp\netapp-manageability-sdk-5.0\lib\python\NetApp")
-from NaServer import *
+NaServer = lazy.lazy_from('NaServer', 'NaServer')
+NaElement = lazy.lazy_from('NaServer', 'NaElement')
 
 # Paths for VADP scripts
 PERL_EXE = r'"C:\Program Files (x86)\VMware\VMware vSphere CLI\Perl\bin\perl.exe" '
@@ -81,6 +83,10 @@ def get_volume_path(server, serial):
 
     returns the lun serial
     '''
+    path = idb.get(array_name, 'lun', serial)
+    if path is not None:
+        return path
+
     api = NaElement("lun-list-info")
 
     xo = server.invoke_elem(api)
@@ -89,12 +95,15 @@ def get_volume_path(server, serial):
         print (xo.sprintf())
         return ""
 
+    # Merge the whole listing, the next lookup of any lun skips the scan
+    paths = {}
     luns = xo.child_get("luns")
     for luns in luns.children_get():
-        if luns.child_get_string("serial-number") == serial:
-            return luns.child_get_string("path")
+        paths[luns.child_get_string("serial-number")] = luns.child_get_string("path")
+    changed, dropped = idb.sync(array_name, 'lun', paths)
+    script_log("Lun listing merged, %d changed, %d gone\n" % (changed, dropped))
 
-    return ""
+    return paths.get(serial, "")
 
 def check_lun(server, serial):
     '''
@@ -324,6 +333,7 @@ def create_snap_clone(cdb, sdb, server, serial, snap_name, access_group):
              break
 
     script_log("Cloned serial is " + cloned_lun_serial)
+    idb.sync(array_name, 'lun', {cloned_lun_serial: cloned_lun_path}, complete=False)
     # Store this information in a local database. 
     # This is needed because when you are running cleanup,
     # the script must find out which cloned lun needs to me un-mapped.
@@ -380,6 +390,7 @@ def delete_cloned_lun(cdb, sdb, server, lun_serial):
     api.child_add_string("name", volume_name)
 
     xo = server.invoke_elem(api)
+    idb.sync(array_name, 'lun', {}, complete=False, removed=[clone_serial])
     if (xo.results_status() == "failed") :
         script_log("Error:\n")
         script_log(xo.sprintf())
@@ -520,18 +531,22 @@ def get_option_parser():
     return parser
 
 
-if __name__ == '__main__':
-    options, argsleft = get_option_parser().parse_args()
+def main(argv=None):
+    global array_name, idb
+    if argv is None:
+        argv = sys.argv[1:]
+    options, argsleft = get_option_parser().parse_args(argv)
 
     # Set the working dir prefix
     set_script_path(options.work_dir)
 
     # Credentials db must be initialized using the cred_mgmt.py file
-    cdb = script_db.CredDB(options.work_dir + r'\cred_db')
-	
-    # Initialize the script database
-    sdb = script_db.ScriptDB(options.work_dir + r'\script_db')
-    sdb.setup()
+    # All handoff state is kept in one store, opened on first use
+    store = lazy.lazy_open(script_db.StateStore, options.work_dir)
+    cdb = lazy.LazyAttribute(store, 'creds')
+    sdb = lazy.LazyAttribute(store, 'clones')
+    idb = lazy.LazyAttribute(store, 'inventory')
+    array_name = options.storage_array
 
     # Connect to Netapp server
     conn = NaServer(options.storage_array, 1 , 7)
@@ -553,9 +568,10 @@ if __name__ == '__main__':
 		            options.snap_name, options.proxy_host)
     else:
         print ('Invalid operation: %s' % str(options.operation))
-        cdb.close()
-        sdb.close()
+        store.close()
         sys.exit(errno.EINVAL)
 
-    sdb.close()
-    cdb.close()
+    store.close()
+
+if __name__ == '__main__':
+    main()
@@ -38,13 +38,14 @@ import subprocess
 import string
 import random
 
-# Script DB is used to store/load the cloned lun
-# information and the credentials
-import script_db
-
 # For setting up PATH
 import os
 
+# Script DB is used to store/load the cloned lun
+# information and the credentials
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
+from src import script_db
+
 # Paths for VADP scripts
 PERL_EXE = r'"C:\Program Files (x86)\VMware\VMware vSphere CLI\Perl\bin\perl.exe" '
 WORK_DIR =  r'C:\rvbd_handoff_scripts'
@@ -341,11 +342,10 @@ if __name__ == '__main__':
     set_script_path(options.work_dir)
 
     # Credentials db must be initialized using the cred_mgmt.py file
-    cdb = script_db.CredDB(options.work_dir + r'\cred_db')
-	
-    # Initialize the script database
-    sdb = script_db.ScriptDB(options.work_dir + r'\script_db')
-    sdb.setup()
+    # All handoff state is kept in one store, var\handoff.db in the work dir
+    store = script_db.StateStore(options.work_dir)
+    cdb = store.creds
+    sdb = store.clones
 
     # Connect to server
     conn = options.storage_array
@@ -361,9 +361,7 @@ if __name__ == '__main__':
 		            options.snap_name, options.proxy_host)
     else:
         print ('Invalid operation: %s' % str(options.operation))
-        cdb.close()
-        sdb.close()
+        store.close()
         sys.exit(errno.EINVAL)
 
-    sdb.close()
-    cdb.close()
+    store.close()
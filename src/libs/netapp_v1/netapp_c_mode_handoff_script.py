@@ -32,13 +32,14 @@ import sys
 import errno
 import subprocess
 
-# Script DB is used to store/load the cloned lun
-# information and the credentials
-import script_db
-
 # For setting up PATH
 import os
 
+# Script DB is used to store/load the cloned lun
+# information and the credentials
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
+from src import script_db
+
 # Netapp sdk path. This is the path to which you installed the 
 # Netapp managebility SDK.
 sys.path.append(r"C:\netapp\netapp-manageability-sdk-5.0\lib\python\NetApp")
@@ -551,11 +552,10 @@ if __name__ == '__main__':
     set_script_path(options.work_dir)
 
     # Credentials db must be initialized using the cred_mgmt.py file
-    cdb = script_db.CredDB(options.work_dir + r'\cred_db')
-	
-    # Initialize the script database
-    sdb = script_db.ScriptDB(options.work_dir + r'\script_db')
-    sdb.setup()
+    # All handoff state is kept in one store, var\handoff.db in the work dir
+    store = script_db.StateStore(options.work_dir)
+    cdb = store.creds
+    sdb = store.clones
 
     # Connect to Netapp server
     conn = NaServer(options.storage_array, 1 , 7)
@@ -577,9 +577,7 @@ if __name__ == '__main__':
 		            options.snap_name, options.proxy_host)
     else:
         print ('Invalid operation: %s' % str(options.operation))
-        cdb.close()
-        sdb.close()
+        store.close()
         sys.exit(errno.EINVAL)
 
-    sdb.close()
-    cdb.close()
+    store.close()
@@ -35,13 +35,14 @@ import string
 import random
 import logging
 
-# Script DB is used to store/load the cloned lun
-# information and the credentials
-import script_db
-
 # For setting up PATH
 import os
 
+# Heavy modules and the databases are loaded on first use
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
+from src import lazy
+from src import script_db
+
 # Paths for VADP scripts
 PERL_EXE = r'"C:\Program Files (x86)\VMware\VMware vSphere CLI\Perl\bin\perl.exe" '
 WORK_DIR =  r'C:\rvbd_handoff_scripts'
@@ -141,28 +142,37 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
     '''
     # Check for duplicate requests, these are possible
     # if Granite Core Crashes or the Handoff host itself crashed
-    rdb_snap_name, replay = rdb.get_snap_info(snap_name)
-    if rdb_snap_name:
-        script_log("Duplicate request")
-        print (snap_name)
-        return
+    # A proxy backup of this request that did not finish resumes after
+    # its last completed step, its snapshot is already recorded
+    op = sdb.begin_operation('CREATE_SNAP', server, serial, snap_name)
+    if op.resuming() and category == protect_category:
+        script_log("Resuming proxy backup after step %s" % op.last_step())
+    else:
+        rdb_snap_name, replay = rdb.get_snap_info(snap_name)
+        if rdb_snap_name:
+            script_log("Duplicate request")
+            print (snap_name)
+            return
 
     # Run proxy backup on this snapshot if its category matches
     # protected snapshot category
     if category == protect_category:
         # Un-mount the previously mounted cloned lun from proxy host
        
-        if unmount_proxy_backup(cdb, sdb, serial, proxy_host, datacenter, include_hosts, exclude_hosts) :
+        if op.step('unmount_proxy', unmount_proxy_backup, cdb, sdb, serial, proxy_host, datacenter, include_hosts, exclude_hosts):
             # Delete the cloned snapshot
-            delete_cloned_lun(cdb, sdb, server, serial)
+            op.step('delete_clone', delete_cloned_lun, cdb, sdb, server, serial)
             # Create a cloned snapshot lun form the snapshot
-            cloned_lun_serial = create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, access_group)
+            cloned_lun_serial = op.step('create_clone', create_snap_clone, cdb, sdb, rdb, server, serial, snap_name, access_group)
             # Mount the snapshot on the proxy host
-            mount_proxy_backup(cdb, sdb, cloned_lun_serial, snap_name,
-                               access_group, proxy_host, datacenter,
-                               include_hosts, exclude_hosts) 
+            op.step('mount_proxy', mount_proxy_backup, cdb, sdb, cloned_lun_serial, snap_name,
+                    access_group, proxy_host, datacenter,
+                    include_hosts, exclude_hosts)
+            op.finish()
             print (snap_name)
             return
+        # The unmount failed, take a plain snapshot
+        op.finish()
 
     # Else, either the snapshot is not protected
     # or the proxy unmount operation failed. In such a case
@@ -177,7 +187,7 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
     #out_split = decoded.strip().split('\n')[0].split(":")[-1]
     script_log("The index is " + str(index))
     # Script finished successfully
-    rdb.insert_snap_info(snap_name, index)
+    rdb.insert_snap_info(snap_name, index, serial)
     print (snap_name)
     sys.exit(0)
 
@@ -274,8 +284,10 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
     # the script must find out which cloned lun needs to me un-mapped.
     script_log('Inserting serial: %s, cloned_lun_serial: %s, snap_name: %s, group: %s' %\
                (serial, cloned_lun_serial, snap_name, accessgroup))
-    sdb.insert_clone_info(serial, cloned_lun_serial, snap_name, accessgroup)
-    rdb.insert_snap_info(snap_name, index)
+    # Roll back both records if either insert fails
+    with script_db.transaction(sdb, rdb):
+        sdb.insert_clone_info(serial, cloned_lun_serial, snap_name, accessgroup)
+        rdb.insert_snap_info(snap_name, index, serial)
     script_log("Index is:" + str(index))
     return cloned_lun_serial        
 
@@ -488,22 +500,22 @@ def get_option_parser():
     return parser
 
 
-if __name__ == '__main__':
-    options, argsleft = get_option_parser().parse_args()
+def main(argv=None):
+    global serial
+    if argv is None:
+        argv = sys.argv[1:]
+    options, argsleft = get_option_parser().parse_args(argv)
 
     # Set the working dir prefix
     set_script_path(options.work_dir)
 
     # Credentials db must be initialized using the cred_mgmt.py file
-    cdb = script_db.CredDB(options.work_dir + r'\cred_db')
-	
-    # Initialize the script database
-    sdb = script_db.ScriptDB(options.work_dir + r'\script_db')
-    sdb.setup()
-
-    # Create snap to replay mapping database
-    rdb = script_db.SnapToReplayDB(options.work_dir + r'\replay_db')
-    rdb.setup()
+    # All handoff state is kept in one store, opened on first use
+    store = lazy.lazy_open(script_db.StateStore, options.work_dir,
+                           array=options.array, issue_time=options.issue_time)
+    cdb = lazy.LazyAttribute(store, 'creds')
+    sdb = lazy.LazyAttribute(store, 'clones')
+    rdb = lazy.LazyAttribute(store, 'snaps')
     
     # Setup server/lun info
     conn = options.array
@@ -527,11 +539,10 @@ if __name__ == '__main__':
                     options.exclude_hosts)
     else:
         print ('Invalid operation: %s' % str(options.operation))
-        cdb.close()
-        sdb.close()
-        rdb.close()
+        store.close()
         sys.exit(errno.EINVAL)
 
-    sdb.close()
-    cdb.close()
-    rdb.close()
+    store.close()
+
+if __name__ == '__main__':
+    main()
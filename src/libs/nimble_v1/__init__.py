@@ -0,0 +1,7 @@
+###############################################################################
+# Nimble driver capabilities, see src/registry.py
+###############################################################################
+CAPABILITIES = {
+    'proxy_backup': True,
+    'external_cli': True,
+}
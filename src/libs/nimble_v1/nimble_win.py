@@ -35,13 +35,14 @@ import string
 import random
 import logging
 
-# Script DB is used to store/load the cloned lun
-# information and the credentials
-import script_db
-
 # For setting up PATH
 import os
 
+# Script DB is used to store/load the cloned lun
+# information and the credentials
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../../..'))
+from src import script_db
+
 # Paths for VADP scripts
 PERL_EXE = r'"C:\Program Files (x86)\VMware\VMware vSphere CLI\Perl\bin\perl.exe" '
 PYTHON_EXE = r'"C:\Python33\python.exe" '
@@ -194,7 +195,7 @@ def create_snap(cdb, sdb, rdb, server, serial, snap_name,
     #out_split = decoded.strip().split('\n')[0].split(":")[-1]
     script_log("The index is " + str(index))
     # Script finished successfully
-    rdb.insert_snap_info(snap_name, index)
+    rdb.insert_snap_info(snap_name, index, serial)
     print (snap_name)
     sys.exit(0)
 
@@ -291,8 +292,10 @@ def create_snap_clone(cdb, sdb, rdb, server, serial, snap_name, accessgroup):
     # the script must find out which cloned lun needs to me un-mapped.
     script_log('Inserting serial: %s, cloned_lun_serial: %s, snap_name: %s, group: %s' %\
                (serial, cloned_lun_serial, snap_name, accessgroup))
-    sdb.insert_clone_info(serial, cloned_lun_serial, snap_name, accessgroup)
-    rdb.insert_snap_info(snap_name, index)
+    # Roll back both records if either insert fails
+    with script_db.transaction(sdb, rdb):
+        sdb.insert_clone_info(serial, cloned_lun_serial, snap_name, accessgroup)
+        rdb.insert_snap_info(snap_name, index, serial)
     script_log("Index is:" + str(index))
     return cloned_lun_serial        
 
@@ -579,15 +582,12 @@ if __name__ == '__main__':
     set_script_path(options.work_dir)
 
     # Credentials db must be initialized using the cred_mgmt.py file
-    cdb = script_db.CredDB(options.work_dir + r'\cred_db')
-	
-    # Initialize the script database
-    sdb = script_db.ScriptDB(options.work_dir + r'\script_db')
-    sdb.setup()
-
-    # Create snap to replay mapping database
-    rdb = script_db.SnapToReplayDB(options.work_dir + r'\replay_db')
-    rdb.setup()
+    # All handoff state is kept in one store, var\handoff.db in the work dir
+    store = script_db.StateStore(options.work_dir, array=options.array,
+                                 issue_time=options.issue_time)
+    cdb = store.creds
+    sdb = store.clones
+    rdb = store.snaps
     
     # Setup server/lun info
     conn = options.array
@@ -611,11 +611,7 @@ if __name__ == '__main__':
                     options.exclude_hosts)
     else:
         print ('Invalid operation: %s' % str(options.operation))
-        cdb.close()
-        sdb.close()
-        rdb.close()
+        store.close()
         sys.exit(errno.EINVAL)
 
-    sdb.close()
-    cdb.close()
-    rdb.close()
+    store.close()
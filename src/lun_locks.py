@@ -0,0 +1,102 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Per-LUN lock manager
+# Operations changing the same LUN (array, serial) run one at a time across
+# all handoff processes on the host, so create_snap and remove_snap never
+# race on the clone info of one LUN. Operations mapping clones to an access
+# group also take the access group lock. Operations on different LUNs and
+# access groups run in parallel.
+#
+# Locks are always taken in the same order, LUN first and access group
+# second, so two operations can not deadlock each other.
+###############################################################################
+
+import contextlib
+import hashlib
+import os
+
+from src import driver_args
+from src import filelock
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LOCK_DIR = os.path.join(ROOT_DIR, 'var', 'locks')
+
+# Configuration defaults
+# Operations which change the LUN, its snapshots or its clones
+LOCKED_OPERATIONS = ('CREATE_SNAP', 'REMOVE_SNAP')
+# Serialize clone mapping per access group
+ACCESS_GROUP_LOCKS = True
+# Seconds an operation waits for its locks before it fails
+LOCK_TIMEOUT = 1800
+
+
+def _lock_path(kind, *parts):
+    name = '\0'.join(str(part) for part in parts)
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return os.path.join(LOCK_DIR, '%s-%s.lock' % (kind, digest))
+
+
+def get_lock_paths(array_model, argv):
+    '''
+    Returns the lock files an operation must hold, in locking order
+    '''
+    operation = driver_args.get_option(argv, '--operation')
+    serial = driver_args.get_option(argv, '--serial')
+    if operation not in LOCKED_OPERATIONS or not serial:
+        return []
+    array = driver_args.get_option(argv, '--array')
+    paths = [_lock_path('lun', array_model, array, serial.upper())]
+    access_group = driver_args.get_option(argv, '--access-group')
+    if ACCESS_GROUP_LOCKS and access_group:
+        paths.append(_lock_path('group', array_model, array, access_group))
+    return paths
+
+
+@contextlib.contextmanager
+def operation_locks(array_model, argv, timeout=None):
+    '''
+    Holds the LUN and access group locks of an operation, e.g.
+        with lun_locks.operation_locks(array_model, argv):
+            run the driver
+
+    Raises filelock.LockTimeout if the locks were not free within timeout,
+    LOCK_TIMEOUT seconds by default.
+    '''
+    timeout = LOCK_TIMEOUT if timeout is None else timeout
+    held = []
+    try:
+        for path in get_lock_paths(array_model, argv):
+            lock = filelock.FileLock(path)
+            try:
+                lock.acquire(timeout=timeout)
+            except filelock.LockTimeout:
+                raise filelock.LockTimeout("Timed out waiting for another operation "
+                                           "on the same LUN or access group")
+            held.append(lock)
+        yield
+    finally:
+        for lock in reversed(held):
+            lock.release()
@@ -0,0 +1,153 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Driver capability registry
+# Each driver declares its capabilities and cost hints in the CAPABILITIES
+# dict of src/libs/<array model>/__init__.py. The dispatcher, the batch
+# runner and the service read them here instead of probing for files.
+# Keys missing from a driver's CAPABILITIES take the DEFAULT_CAPABILITIES value.
+###############################################################################
+
+import importlib
+import os
+import sys
+import threading
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LIBS_DIR = os.path.join(ROOT_DIR, 'src', 'libs')
+DRIVER_SCRIPT = 'SteelFusionHandoff.py'
+DRIVER_PACKAGE = 'src.libs.%s'
+
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+# Interpreters drivers may ask for
+PYTHON2_EXE = r'C:\Python27\python.exe'
+INTERPRETERS = {'python3': sys.executable,
+                'python2': PYTHON2_EXE}
+
+DEFAULT_CAPABILITIES = {
+    # Interpreter the driver script runs under, see INTERPRETERS
+    'interpreter': 'python3',
+    # main(argv) can be called by run.py and the service in-process
+    'in_process': True,
+    # Clones snapshots and mounts them on an ESX proxy host
+    'proxy_backup': False,
+    # Can handle several LUNs of one array in a single operation
+    'multi_lun_batch': False,
+    # Array API runs long operations as tasks the driver polls
+    'native_async_tasks': False,
+    # Driver steps run external CLIs (PowerShell, SSSU, Perl) and mostly
+    # wait on child processes rather than on the network
+    'external_cli': False,
+    # Login state is kept in module globals and can be reused between
+    # requests when the driver stays loaded
+    'session_reuse': False,
+    # Recommended operations at the same time against one array
+    'max_concurrency': 4,
+}
+
+
+class DriverInfo(object):
+    '''
+    Capabilities of one array model driver
+
+    model : driver directory name under src/libs
+    capabilities : dict overriding DEFAULT_CAPABILITIES
+    '''
+
+    def __init__(self, model, capabilities=None):
+        self.model = model
+        self.path = os.path.join(LIBS_DIR, model, DRIVER_SCRIPT)
+        self.capabilities = dict(DEFAULT_CAPABILITIES)
+        self.capabilities.update(capabilities or {})
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['capabilities'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def get_interpreter(self):
+        '''
+        Returns the python executable the driver script runs under
+        '''
+        return INTERPRETERS.get(self.interpreter, sys.executable)
+
+    def __repr__(self):
+        return 'DriverInfo(%r, %r)' % (self.model, self.capabilities)
+
+
+_drivers = {}
+_drivers_lock = threading.Lock()
+
+
+def _load_capabilities(model):
+    try:
+        package = importlib.import_module(DRIVER_PACKAGE % model)
+    except (ImportError, SyntaxError):
+        return {}
+    return getattr(package, 'CAPABILITIES', {})
+
+
+def get_driver(model):
+    '''
+    Returns the DriverInfo of the array model, or None if there is no
+    driver for it
+    '''
+    if not model or os.sep in model or '/' in model or '.' in model:
+        return None
+    with _drivers_lock:
+        if model in _drivers:
+            return _drivers[model]
+    info = None
+    if os.path.isfile(os.path.join(LIBS_DIR, model, DRIVER_SCRIPT)):
+        info = DriverInfo(model, _load_capabilities(model))
+    with _drivers_lock:
+        _drivers[model] = info
+    return info
+
+
+def list_drivers():
+    '''
+    Returns the DriverInfo of every driver under src/libs, sorted by model
+    '''
+    drivers = []
+    for model in sorted(os.listdir(LIBS_DIR)):
+        info = get_driver(model)
+        if info is not None:
+            drivers.append(info)
+    return drivers
+
+
+def get_capability(model, name):
+    '''
+    Returns one capability of the array model, the default if the
+    model has no driver
+    '''
+    info = get_driver(model)
+    if info is None:
+        return DEFAULT_CAPABILITIES[name]
+    return info.capabilities[name]
@@ -22,152 +22,1220 @@
 #
 ###############################################################################
 
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import re
 import sqlite3
+import sys
+import threading
+import time
 
-class CredDB(object):
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+
+# Seconds a statement waits while another process holds the database lock
+BUSY_TIMEOUT = 30
+# WAL lets readers run while another process writes, set to 'DELETE'
+# for the old rollback journal
+JOURNAL_MODE = 'WAL'
+
+# Handoff state of all drivers, relative to the work directory
+STORE_DB = os.path.join('var', 'handoff.db')
+# Backend of the clone and snapshot tables: 'sqlite' keeps them in STORE_DB,
+# 'journal' in the append-only log of src/journal_store.py
+STATE_BACKEND = 'sqlite'
+# Database files of earlier versions, imported into the state store when it
+# is opened: (path relative to the work directory, table)
+LEGACY_DBS = ((os.path.join('var', 'cred.db'), 'pwd'),
+              (os.path.join('var', 'script.db'), 'clone_info'),
+              (os.path.join('var', 'replay.db'), 'snap_to_replay_info'),
+              ('cred_db', 'pwd'),
+              ('script_db', 'clone_info'),
+              ('replay_db', 'snap_to_replay_info'))
+
+# Seconds credentials are served from the process cache before they are
+# read again, the cache is dropped earlier when a process changes them.
+# Set to 0 to read them from the database every time.
+CRED_CACHE_TTL = 60
+# Days removed snapshots stay in the catalog, see StateStore.prune()
+CATALOG_KEEP_DAYS = 365
+# Days an unfinished operation journal is kept for a retry
+JOURNAL_KEEP_DAYS = 7
+# Rows deleted per transaction when pruning
+PRUNE_BATCH = 1000
+# Seconds an array inventory record is used before the array is listed again
+INVENTORY_TTL = 300
+# Records kept in the inventory cache, the least recently used go first
+INVENTORY_MAX_ENTRIES = 20000
+# Values per statement of the bulk APIs, below the SQLite default limit of 999
+MAX_VARIABLES = 500
+
+# INSERT ... ON CONFLICT needs SQLite 3.24, older versions UPDATE and
+# then INSERT the rows which were not there
+HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+# excluded.<column> in the SET expressions of upsert_many()
+_EXCLUDED = re.compile(r'\bexcluded\.(\w+)')
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def _text(value):
+    # The original layer formatted all values into the SQL as strings
+    return None if value is None else str(value)
+
+
+class SharedConnection(object):
+    '''
+    The one connection of this process to a database file. It runs in
+    autocommit mode, transaction() groups several writes.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT,
+                                    isolation_level=None,
+                                    check_same_thread=False)
+        # Lets prune() return free pages to the file system, only takes
+        # effect on new files, prune() converts existing ones
+        self.conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self.conn.execute('PRAGMA journal_mode=%s' % JOURNAL_MODE)
+        if JOURNAL_MODE.upper() == 'WAL':
+            # Durable across process crashes, only a power loss may lose
+            # the last transactions
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.lock = threading.RLock()
+        self.depth = 0
+        # Tables whose schema was checked on this connection
+        self.checked = set()
+        # Process caches of table data, {table: cache}
+        self.caches = {}
+
+    def file_signature(self):
+        '''
+        Returns the modification time and size of the database file and
+        its WAL file, they change whenever a process commits
+        '''
+        signature = []
+        for path in (self.path, self.path + '-wal'):
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            if not self.depth:
+                self.conn.execute('BEGIN IMMEDIATE')
+            self.depth += 1
+            try:
+                yield
+            except:
+                self.depth -= 1
+                if not self.depth:
+                    self.conn.execute('ROLLBACK')
+                raise
+            self.depth -= 1
+            if not self.depth:
+                self.conn.execute('COMMIT')
+
+
+def get_connection(path):
+    '''
+    Returns the shared connection to the database file
+    '''
+    key = os.path.normcase(os.path.abspath(path))
+    with _connections_lock:
+        shared = _connections.get(key)
+        if shared is None:
+            shared = SharedConnection(path)
+            _connections[key] = shared
+    return shared
+
+
+def close_all():
+    '''
+    Closes all shared connections of this process
+    '''
+    with _connections_lock:
+        for shared in _connections.values():
+            shared.conn.close()
+        _connections.clear()
+
+atexit.register(close_all)
+
+
+@contextlib.contextmanager
+def transaction(*dbs):
+    '''
+    Runs the writes of the with block in one transaction per database, e.g.
+        with script_db.transaction(sdb, rdb):
+            sdb.insert_clone_info(...)
+            rdb.insert_snap_info(...)
+    '''
+    if not dbs:
+        yield
+        return
+    with dbs[0].transaction():
+        with transaction(*dbs[1:]):
+            yield
+
+
+class Database(object):
+    '''
+    Base class of the databases, all instances for the same file share
+    the process connection. The table schema is created or migrated to
+    SCHEMA_VERSION the first time the file is opened by the process.
+    '''
+
+    TABLE = None
+    SCHEMA_VERSION = 0
+    # CREATE TABLE and CREATE INDEX statements of the current layout
+    CREATE = ()
+    # Statements bringing the table from the previous version, {version: statements}
+    UPGRADES = {}
+    # INSERT ... SELECT statement copying rows into TABLE, %s is the source
+    COPY = None
 
     def __init__(self, path):
-        self.conn_ = sqlite3.connect(path)
+        self.shared_ = get_connection(path)
+        self.conn_ = self.shared_.conn
+        self.ensure_schema()
+
+    def transaction(self):
+        return self.shared_.transaction()
+
+    def execute(self, sql, params=()):
+        with self.shared_.lock:
+            return self.conn_.execute(sql, params)
+
+    def fetchone(self, sql, params=()):
+        with self.shared_.lock:
+            return self.conn_.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        with self.shared_.lock:
+            return self.conn_.execute(sql, params).fetchall()
+
+    def table_exists(self, table):
+        return self.fetchone("SELECT name FROM sqlite_master "
+                             "WHERE type='table' AND name=?", (table,)) is not None
+
+    def upsert(self, columns, key_columns, values, updates=None):
+        '''
+        Inserts a row into TABLE or updates the row with the same key,
+        see upsert_many()
+        '''
+        self.upsert_many(columns, key_columns, [values], updates)
+
+    def upsert_many(self, columns, key_columns, rows, updates=None):
+        '''
+        Inserts rows into TABLE or updates the rows with the same key,
+        all in one transaction
+
+        columns : column names of the row values
+        key_columns : columns of the table's primary key or unique constraint
+        rows : sequence of row values
+        updates : SET expressions for existing rows, by default the other
+                  columns take the new values
+        '''
+        sql = "INSERT INTO %s (%s) VALUES (%s)" % \
+              (self.TABLE, ', '.join(columns), ', '.join('?' * len(columns)))
+        if updates is None:
+            updates = ['%s=excluded.%s' % (c, c) for c in columns if c not in key_columns]
+        if not HAS_UPSERT and updates:
+            self._update_or_insert(sql, columns, key_columns, rows, updates)
+            return
+        if updates:
+            sql += " ON CONFLICT (%s) DO UPDATE SET %s" % \
+                   (', '.join(key_columns), ', '.join(updates))
+        with self.transaction():
+            with self.shared_.lock:
+                self.conn_.executemany(sql, rows)
+
+    def _update_or_insert(self, insert_sql, columns, key_columns, rows, updates):
+        # upsert_many() for SQLite before 3.24: UPDATE the row with the key,
+        # INSERT it if there is none. INSERT OR REPLACE would delete the row
+        # and lose the columns the updates keep.
+        excluded = []
+
+        def parameter(match):
+            excluded.append(columns.index(match.group(1)))
+            return '?'
+
+        assignments = _EXCLUDED.sub(parameter, ', '.join(updates))
+        update_sql = "UPDATE %s SET %s WHERE %s" % \
+                     (self.TABLE, assignments, ' AND '.join('%s=?' % c for c in key_columns))
+        keys = [columns.index(c) for c in key_columns]
+        with self.transaction():
+            with self.shared_.lock:
+                for row in rows:
+                    cursor = self.conn_.execute(update_sql, [row[i] for i in excluded] +
+                                                [row[i] for i in keys])
+                    if cursor.rowcount == 0:
+                        self.conn_.execute(insert_sql, row)
+
+    def _statements(self, sql, conditions, params, key_column, keys):
+        # Splits a statement on a list of keys into chunks of MAX_VARIABLES
+        if keys is None:
+            if conditions:
+                sql += " WHERE " + " AND ".join(conditions)
+            yield sql, tuple(params)
+            return
+        keys = [_text(k) for k in keys]
+        for i in range(0, len(keys), MAX_VARIABLES):
+            chunk = keys[i:i + MAX_VARIABLES]
+            where = conditions + ['%s IN (%s)' % (key_column, ', '.join('?' * len(chunk)))]
+            yield sql + " WHERE " + " AND ".join(where), tuple(params) + tuple(chunk)
+
+    def select_many(self, columns, conditions, params, key_column=None, keys=None):
+        '''
+        Returns the rows of TABLE matching all conditions, and with
+        key_column in keys if keys is given
+        '''
+        rows = []
+        for sql, values in self._statements("SELECT %s FROM %s" % (columns, self.TABLE),
+                                            conditions, params, key_column, keys):
+            rows.extend(self.fetchall(sql, values))
+        return rows
+
+    def delete_many(self, conditions, params, key_column=None, keys=None):
+        '''
+        Deletes the rows select_many() would return, in one transaction
+
+        Returns the number of rows deleted
+        '''
+        if not conditions and keys is None:
+            raise ValueError("delete_many() needs at least one filter")
+        deleted = 0
+        with self.transaction():
+            for sql, values in self._statements("DELETE FROM %s" % self.TABLE,
+                                                conditions, params, key_column, keys):
+                deleted += self.execute(sql, values).rowcount
+        return deleted
+
+    def get_schema_version(self):
+        if not self.table_exists('schema_version'):
+            return 0
+        row = self.fetchone("SELECT version FROM schema_version WHERE name=?",
+                            (self.TABLE,))
+        return row[0] if row else 0
+
+    def set_schema_version(self, version):
+        self.execute("CREATE TABLE IF NOT EXISTS schema_version "
+                     "(name text PRIMARY KEY, version integer)")
+        self.execute("INSERT OR REPLACE INTO schema_version VALUES (?, ?)",
+                     (self.TABLE, version))
+
+    def ensure_schema(self):
+        '''
+        Creates TABLE or migrates it from an older layout
+        '''
+        if self.TABLE in self.shared_.checked:
+            return
+        if self.get_schema_version() < self.SCHEMA_VERSION:
+            with self.transaction():
+                # Another process may have migrated it in the meantime
+                version = self.get_schema_version()
+                if version < self.SCHEMA_VERSION:
+                    self.migrate(version)
+                    self.set_schema_version(self.SCHEMA_VERSION)
+        self.shared_.checked.add(self.TABLE)
+
+    def migrate(self, version):
+        '''
+        Brings TABLE from schema version to SCHEMA_VERSION, called inside
+        a transaction. Unversioned tables are moved into the CREATE layout.
+        '''
+        if version:
+            for upgrade in range(version + 1, self.SCHEMA_VERSION + 1):
+                for sql in self.UPGRADES.get(upgrade, ()):
+                    self.execute(sql)
+            return
+        old_table = None
+        if self.table_exists(self.TABLE):
+            old_table = self.TABLE + '_v0'
+            self.execute("ALTER TABLE %s RENAME TO %s" % (self.TABLE, old_table))
+        for sql in self.CREATE:
+            self.execute(sql)
+        if old_table:
+            self.copy_rows(old_table)
+            self.execute("DROP TABLE %s" % old_table)
+
+    def copy_rows(self, source):
+        '''
+        Copies the rows of a table with the TABLE columns, e.g. the table
+        of an attached legacy database, into TABLE
+        '''
+        self.execute(self.COPY % source)
+
+    def close(self):
+        '''
+        The connection is shared with other users in this process
+        and closed when the process exits
+        '''
+        pass
+
+
+class CredDB(Database):
+
+    TABLE = 'pwd'
+    SCHEMA_VERSION = 2
+    # pwd_version counts the changes of pwd, made by any process, so the
+    # credential cache survives writes to the other tables of the store
+    CREATE = ('CREATE TABLE pwd (host text PRIMARY KEY, user text, pass text)',
+              'CREATE TABLE IF NOT EXISTS pwd_version (version integer)',
+              'INSERT INTO pwd_version SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM pwd_version)') + \
+        tuple('CREATE TRIGGER pwd_%s AFTER %s ON pwd '
+              'BEGIN UPDATE pwd_version SET version=version+1; END' % (event.lower(), event)
+              for event in ('INSERT', 'UPDATE', 'DELETE'))
+    UPGRADES = {2: CREATE[1:]}
+
+    # The last row written for a host is the one in use
+    COPY = ("INSERT OR REPLACE INTO pwd (host, user, pass) "
+            "SELECT host, user, pass FROM %s ORDER BY rowid")
 
     def setup(self):
         '''
-        Deletes all existing tables and creates fresh
-        tables
-        '''
-        c = self.conn_.cursor()
-		
-        # Cleanup existing tables if they exist
-        tables = []
-        for row in c.execute("SELECT name FROM sqlite_master WHERE type='table' "):
-            tables.append(row[0])
-		
-        for table in tables:
-            c.execute("DROP table %s" % table)
-		
-        c.execute('''CREATE TABLE pwd (host text, user text, pass text)''')
-        self.conn_.commit()
+        Deletes all existing credentials and creates a fresh table
+        '''
+        with self.transaction():
+            self.execute("DROP TABLE IF EXISTS pwd")
+            for sql in self.CREATE:
+                self.execute(sql)
+            # Dropping the table does not run the triggers
+            self.execute("UPDATE pwd_version SET version=version+1")
+            self.set_schema_version(self.SCHEMA_VERSION)
+        self.invalidate()
+
+    def invalidate(self):
+        '''
+        Drops the cached credentials of this process
+        '''
+        self.shared_.caches.pop(self.TABLE, None)
+
+    def get_version(self):
+        '''
+        Returns the change counter of the credentials
+        '''
+        return self.fetchone("SELECT version FROM pwd_version")[0]
+
+    def _cached_hosts(self):
+        # The file signature is taken before reading, a change made while
+        # the cache is filled drops it on the next lookup. Only when the
+        # file changed is the change counter read, writes to other tables
+        # keep the cache.
+        signature = self.shared_.file_signature()
+        now = time.time()
+        cache = self.shared_.caches.get(self.TABLE)
+        if cache is not None and now - cache['loaded'] < CRED_CACHE_TTL:
+            if cache['signature'] == signature:
+                return cache['hosts']
+            version = self.get_version()
+            if cache['version'] == version:
+                cache['signature'] = signature
+                return cache['hosts']
+        else:
+            version = self.get_version()
+        cache = {'signature': signature, 'version': version, 'loaded': now, 'hosts': {}}
+        self.shared_.caches[self.TABLE] = cache
+        return cache['hosts']
 
     def insert_enc_info(self, hostname, user, pwd):
-        c = self.conn_.cursor()
-        host = (hostname,)
-        c.execute("DELETE FROM pwd where host=?", host)
-        c.execute("INSERT INTO pwd VALUES ('%s', '%s', '%s')" % \
-				 (hostname, user, pwd))
-        self.conn_.commit()
+        self.upsert(('host', 'user', 'pass'), ('host',),
+                    (_text(hostname), _text(user), _text(pwd)))
+        self.invalidate()
 
     def delete_enc_info(self, hostname):
-        c = self.conn_.cursor()
-        host = (hostname,)
-        c.execute("DELETE FROM pwd where host=?", host)
-        self.conn_.commit()
+        self.execute("DELETE FROM pwd where host=?", (hostname,))
+        self.invalidate()
 
     def get_all_enc_info(self):
-        c = self.conn_.cursor()
-        details = []
-        for row in c.execute("SELECT host, user, pass FROM pwd"):
-            details.append((row[0], row[1], row[2]))
-
-        self.conn_.commit()
-        return details
+        return [(row[0], row[1], row[2])
+                for row in self.fetchall("SELECT host, user, pass FROM pwd")]
 
     def get_enc_info(self, hostname):
-        c = self.conn_.cursor()
-        host = (hostname,)
-        c.execute("SELECT user, pass FROM pwd where host=?", host)
-        details = c.fetchone()
-        self.conn_.commit()
-        return details or ('', '')
+        '''
+        Returns (user, password) of the host, from the process cache unless
+        the credentials changed since the host was read
+        '''
+        with self.shared_.lock:
+            hosts = self._cached_hosts()
+            if hostname not in hosts:
+                details = self.fetchone("SELECT user, pass FROM pwd where host=?",
+                                        (hostname,))
+                hosts[hostname] = tuple(details) if details else ('', '')
+            return hosts[hostname]
 
-    def close(self):
-        self.conn_.close()
-		
-		
-class ScriptDB(object):
 
-    def __init__(self, path):
-        self.conn_ = sqlite3.connect(path)
+class ScriptDB(Database):
+
+    TABLE = 'clone_info'
+    SCHEMA_VERSION = 2
+    # The unique (lun, clone) index serves the lookups by LUN serial
+    CREATE = ('CREATE TABLE clone_info (id INTEGER PRIMARY KEY, lun text NOT NULL, '
+              'clone text, snap_name text, access_group text, UNIQUE (lun, clone))',
+              'CREATE INDEX clone_info_snap_name ON clone_info (snap_name)',
+              'CREATE INDEX clone_info_access_group ON clone_info (access_group)')
+    UPGRADES = {2: CREATE[2:]}
+
+    # Duplicate rows are dropped, the oldest one is kept
+    COPY = ("INSERT OR IGNORE INTO clone_info (lun, clone, snap_name, access_group) "
+            "SELECT lun, clone, snap_name, access_group FROM %s "
+            "WHERE lun IS NOT NULL ORDER BY rowid")
 
     def setup(self):
         '''
         Creates database tables if they do not exist
         '''
-        c = self.conn_.cursor()
-        table_exists = False
-        for row in c.execute("SELECT name FROM sqlite_master WHERE type='table' "):
-            if row[0] == 'clone_info':
-                table_exists = True
-                break
-
-        if not table_exists:
-            c.execute('CREATE TABLE clone_info (lun text, clone text, '\
-			          'snap_name text, access_group text)')
-        self.conn_.commit()
+        self.ensure_schema()
 
     def insert_clone_info(self, lun, clone, snap_name, group):
-        c = self.conn_.cursor()
-        c.execute("INSERT INTO clone_info VALUES ('%s', '%s', '%s', '%s')" % \
-                  (lun, clone, snap_name, group))
-        self.conn_.commit()
+        self.insert_many([(lun, clone, snap_name, group)])
+
+    def insert_many(self, rows):
+        '''
+        Inserts or updates (lun, clone, snap_name, access_group) rows
+        in one transaction
+        '''
+        self.upsert_many(('lun', 'clone', 'snap_name', 'access_group'), ('lun', 'clone'),
+                         [tuple(_text(v) for v in row) for row in rows])
 
     def get_clone_info(self, lun_serial):
-        c = self.conn_.cursor()
-        lun = (lun_serial,)
-        c.execute("SELECT clone, snap_name, access_group "\
-		          "FROM clone_info where lun=?", lun)
-        data = c.fetchone()
-        self.conn_.commit()
+        data = self.fetchone("SELECT clone, snap_name, access_group "\
+                             "FROM clone_info where lun=? ORDER BY id LIMIT 1",
+                             (lun_serial,))
         return data or ('', '', '')
 
+    def _filters(self, access_group, snap_name):
+        conditions = []
+        params = []
+        if access_group is not None:
+            conditions.append('access_group=?')
+            params.append(_text(access_group))
+        if snap_name is not None:
+            conditions.append('snap_name=?')
+            params.append(_text(snap_name))
+        return conditions, params
+
+    def get_many(self, luns=None, access_group=None, snap_name=None):
+        '''
+        Returns the (lun, clone, snap_name, access_group) rows matching
+        all the filters given
+
+        luns : LUN serials
+        access_group : access group the clones are mapped to
+        snap_name : snapshot the clones were made from
+        '''
+        conditions, params = self._filters(access_group, snap_name)
+        return self.select_many('lun, clone, snap_name, access_group',
+                                conditions, params, 'lun', luns)
+
     def delete_clone_info(self, lun_serial):
-        c = self.conn_.cursor()
-        lun = (lun_serial,)
-        c.execute("DELETE FROM clone_info where lun=?", lun)
-        self.conn_.commit()
+        self.execute("DELETE FROM clone_info where lun=?", (lun_serial,))
 
-    def close(self):
-        self.conn_.close()
+    def begin_operation(self, *key):
+        '''
+        Returns the journal of an operation in the same store, e.g.
+            op = sdb.begin_operation('CREATE_SNAP', array, serial, snap_name)
+        '''
+        return Operation(OpJournal(self.shared_.path), key)
 
+    def delete_many(self, luns=None, access_group=None, snap_name=None):
+        '''
+        Deletes the rows get_many() would return, in one transaction
 
-class SnapToReplayDB(object):
+        Returns the number of rows deleted
+        '''
+        conditions, params = self._filters(access_group, snap_name)
+        return Database.delete_many(self, conditions, params, 'lun', luns)
 
-    def __init__(self, path):
-        self.conn_ = sqlite3.connect(path)
+
+class SnapToReplayDB(Database):
+
+    TABLE = 'snap_to_replay_info'
+    SCHEMA_VERSION = 2
+    # created is the time.time() of the first insert
+    CREATE = ('CREATE TABLE snap_to_replay_info (snap_name text PRIMARY KEY, '
+              'replay text, serial text, created real)',
+              'CREATE INDEX snap_to_replay_info_serial ON snap_to_replay_info (serial)',
+              'CREATE INDEX snap_to_replay_info_created ON snap_to_replay_info (created)')
+    # Rows of earlier versions count as created by the upgrade
+    UPGRADES = {2: ('ALTER TABLE snap_to_replay_info ADD COLUMN serial text',
+                    'ALTER TABLE snap_to_replay_info ADD COLUMN created real',
+                    "UPDATE snap_to_replay_info SET created=CAST(strftime('%s', 'now') AS real)") +
+                   CREATE[1:]}
+
+    # get_snap_info returned the first row of a snapshot, keep that one
+    COPY = ("INSERT OR IGNORE INTO snap_to_replay_info (snap_name, replay, created) "
+            "SELECT snap_name, replay, CAST(strftime('%%s', 'now') AS real) "
+            "FROM %s ORDER BY rowid")
 
     def setup(self):
         '''
         Creates database tables if they do not exist
         '''
-        c = self.conn_.cursor()
-        table_exists = False
-        for row in c.execute("SELECT name FROM sqlite_master WHERE type='table' "):
-            if row[0] == 'snap_to_replay_info':
-                table_exists = True
-                break
+        self.ensure_schema()
 
-        if not table_exists:
-            c.execute('CREATE TABLE snap_to_replay_info (snap_name text, replay text)')
-        self.conn_.commit()
+    # SnapCatalog recording the snapshots inserted and deleted, set by StateStore
+    catalog = None
 
-    def insert_snap_info(self, snap_name, replay):
-        c = self.conn_.cursor()
-        c.execute("INSERT INTO snap_to_replay_info VALUES ('%s', '%s')" % \
-                  (snap_name, replay))
-        self.conn_.commit()
+    def insert_snap_info(self, snap_name, replay, serial=None):
+        self.insert_many([(snap_name, replay, serial)])
+
+    def insert_many(self, rows):
+        '''
+        Inserts or updates (snap_name, replay) or (snap_name, replay, serial)
+        rows in one transaction
+        '''
+        now = time.time()
+        with self.transaction():
+            # The rows are merged here, not in the upsert, so SQLite versions
+            # without ON CONFLICT keep the same values
+            old = dict((row[0], row[1:]) for row in self.select_many(
+                'snap_name, replay, serial, created', [], [], 'snap_name',
+                [row[0] for row in rows]))
+            values = []
+            for row in rows:
+                snap_name = _text(row[0])
+                replay = _text(row[1])
+                serial = _text(row[2]) if len(row) > 2 else None
+                created = now
+                if snap_name in old:
+                    # get_snap_info returned the first row of a snapshot,
+                    # the first replay recorded is kept
+                    old_replay, old_serial, created = old[snap_name]
+                    if old_replay is not None:
+                        replay = old_replay
+                    if serial is None:
+                        serial = old_serial
+                old[snap_name] = (replay, serial, created)
+                values.append((snap_name, replay, serial, created))
+            self.upsert_many(('snap_name', 'replay', 'serial', 'created'), ('snap_name',),
+                             values)
+            if self.catalog is not None:
+                self.catalog.record_created([(v[2], v[0], v[1]) for v in values])
 
     def get_snap_info(self, snap_name):
-        c = self.conn_.cursor()
-        snap_names = (snap_name,)
-        c.execute("SELECT snap_name, replay "\
-		          "FROM snap_to_replay_info where snap_name=?", snap_names)
-        data = c.fetchone()
-        self.conn_.commit()
+        data = self.fetchone("SELECT snap_name, replay "\
+                             "FROM snap_to_replay_info where snap_name=?", (snap_name,))
         return data or ('', '')
 
+    def _filters(self, serial, older_than):
+        conditions = []
+        params = []
+        if serial is not None:
+            conditions.append('serial=?')
+            params.append(_text(serial))
+        if older_than is not None:
+            conditions.append('created<?')
+            params.append(older_than)
+        return conditions, params
+
+    def get_many(self, snap_names=None, serial=None, older_than=None):
+        '''
+        Returns the (snap_name, replay) rows matching all the filters given
+
+        snap_names : snapshot names
+        serial : LUN serial the snapshots were taken of
+        older_than : time.time() value, snapshots recorded before it
+        '''
+        conditions, params = self._filters(serial, older_than)
+        return self.select_many('snap_name, replay', conditions, params,
+                                'snap_name', snap_names)
+
     def delete_snap_info(self, snap_name):
-        c = self.conn_.cursor()
-        c.execute("DELETE FROM snap_to_replay_info where snap_name=?", (snap_name,))
-        self.conn_.commit()
+        with self.transaction():
+            self.execute("DELETE FROM snap_to_replay_info where snap_name=?", (snap_name,))
+            if self.catalog is not None:
+                self.catalog.record_removed([snap_name])
+
+    def delete_many(self, snap_names=None, serial=None, older_than=None):
+        '''
+        Deletes the rows get_many() would return, in one transaction
+
+        Returns the number of rows deleted
+        '''
+        conditions, params = self._filters(serial, older_than)
+        with self.transaction():
+            if self.catalog is not None:
+                removed = self.select_many('snap_name', conditions, params,
+                                           'snap_name', snap_names)
+                self.catalog.record_removed([row[0] for row in removed])
+            return Database.delete_many(self, conditions, params, 'snap_name', snap_names)
+
+
+class OpJournal(Database):
+    '''
+    Completed steps of running operations and their outputs
+    '''
+
+    TABLE = 'op_journal'
+    SCHEMA_VERSION = 1
+    CREATE = ('CREATE TABLE op_journal (operation text NOT NULL, step text NOT NULL, '
+              'seq integer, output text, updated real, PRIMARY KEY (operation, step))',
+              'CREATE INDEX op_journal_updated ON op_journal (updated)')
+
+    def get_steps(self, operation):
+        '''
+        Returns [(step, output)] of the operation in the order they completed
+        '''
+        return [(step, json.loads(output)) for step, output in
+                self.fetchall("SELECT step, output FROM op_journal "
+                              "WHERE operation=? ORDER BY seq", (operation,))]
+
+    def record_step(self, operation, step, seq, output):
+        self.upsert(('operation', 'step', 'seq', 'output', 'updated'), ('operation', 'step'),
+                    (operation, step, seq, json.dumps(output, default=str), time.time()))
+
+    def finish(self, operation):
+        self.execute("DELETE FROM op_journal WHERE operation=?", (operation,))
+
+    def prune(self, older_than):
+        '''
+        Drops the journals of operations not updated since older_than
+
+        Returns the number of steps dropped
+        '''
+        return self.execute("DELETE FROM op_journal WHERE operation IN "
+                            "(SELECT operation FROM op_journal GROUP BY operation "
+                            "HAVING max(updated) < ?)", (older_than,)).rowcount
+
+    def get_unfinished(self, older_than=None):
+        '''
+        Returns [(operation, steps completed, last update)] of the
+        operations which did not finish, optionally only those not
+        updated since older_than
+        '''
+        sql = "SELECT operation, count(*), max(updated) FROM op_journal GROUP BY operation"
+        params = ()
+        if older_than is not None:
+            sql += " HAVING max(updated) < ?"
+            params = (older_than,)
+        return self.fetchall(sql, params)
+
+
+class SnapCatalog(Database):
+    '''
+    History of the snapshots of each LUN (array, serial): Core issue time,
+    creation and removal time and the array's name for the snapshot.
+    Rows stay after the snapshot is removed until prune() drops them.
+    '''
+
+    TABLE = 'snap_catalog'
+    SCHEMA_VERSION = 1
+    CREATE = ('CREATE TABLE snap_catalog (id INTEGER PRIMARY KEY, array text NOT NULL, '
+              'serial text NOT NULL, snap_name text NOT NULL, array_id text, '
+              'issue_time real, created real, removed real, '
+              'UNIQUE (array, serial, snap_name))',
+              'CREATE INDEX snap_catalog_lun ON snap_catalog (array, serial, created)',
+              'CREATE INDEX snap_catalog_snap_name ON snap_catalog (snap_name)',
+              'CREATE INDEX snap_catalog_removed ON snap_catalog (removed)')
+
+    COLUMNS = 'array, serial, snap_name, array_id, issue_time, created, removed'
+
+    def __init__(self, path, array=None, issue_time=None):
+        Database.__init__(self, path)
+        # Array and Core issue time of the request recording snapshots
+        self.array = array or ''
+        self.issue_time = issue_time or None
+
+    def record_created(self, rows):
+        '''
+        Records (serial, snap_name, array_id) snapshots as created now
+        '''
+        now = time.time()
+        self.upsert_many(('array', 'serial', 'snap_name', 'array_id', 'issue_time', 'created'),
+                         ('array', 'serial', 'snap_name'),
+                         [(_text(self.array), _text(serial or ''), _text(snap_name),
+                           _text(array_id), _text(self.issue_time), now)
+                          for serial, snap_name, array_id in rows],
+                         ['array_id=excluded.array_id',
+                          'issue_time=coalesce(excluded.issue_time, issue_time)',
+                          'removed=NULL'])
+
+    def record_removed(self, snap_names):
+        '''
+        Records the snapshots as removed now
+        '''
+        conditions = ['removed IS NULL']
+        params = [time.time()]
+        if self.array:
+            conditions.append('array=?')
+            params.append(_text(self.array))
+        with self.transaction():
+            for sql, values in self._statements("UPDATE snap_catalog SET removed=?",
+                                                conditions, params, 'snap_name', snap_names):
+                # removed=? comes first in the statement, the conditions after it
+                self.execute(sql, values)
+
+    def get_history(self, array, serial, since=None, until=None, include_removed=True):
+        '''
+        Returns the catalog rows of a LUN created between since and until,
+        oldest first, as tuples of COLUMNS
+        '''
+        sql = "SELECT %s FROM snap_catalog WHERE array=? AND serial=?" % self.COLUMNS
+        params = [_text(array), _text(serial)]
+        if since is not None:
+            sql += " AND created>=?"
+            params.append(since)
+        if until is not None:
+            sql += " AND created<?"
+            params.append(until)
+        if not include_removed:
+            sql += " AND removed IS NULL"
+        return self.fetchall(sql + " ORDER BY created", params)
+
+    def prune(self, removed_before, batch=PRUNE_BATCH):
+        '''
+        Drops the snapshots removed before removed_before, batch rows per
+        transaction so drivers are not kept waiting
+
+        Returns the number of rows dropped
+        '''
+        pruned = 0
+        while True:
+            with self.transaction():
+                count = self.execute("DELETE FROM snap_catalog WHERE id IN "
+                                     "(SELECT id FROM snap_catalog WHERE removed<? LIMIT ?)",
+                                     (removed_before, batch)).rowcount
+            pruned += count
+            if count < batch:
+                return pruned
+
+
+class HelloCache(Database):
+    '''
+    HELLO results of the dispatcher by (array model, array, serial),
+    see src/hello_cache.py
+    '''
+
+    TABLE = 'hello_cache'
+    SCHEMA_VERSION = 1
+    CREATE = ('CREATE TABLE hello_cache (array_model text, array text, serial text, '
+              'status integer, stdout text, stderr text, expires real, '
+              'PRIMARY KEY (array_model, array, serial))',)
+
+    def get(self, array_model, array, serial):
+        '''
+        Returns the (status, stdout, stderr) cached for the LUN, None if
+        there is none or it expired
+        '''
+        return self.fetchone("SELECT status, stdout, stderr FROM hello_cache "
+                             "WHERE array_model=? AND array=? AND serial=? AND expires>?",
+                             (_text(array_model), _text(array), _text(serial), time.time()))
+
+    def put(self, array_model, array, serial, result, ttl):
+        self.upsert(('array_model', 'array', 'serial', 'status', 'stdout', 'stderr', 'expires'),
+                    ('array_model', 'array', 'serial'),
+                    (_text(array_model), _text(array), _text(serial),
+                     result[0], result[1], result[2], time.time() + ttl))
+
+    def invalidate(self, array_model, array):
+        '''
+        Drops the results cached for the array and the expired ones
+
+        Returns the number of rows dropped
+        '''
+        return self.execute("DELETE FROM hello_cache WHERE (array_model=? AND array=?) "
+                            "OR expires<=?",
+                            (_text(array_model), _text(array), time.time())).rowcount
+
+
+class InventoryCache(Database):
+    '''
+    Array objects by (array, kind, serial), shared by all drivers and kept
+    across requests, so resolving the Core's serial does not list the whole
+    array every time. Records are small JSON values holding only what the
+    driver needs, e.g. the volume name. Records expire after INVENTORY_TTL
+    seconds, the least recently used ones are dropped over
+    INVENTORY_MAX_ENTRIES.
+
+    Listings merged with sync() keep a fingerprint per object and a
+    high-water mark per (array, kind) in inventory_sync, so a refresh only
+    writes the objects which changed and may ask the array for the objects
+    changed since the mark. Drivers merge or drop the objects they create
+    or delete themselves instead of listing the array again.
+    '''
+
+    TABLE = 'inventory'
+    SCHEMA_VERSION = 2
+    CREATE = ('CREATE TABLE inventory (array text, kind text, serial text, '
+              'record text, expires real, used real, fingerprint text, '
+              'PRIMARY KEY (array, kind, serial))',
+              'CREATE INDEX inventory_used ON inventory (used)',
+              'CREATE TABLE inventory_sync (array text, kind text, mark text, '
+              'synced real, expires real, PRIMARY KEY (array, kind))')
+    UPGRADES = {2: ('ALTER TABLE inventory ADD COLUMN fingerprint text',) + CREATE[2:]}
+
+    def get(self, array, kind, serial):
+        '''
+        Returns the record of the object, None if it is not cached
+        '''
+        now = time.time()
+        key = (_text(array), kind, _text(serial))
+        # Records of a synced listing stay valid as long as the listing
+        data = self.fetchone("SELECT i.record, i.used FROM inventory i "
+                             "LEFT JOIN inventory_sync s ON s.array=i.array AND s.kind=i.kind "
+                             "WHERE i.array=? AND i.kind=? AND i.serial=? "
+                             "AND max(i.expires, ifnull(s.expires, 0))>?", key + (now,))
+        if data is None:
+            return None
+        # Recency is kept to the second, most hits do not write
+        if now - data[1] >= 1:
+            self.execute("UPDATE inventory SET used=? WHERE array=? AND kind=? AND serial=?",
+                         (now,) + key)
+        return json.loads(data[0])
+
+    def put(self, array, kind, serial, record):
+        self.put_many(array, kind, {serial: record})
+
+    def _trim(self):
+        count = self.fetchone("SELECT count(*) FROM inventory")[0]
+        if count > INVENTORY_MAX_ENTRIES:
+            self.execute("DELETE FROM inventory WHERE rowid IN (SELECT rowid FROM "
+                         "inventory ORDER BY used LIMIT ?)",
+                         (count - INVENTORY_MAX_ENTRIES,))
+
+    def put_many(self, array, kind, records, ttl=None):
+        '''
+        Caches {serial: record} objects of the array, e.g. everything a
+        full listing of the array returned
+        '''
+        now = time.time()
+        expires = now + (INVENTORY_TTL if ttl is None else ttl)
+        rows = [(_text(array), kind, _text(serial), json.dumps(record), expires, now)
+                for serial, record in records.items() if serial]
+        with self.transaction():
+            self.upsert_many(('array', 'kind', 'serial', 'record', 'expires', 'used'),
+                             ('array', 'kind', 'serial'), rows)
+            self._trim()
+
+    def get_sync(self, array, kind):
+        '''
+        Returns (mark, synced, fresh) of the last sync() of the array's
+        objects, (None, None, False) if they were never synced. fresh is
+        False once the listing expired or the array was invalidated.
+        '''
+        data = self.fetchone("SELECT mark, synced, expires FROM inventory_sync "
+                             "WHERE array=? AND kind=?", (_text(array), kind))
+        if data is None:
+            return None, None, False
+        return data[0], data[1], data[2] > time.time()
+
+    def sync(self, array, kind, records, fingerprints=None, mark=None,
+             complete=True, removed=(), ttl=None):
+        '''
+        Merges a listing of the array into the cache, writing only the
+        objects whose fingerprint changed
+
+        records : {serial: record} of the listing
+        fingerprints : {serial: fingerprint}, compact values which change
+                       when the object changes, by default the record
+        mark : high-water mark of the listing, e.g. the newest creation
+               time, returned by get_sync() for the next incremental listing
+        complete : records is the whole listing, cached objects missing
+                   from it are dropped. False when records only holds the
+                   objects changed since the last mark, or the objects
+                   the driver just created. Without a mark such a merge
+                   leaves the freshness of the listing as it is.
+        removed : serials known to be gone, for incremental listings
+
+        Returns (changed, dropped) object counts
+        '''
+        now = time.time()
+        expires = now + (INVENTORY_TTL if ttl is None else ttl)
+        array = _text(array)
+        if fingerprints is None:
+            fingerprints = {}
+        with self.transaction():
+            cached = dict(self.fetchall("SELECT serial, fingerprint FROM inventory "
+                                        "WHERE array=? AND kind=?", (array, kind)))
+            rows = []
+            for serial, record in records.items():
+                if not serial:
+                    continue
+                data = json.dumps(record)
+                fingerprint = _text(fingerprints.get(serial, data))
+                if cached.get(_text(serial)) != fingerprint:
+                    rows.append((array, kind, _text(serial), data, expires, now, fingerprint))
+            self.upsert_many(('array', 'kind', 'serial', 'record', 'expires', 'used',
+                              'fingerprint'), ('array', 'kind', 'serial'), rows)
+            if complete:
+                gone = set(cached) - set(_text(serial) for serial in records)
+            else:
+                gone = set(_text(serial) for serial in removed) & set(cached)
+            dropped = 0
+            if gone:
+                dropped = self.delete_many(['array=?', 'kind=?'], [array, kind],
+                                           'serial', sorted(gone))
+            if complete or mark is not None:
+                self.execute("INSERT OR REPLACE INTO inventory_sync VALUES (?, ?, ?, ?, ?)",
+                             (array, kind, _text(mark), now, expires))
+            self._trim()
+        return len(rows), dropped
+
+    def drop(self, array, kind, record):
+        '''
+        Drops the objects of the array with the record, e.g. the name of a
+        volume the driver deleted, and keeps the rest of the listing fresh
+
+        Returns the number of objects dropped
+        '''
+        return self.execute("DELETE FROM inventory WHERE array=? AND kind=? AND record=?",
+                            (_text(array), kind, json.dumps(record))).rowcount
+
+    def invalidate(self, array, kind=None):
+        '''
+        Expires the records of the array, of one kind if given. The
+        fingerprints and marks stay, the next sync() only writes what
+        changed. Records expired long ago are dropped.
+
+        Returns the number of records expired
+        '''
+        now = time.time()
+        conditions = ["array=?"]
+        params = [_text(array)]
+        if kind is not None:
+            conditions.append("kind=?")
+            params.append(kind)
+        where = " AND ".join(conditions)
+        with self.transaction():
+            self.execute("UPDATE inventory_sync SET expires=0 WHERE " + where, params)
+            count = self.execute("UPDATE inventory SET expires=0 WHERE " + where,
+                                 params).rowcount
+            self.execute("DELETE FROM inventory WHERE expires<? AND NOT EXISTS "
+                         "(SELECT 1 FROM inventory_sync s WHERE s.array=inventory.array "
+                         "AND s.kind=inventory.kind)", (now - INVENTORY_TTL,))
+        return count
+
+
+class Operation(object):
+    '''
+    Journal of one operation. step() runs a step and records its output,
+    a retried operation gets the recorded output instead of running the
+    step again. finish() drops the journal.
+
+    journal : OpJournal
+    key : values naming the operation, e.g. (operation, array, serial, snap name)
+    '''
+
+    def __init__(self, journal, key):
+        self.journal = journal
+        self.operation = '/'.join(str(part) for part in key)
+        self.steps = journal.get_steps(self.operation)
+        self.outputs = dict(self.steps)
+
+    def resuming(self):
+        '''
+        Returns True if an earlier attempt completed steps of the operation
+        '''
+        return bool(self.steps)
+
+    def last_step(self):
+        return self.steps[-1][0] if self.steps else None
+
+    def step(self, name, func, *args, **kwargs):
+        '''
+        Returns func(*args, **kwargs), or its recorded output if an
+        earlier attempt completed the step
+        '''
+        if name in self.outputs:
+            return self.outputs[name]
+        output = func(*args, **kwargs)
+        # Store what a retry would read back
+        output = json.loads(json.dumps(output, default=str))
+        self.journal.record_step(self.operation, name, len(self.steps), output)
+        self.steps.append((name, output))
+        self.outputs[name] = output
+        return output
+
+    def finish(self):
+        if self.steps:
+            self.journal.finish(self.operation)
+            self.steps = []
+            self.outputs = {}
+
+
+class StateStore(object):
+    '''
+    The handoff state of a work directory in one database file, STORE_DB.
+    The tables share one connection, so a transaction covers all of them.
+
+    work_dir : handoff work directory
+    array : array of the request, recorded in the snapshot catalog
+    issue_time : Core issue time of the request's snapshot
+    backend : backend of the clone and snapshot tables, STATE_BACKEND by default
+    '''
+
+    def __init__(self, work_dir, array=None, issue_time=None, backend=None):
+        self.work_dir = work_dir
+        self.path = os.path.join(work_dir, STORE_DB)
+        store_dir = os.path.dirname(self.path)
+        if not os.path.isdir(store_dir):
+            try:
+                os.makedirs(store_dir)
+            except OSError:
+                pass
+        self.creds = CredDB(self.path)
+        self.clones = ScriptDB(self.path)
+        self.snaps = SnapToReplayDB(self.path)
+        self.journal = OpJournal(self.path)
+        self.catalog = SnapCatalog(self.path, array, issue_time)
+        self.hello = HelloCache(self.path)
+        self.inventory = InventoryCache(self.path)
+        self.import_legacy()
+        if (backend or STATE_BACKEND) == 'journal':
+            self.use_journal()
+        self.snaps.catalog = self.catalog
+
+    def transaction(self):
+        return self.creds.transaction()
+
+    def import_legacy(self):
+        '''
+        Imports the database files of earlier versions found in the work
+        directory, once. Older files are imported first, so the newest
+        credentials of a host win.
+        '''
+        shared = self.creds.shared_
+        if 'legacy_import' in shared.checked:
+            return
+        tables = dict((db.TABLE, db) for db in (self.creds, self.clones, self.snaps))
+        pending = []
+        for name, table in LEGACY_DBS:
+            path = os.path.join(self.work_dir, name)
+            if os.path.isfile(path):
+                pending.append((os.path.getmtime(path), name, path, tables[table]))
+        if pending:
+            self.creds.execute("CREATE TABLE IF NOT EXISTS legacy_import "
+                               "(name text PRIMARY KEY, imported real)")
+        for _, name, path, db in sorted(pending):
+            if self.creds.fetchone("SELECT name FROM legacy_import WHERE name=?", (name,)):
+                continue
+            with shared.lock:
+                # ATTACH is not allowed inside a transaction
+                self.creds.execute("ATTACH DATABASE ? AS legacy", (path,))
+                try:
+                    with self.transaction():
+                        # Another process may have imported it in the meantime
+                        if self.creds.fetchone("SELECT name FROM legacy_import "
+                                               "WHERE name=?", (name,)):
+                            continue
+                        if self.creds.fetchone("SELECT name FROM legacy.sqlite_master "
+                                               "WHERE type='table' AND name=?",
+                                               (db.TABLE,)):
+                            db.copy_rows('legacy.' + db.TABLE)
+                        self.creds.execute("INSERT INTO legacy_import VALUES (?, ?)",
+                                           (name, time.time()))
+                finally:
+                    self.creds.execute("DETACH DATABASE legacy")
+        shared.checked.add('legacy_import')
+
+    def use_journal(self):
+        '''
+        Moves the clone and snapshot tables to the journal backend. Their
+        rows in the SQLite store are copied to the journal once.
+        '''
+        from src import journal_store
+        base = os.path.join(self.work_dir, journal_store.JOURNAL_BASE)
+        clones = journal_store.JournalScriptDB(base, self.path)
+        snaps = journal_store.JournalSnapToReplayDB(base, self.path)
+        shared = self.creds.shared_
+        if 'journal_import' not in shared.checked:
+            self.creds.execute("CREATE TABLE IF NOT EXISTS legacy_import "
+                               "(name text PRIMARY KEY, imported real)")
+            with self.transaction():
+                if not self.creds.fetchone("SELECT name FROM legacy_import WHERE name=?",
+                                           ('journal',)):
+                    with clones.transaction():
+                        clones.insert_many(self.clones.select_many(
+                            'lun, clone, snap_name, access_group', [], []))
+                        snaps.insert_many(self.snaps.select_many(
+                            'snap_name, replay, serial', [], []))
+                    self.creds.execute("INSERT INTO legacy_import VALUES (?, ?)",
+                                       ('journal', time.time()))
+            shared.checked.add('journal_import')
+        self.clones = clones
+        self.snaps = snaps
 
     def close(self):
-        self.conn_.close()
+        '''
+        The connection is shared with other users in this process
+        and closed when the process exits
+        '''
+        pass
+
+    def prune(self, keep_days=CATALOG_KEEP_DAYS, journal_keep_days=JOURNAL_KEEP_DAYS):
+        '''
+        Drops old catalog rows and abandoned operation journals, then
+        returns the free pages to the file system
+
+        Returns (catalog rows, journal steps) dropped
+        '''
+        now = time.time()
+        pruned = self.catalog.prune(now - keep_days * 86400)
+        with self.transaction():
+            steps = self.journal.prune(now - journal_keep_days * 86400)
+        self.vacuum()
+        return pruned, steps
+
+    def vacuum(self):
+        '''
+        Returns free pages to the file system. A store created before
+        auto_vacuum was enabled is converted with one full VACUUM.
+        '''
+        db = self.creds
+        with db.shared_.lock:
+            if db.fetchone('PRAGMA auto_vacuum')[0] != 2:
+                db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                db.execute('VACUUM')
+            else:
+                db.fetchall('PRAGMA incremental_vacuum')
+
+
+def get_option_parser():
+    '''
+    Returns argument parser
+    '''
+    parser = argparse.ArgumentParser(description="Handoff state store maintenance")
+    parser.add_argument("--work-dir",
+                        default=os.getcwd(),
+                        help="handoff work directory, the current directory by default")
+    parser.add_argument("--prune",
+                        action="store_true",
+                        default=False,
+                        help="drop old snapshot catalog rows and abandoned journals")
+    parser.add_argument("--keep-days",
+                        type=float,
+                        default=CATALOG_KEEP_DAYS,
+                        help="days removed snapshots stay in the catalog")
+    parser.add_argument("--history",
+                        nargs=2,
+                        metavar=('ARRAY', 'SERIAL'),
+                        help="list the snapshots of a LUN")
+    return parser
+
+
+def main():
+    args = get_option_parser().parse_args()
+    store = StateStore(args.work_dir)
+    if args.prune:
+        pruned, steps = store.prune(args.keep_days)
+        print("Pruned %d catalog rows and %d journal steps" % (pruned, steps))
+    if args.history:
+        print("%-30s %-20s %-19s %-19s %-19s" %
+              ('snapshot', 'array id', 'issued', 'created', 'removed'))
+        for row in store.catalog.get_history(*args.history):
+            times = [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+                     if isinstance(t, float) else str(t or '')
+                     for t in row[4:]]
+            print("%-30s %-20s %-19s %-19s %-19s" % ((row[2], row[3] or '') + tuple(times)))
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+###############################################################################
+#
+# (C) Copyright 2016 Riverbed Technology, Inc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+###############################################################################
+# Worker pool of the resident handoff service
+# Worker processes are started once and each one owns the arrays routed to
+# it: every request for an array goes to the same worker, which keeps the
+# driver modules loaded, so login state kept in driver globals survives
+# between operations. Requests for arrays on different workers run in
+# parallel without sharing a GIL.
+# Each worker runs one request at a time: in-process drivers keep their
+# state in module globals and run one at a time in any process
+# (dispatch._driver_lock), so a request id on the pipe would gain nothing.
+# Arrays sharing a worker queue behind each other whatever max_concurrency
+# or admission slots they have, so POOL_SIZE should be at least the number
+# of arrays busy at the same time, with AFFINITY splitting busy arrays
+# which share a worker.
+###############################################################################
+
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import zlib
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import dispatch
+from src import driver_args
+from src import inflight
+from src import registry
+
+# Configuration defaults
+# Number of worker processes
+POOL_SIZE = 4
+# Arrays pinned to a worker: {'10.1.1.1': 0, 'eva-cv.example.com': 1}
+# Arrays not listed here are spread over the workers by name.
+AFFINITY = {}
+
+
+def _worker_main(conn):
+    '''
+    Worker process loop, runs one request at a time
+    '''
+    # Ctrl+C in the service console is handled by the service process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # WorkerPool.run() already holds the single-flight lock of the request
+    dispatch.COALESCE_REQUESTS = False
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+        array_model, argv = request
+        try:
+            result = dispatch.run(array_model, argv)
+        except Exception as e:
+            result = (1, '', 'Handoff worker failed: %s\n' % e)
+        conn.send(result)
+    conn.close()
+
+
+class Worker(object):
+    '''
+    One worker process and the pipe to it
+
+    index : worker number, used in the process name
+    '''
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_worker_main,
+                                          args=(child_conn,),
+                                          name='handoff-worker-%d' % self.index)
+        process.daemon = True
+        process.start()
+        child_conn.close()
+        self.process = process
+        self.conn = parent_conn
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def call(self, array_model, argv):
+        '''
+        Runs a request on the worker, restarting it first if it died.
+        Requests wait for the ones before them on this worker.
+
+        Returns (exit status, stdout, stderr)
+        '''
+        with self.lock:
+            if not self.alive():
+                self.stop()
+                self.start()
+            self.requests += 1
+            try:
+                self.conn.send((array_model, list(argv)))
+                return self.conn.recv()
+            except (EOFError, OSError) as e:
+                # The request may have been half way through, report it
+                # to the Core rather than run it again
+                self.stop()
+                return (1, '', 'Handoff worker %d failed: %s\n' % (self.index, e))
+
+    def stop(self):
+        if self.conn is not None:
+            try:
+                self.conn.send(None)
+            except (EOFError, OSError):
+                pass
+            self.conn.close()
+            self.conn = None
+        if self.process is not None:
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+
+
+class WorkerPool(object):
+    '''
+    Routes requests to worker processes by storage array
+
+    size : number of worker processes
+    affinity : {array: worker index} overriding the default routing
+    '''
+
+    def __init__(self, size=POOL_SIZE, affinity=None):
+        self.size = max(1, size)
+        self.affinity = dict(AFFINITY if affinity is None else affinity)
+        self.workers = [Worker(i) for i in range(self.size)]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def close(self):
+        for worker in self.workers:
+            with worker.lock:
+                worker.stop()
+
+    def worker_index(self, array):
+        '''
+        Returns the index of the worker owning the array
+        '''
+        if array in self.affinity:
+            return int(self.affinity[array]) % self.size
+        # crc32 rather than hash() so an array keeps its worker across restarts
+        return zlib.crc32((array or '').encode('utf-8')) % self.size
+
+    def run(self, array_model, argv):
+        '''
+        Runs a Core request on the worker owning its array. Drivers which
+        cannot run in-process are started by the calling thread directly,
+        a worker would only add a hop in front of the child interpreter.
+
+        Returns (exit status, stdout, stderr)
+        '''
+        info = registry.get_driver(array_model)
+        if info is None or not info.in_process:
+            return dispatch.run(array_model, argv)
+        array = driver_args.get_option(argv, '--array')
+        worker = self.workers[self.worker_index(array)]
+        key = dispatch.request_key(array_model, argv) if dispatch.COALESCE_REQUESTS else None
+        if key is None:
+            return worker.call(array_model, argv)
+        # A retry queued behind the request it duplicates would find it
+        # finished and run again, so coalesce before queueing on the worker
+        return tuple(inflight.single_flight(
+            key, lambda: tuple(worker.call(array_model, argv))))
+
+
+def parse_affinity(values):
+    '''
+    Converts ARRAY=WORKER strings to an affinity dict
+    '''
+    affinity = {}
+    for value in values or []:
+        array, _, index = value.rpartition('=')
+        if not array:
+            raise ValueError("Invalid affinity '%s', expected ARRAY=WORKER" % value)
+        affinity[array] = int(index)
+    return affinity
@@ -0,0 +1,89 @@
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import admission
+from src import dispatch
+from src import filelock
+from src import lun_locks
+
+
+class TestAdmission(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = (admission.ADMISSION_DIR, admission.ADMISSION_DB,
+                      admission.ARRAY_CONCURRENCY, admission.RATE_LIMITS,
+                      admission.ADMISSION_TIMEOUT, lun_locks.LOCK_DIR)
+        admission.ADMISSION_DIR = os.path.join(self.dir, 'admission')
+        admission.ADMISSION_DB = os.path.join(self.dir, 'admission.db')
+        admission.ARRAY_CONCURRENCY = {'array': 2}
+        admission.RATE_LIMITS = {'array': (1000, 1000)}
+        lun_locks.LOCK_DIR = os.path.join(self.dir, 'locks')
+
+    def tearDown(self):
+        (admission.ADMISSION_DIR, admission.ADMISSION_DB,
+         admission.ARRAY_CONCURRENCY, admission.RATE_LIMITS,
+         admission.ADMISSION_TIMEOUT, lun_locks.LOCK_DIR) = self.saved
+        shutil.rmtree(self.dir)
+
+    def admit_time(self, array='array'):
+        start = time.time()
+        with admission.admit('model', array, timeout=5):
+            pass
+        return time.time() - start
+
+    def test_slot_limit(self):
+        with admission.admit('model', 'array'):
+            with admission.admit('model', 'array'):
+                self.assertRaises(filelock.LockTimeout,
+                                  admission.admit('model', 'array', timeout=0.3).__enter__)
+                self.assertEqual(admission.get_status()[0]['running'], 2)
+                # Other arrays have their own slots
+                self.assertTrue(self.admit_time('other') < 1)
+            self.assertTrue(self.admit_time() < 1)
+        status = admission.get_status()
+        self.assertEqual([row['array'] for row in status], ['array', 'other'])
+        self.assertEqual(status[0]['admitted'], 3)
+        self.assertEqual(status[0]['running'], 0)
+
+    def test_timeout_is_busy(self):
+        admission.ARRAY_CONCURRENCY = {'array': 1}
+        admission.ADMISSION_TIMEOUT = 0.3
+        with admission.admit('model', 'array'):
+            status, out, err = dispatch.run_driver('model', ['--array', 'array',
+                                                             '--operation', 'HELLO'])
+        self.assertEqual(status, errno.EBUSY)
+        self.assertTrue('admission' in err)
+
+    def test_bucket_refill(self):
+        admission.RATE_LIMITS = {'array': (5, 2)}
+        # The burst goes through, the next request waits for a token
+        self.assertTrue(self.admit_time() < 0.1)
+        self.assertTrue(self.admit_time() < 0.1)
+        self.assertTrue(0.1 < self.admit_time() < 1)
+        time.sleep(0.5)
+        self.assertTrue(self.admit_time() < 0.1)
+        self.assertTrue(self.admit_time() < 0.1)
+
+    def test_rate_wait_keeps_slot_free(self):
+        admission.ARRAY_CONCURRENCY = {'array': 1}
+        admission.RATE_LIMITS = {'array': (1, 1)}
+        self.admit_time()
+        waiter = threading.Thread(target=self.admit_time)
+        waiter.start()
+        time.sleep(0.3)
+        # The second request waits for its token without holding the slot
+        slot = admission._try_slot('array', 1)
+        self.assertIsNotNone(slot)
+        slot.release()
+        waiter.join()
+
+if __name__ == '__main__':
+    unittest.main()
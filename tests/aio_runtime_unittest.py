@@ -0,0 +1,65 @@
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import admission
+from src import aio_runtime
+from src import dispatch
+from src import lun_locks
+
+
+def fake_main(argv):
+    print(' '.join(argv))
+    sys.stderr.write('done\n')
+    if '--fail' in argv:
+        sys.exit(3)
+
+
+class TestDriverRuntime(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = (admission.ADMISSION_DIR, admission.ADMISSION_DB,
+                      admission.ARRAY_CONCURRENCY, admission.ADMISSION_TIMEOUT,
+                      lun_locks.LOCK_DIR, dispatch.COALESCE_REQUESTS)
+        admission.ADMISSION_DIR = os.path.join(self.dir, 'admission')
+        admission.ADMISSION_DB = os.path.join(self.dir, 'admission.db')
+        lun_locks.LOCK_DIR = os.path.join(self.dir, 'locks')
+        dispatch.COALESCE_REQUESTS = False
+        dispatch._drivers['fake'] = types.SimpleNamespace(main=fake_main)
+        self.runtime = aio_runtime.DriverRuntime(2)
+
+    def tearDown(self):
+        self.runtime.close()
+        del dispatch._drivers['fake']
+        (admission.ADMISSION_DIR, admission.ADMISSION_DB,
+         admission.ARRAY_CONCURRENCY, admission.ADMISSION_TIMEOUT,
+         lun_locks.LOCK_DIR, dispatch.COALESCE_REQUESTS) = self.saved
+        shutil.rmtree(self.dir)
+
+    def test_run_driver(self):
+        argv = ['--array', 'array', '--operation', 'CHECK_LUN', '--serial', 'lun1']
+        status, out, err = self.runtime.run(self.runtime.run_driver('fake', argv))
+        self.assertEqual((status, out, err), (0, ' '.join(argv) + '\n', 'done\n'))
+        status, out, err = self.runtime.run(
+            self.runtime.run_driver('fake', argv + ['--fail']))
+        self.assertEqual(status, 3)
+
+    def test_run_driver_admission(self):
+        # Batch requests wait for an array session slot like single requests
+        admission.ARRAY_CONCURRENCY = {'array': 1}
+        admission.ADMISSION_TIMEOUT = 0.3
+        argv = ['--array', 'array', '--operation', 'CHECK_LUN', '--serial', 'lun1']
+        with admission.admit('fake', 'array'):
+            status, out, err = self.runtime.run(self.runtime.run_driver('fake', argv))
+        self.assertEqual(status, errno.EBUSY)
+        self.assertEqual(out, '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import io
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import batch
+from src import driver_args
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+
+    def fake_run(self, array_model, argv):
+        array = driver_args.get_option(argv, '--array')
+        with self.lock:
+            self.running[array] = self.running.get(array, 0) + 1
+            total = sum(self.running.values())
+            self.peak[array] = max(self.peak.get(array, 0), self.running[array])
+            self.peak['total'] = max(self.peak.get('total', 0), total)
+        time.sleep(0.05)
+        with self.lock:
+            self.running[array] -= 1
+        return 0, driver_args.get_option(argv, '--snap-name') + '\n', ''
+
+    def test_operation_argv(self):
+        op = {'id': 'a', 'array_model': 'hpeva', 'array': '10.1.1.1',
+              'snap_name': 'snap1', 'system': None}
+        self.assertEqual(batch.operation_argv(op),
+                         ['--array', '10.1.1.1', '--snap-name', 'snap1'])
+        self.assertEqual(batch.operation_argv({'argv': ['--array', 1]}),
+                         ['--array', '1'])
+
+    def test_limits(self):
+        lines = []
+        for i in range(12):
+            lines.append('{"array_model": "hpeva", "array": "a%d", '
+                         '"operation": "CREATE_SNAP", "snap_name": "s%d"}'
+                         % (i % 3, i))
+        lines.append('not json')
+        out = io.StringIO()
+        failed = batch.run_batch(io.StringIO('\n'.join(lines)), out,
+                                 max_workers=4, max_per_array=2,
+                                 run_func=self.fake_run)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(results), 13)
+        self.assertEqual(failed, 1)
+        self.assertLessEqual(self.peak['total'], 4)
+        for array in ('a0', 'a1', 'a2'):
+            self.assertLessEqual(self.peak[array], 2)
+        outputs = set(r['output'] for r in results if r['status'] == 0)
+        self.assertEqual(outputs, set('s%d' % i for i in range(12)))
+
+if __name__ == '__main__':
+    unittest.main()
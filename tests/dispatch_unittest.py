@@ -0,0 +1,120 @@
+import contextlib
+import errno
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import admission
+from src import dispatch
+from src import lun_locks
+from src import registry
+
+DRIVER = '''
+import sys
+
+def main(argv):
+    print(' '.join(argv))
+    sys.stderr.write('done\\n')
+    if '--fail' in argv:
+        sys.exit(3)
+    if '--message' in argv:
+        sys.exit('failed')
+    if '--crash' in argv:
+        raise RuntimeError('crash')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+'''
+
+NO_MAIN = '''
+def run(argv):
+    pass
+'''
+
+
+class TestDispatch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for model, source in (('fakedrv', DRIVER), ('nomain', NO_MAIN)):
+            os.makedirs(os.path.join(self.dir, model))
+            with open(os.path.join(self.dir, model, dispatch.DRIVER_SCRIPT), 'w') as f:
+                f.write(source)
+            with open(os.path.join(self.dir, model, '__init__.py'), 'w') as f:
+                f.write('')
+        sys.path.insert(0, self.dir)
+        self.saved = (dispatch.LIBS_DIR, dispatch.DRIVER_MODULE, dispatch.COALESCE_REQUESTS,
+                      lun_locks.LOCK_DIR, lun_locks.LOCK_TIMEOUT, admission.ADMISSION_CONTROL)
+        dispatch.LIBS_DIR = self.dir
+        dispatch.DRIVER_MODULE = '%s.SteelFusionHandoff'
+        dispatch.COALESCE_REQUESTS = False
+        lun_locks.LOCK_DIR = os.path.join(self.dir, 'locks')
+        admission.ADMISSION_CONTROL = False
+        self.set_driver('fakedrv')
+        self.set_driver('nomain')
+
+    def tearDown(self):
+        (dispatch.LIBS_DIR, dispatch.DRIVER_MODULE, dispatch.COALESCE_REQUESTS,
+         lun_locks.LOCK_DIR, lun_locks.LOCK_TIMEOUT, admission.ADMISSION_CONTROL) = self.saved
+        for model in ('fakedrv', 'nomain'):
+            registry._drivers.pop(model, None)
+            dispatch._drivers.pop(model, None)
+            for name in (model, model + '.SteelFusionHandoff'):
+                sys.modules.pop(name, None)
+        sys.path.remove(self.dir)
+        shutil.rmtree(self.dir)
+
+    def set_driver(self, model, **capabilities):
+        registry._drivers[model] = registry.DriverInfo(model, capabilities)
+        dispatch._drivers.pop(model, None)
+
+    def test_load_driver(self):
+        module = dispatch.load_driver('fakedrv')
+        self.assertTrue(callable(module.main))
+        self.assertIs(dispatch.load_driver('fakedrv'), module)
+        self.assertIsNone(dispatch.load_driver('nomain'))
+        self.assertIsNone(dispatch.load_driver('unknown'))
+        self.set_driver('fakedrv', in_process=False)
+        self.assertIsNone(dispatch.load_driver('fakedrv'))
+
+    def test_exit_status(self):
+        self.assertEqual(dispatch.exit_status(None), 0)
+        self.assertEqual(dispatch.exit_status(4), 4)
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            self.assertEqual(dispatch.exit_status('failed'), 1)
+        self.assertEqual(err.getvalue(), 'failed\n')
+
+    def test_run_in_process(self):
+        module = dispatch.load_driver('fakedrv')
+        self.assertEqual(dispatch.run_in_process(module, ['--array', 'a']),
+                         (0, '--array a\n', 'done\n'))
+        self.assertEqual(dispatch.run_in_process(module, ['--fail'])[0], 3)
+        self.assertEqual(dispatch.run_in_process(module, ['--message']),
+                         (1, '--message\n', 'done\nfailed\n'))
+        status, out, err = dispatch.run_in_process(module, ['--crash'])
+        self.assertEqual(status, 1)
+        self.assertTrue('RuntimeError: crash' in err)
+
+    def test_subprocess_fallback(self):
+        self.set_driver('fakedrv', in_process=False)
+        self.assertEqual(dispatch.run('fakedrv', ['--array', 'a', '--operation', 'CHECK_LUN']),
+                         (0, '--array a --operation CHECK_LUN\n', 'done\n'))
+        self.assertEqual(dispatch.run('fakedrv', ['--fail'])[0], 3)
+
+    def test_lock_timeout_is_busy(self):
+        lun_locks.LOCK_TIMEOUT = 0.2
+        argv = ['--array', 'a', '--serial', 'lun1', '--operation', 'CREATE_SNAP']
+        with lun_locks.operation_locks('fakedrv', argv):
+            status, out, err = dispatch.run_driver('fakedrv', argv)
+        self.assertEqual((status, out), (errno.EBUSY, ''))
+        self.assertTrue('same LUN' in err)
+        self.assertEqual(dispatch.run_driver('fakedrv', argv)[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import handoff_service
+
+
+class TestHandoffService(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = handoff_service.SERVICE_FILE
+        handoff_service.SERVICE_FILE = os.path.join(self.dir, 'handoff_service.json')
+        self.server = handoff_service.HandoffService(('127.0.0.1', 0),
+                                                     handoff_service.HandoffRequestHandler)
+        self.server.token = handoff_service.new_token()
+        self.server.run = lambda array_model, argv: (0, ' '.join(argv) + '\n', '')
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        handoff_service.write_service_file('127.0.0.1', self.server.server_address[1],
+                                           self.server.token)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        handoff_service.SERVICE_FILE = self.saved
+        shutil.rmtree(self.dir)
+
+    def test_token(self):
+        argv = ['--array', 'array', '--operation', 'HELLO']
+        self.assertEqual(handoff_service.call_service('hpeva', argv),
+                         (0, ' '.join(argv) + '\n', ''))
+        if os.name != 'nt':
+            mode = os.stat(handoff_service.SERVICE_FILE).st_mode
+            self.assertEqual(stat.S_IMODE(mode), 0o600)
+        # A client without the token is refused
+        with open(handoff_service.SERVICE_FILE) as f:
+            info = json.load(f)
+        os.remove(handoff_service.SERVICE_FILE)
+        for token in ('wrong', u'é'):
+            info['token'] = token
+            with open(handoff_service.SERVICE_FILE, 'w') as f:
+                json.dump(info, f)
+            status, out, err = handoff_service.call_service('hpeva', argv)
+            self.assertEqual((status, out), (1, ''))
+            self.assertTrue('invalid token' in err)
+
+    def test_loopback_only(self):
+        for host in ('127.0.0.1', '::1', 'localhost', '127.0.0.2'):
+            self.assertTrue(handoff_service.is_loopback(host))
+        for host in ('0.0.0.0', '10.1.1.1', '::', 'no-such-host.invalid'):
+            self.assertFalse(handoff_service.is_loopback(host))
+
+
+if __name__ == '__main__':
+    unittest.main()
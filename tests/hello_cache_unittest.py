@@ -0,0 +1,57 @@
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import hello_cache
+from src import script_db
+
+
+class TestHelloCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.calls = []
+
+    def tearDown(self):
+        script_db.close_all()
+        shutil.rmtree(self.dir)
+
+    def argv(self, operation, serial='lun1', array='array'):
+        return ['--work-dir', self.dir, '--array', array, '--serial', serial,
+                '--operation', operation]
+
+    def request(self, operation, result=(0, 'OK\n', ''), **kwargs):
+        def func():
+            self.calls.append(operation)
+            return result
+        return hello_cache.cached('model', self.argv(operation, **kwargs), func)
+
+    def test_hello_cached_until_snapshot_operation(self):
+        self.assertEqual(self.request('HELLO'), (0, 'OK\n', ''))
+        self.assertEqual(self.request('HELLO', serial='LUN1'), (0, 'OK\n', ''))
+        self.assertEqual(self.calls, ['HELLO'])
+        # Other arrays keep their results
+        self.request('HELLO', array='other')
+        self.request('CREATE_SNAP', array='other')
+        self.request('HELLO')
+        self.assertEqual(self.calls, ['HELLO', 'HELLO', 'CREATE_SNAP'])
+        self.request('REMOVE_SNAP')
+        self.request('HELLO')
+        self.assertEqual(self.calls[-2:], ['REMOVE_SNAP', 'HELLO'])
+
+    def test_negative_caching(self):
+        self.request('HELLO', (1, 'Lun lun1 not found\n', ''))
+        self.assertEqual(self.request('HELLO'), (1, 'Lun lun1 not found\n', ''))
+        self.assertEqual(len(self.calls), 1)
+        # Timeouts and crashes are not cached
+        self.request('HELLO', (errno.EBUSY, '', 'timed out\n'), serial='lun2')
+        self.request('HELLO', (1, '', 'Traceback (most recent call last):\n'), serial='lun2')
+        self.request('HELLO', serial='lun2')
+        self.assertEqual(len(self.calls), 4)
+
+if __name__ == '__main__':
+    unittest.main()
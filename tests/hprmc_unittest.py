@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src.libs.hprmc import SteelFusionHandoff as hprmc
+
+POLICIES = {'backupPolicies': [{'name': 'daily', 'id': '1'},
+                               {'name': 'a b&c#"d', 'id': '2'}]}
+
+
+class Response(object):
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.content = json.dumps(body or {}).encode('utf-8')
+        self.text = self.content.decode('utf-8')
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, size):
+        return iter([self.content[i:i + size] for i in range(0, len(self.content), size)])
+
+    def close(self):
+        pass
+
+
+class TestHpRmc(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (hprmc.http_transport.request, hprmc.script_log,
+                      hprmc.COLLECTION_FILTER, hprmc.session_key, hprmc.session_renewed)
+        hprmc.http_transport.request = self.request
+        hprmc.script_log = lambda msg: None
+        hprmc.parameters = ''
+        hprmc._sessions.clear()
+        self.sent = []
+        self.replies = []
+
+    def tearDown(self):
+        (hprmc.http_transport.request, hprmc.script_log,
+         hprmc.COLLECTION_FILTER, hprmc.session_key, hprmc.session_renewed) = self.saved
+        hprmc._sessions.clear()
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.sent.append((method, url, dict(headers or {})))
+        if url.endswith('/login-sessions'):
+            token = 'token%d' % len([s for s in self.sent if s[1].endswith('/login-sessions')])
+            return Response(200, {'loginSession': {'access': {'token': {'id': token}}}})
+        return self.replies.pop(0)
+
+    def test_filtered_request(self):
+        self.replies = [Response(200, {'backupPolicies': POLICIES['backupPolicies'][1:]})]
+        policy = hprmc.hprmchost_find('rmc', {}, 'backup-policies', 'backupPolicies',
+                                      'name', 'a b&c#"d')
+        self.assertEqual(policy['id'], '2')
+        self.assertTrue(self.sent[0][1].endswith(
+            '/backup-policies?filter=name%20eq%20%22a%20b%26c%23%22d%22'))
+
+    def test_unfiltered_fallback(self):
+        self.replies = [Response(400), Response(200, POLICIES)]
+        members = hprmc.hprmchost_list('rmc', {}, 'backup-policies', 'backupPolicies',
+                                       'name', 'daily')
+        self.assertEqual(members, POLICIES['backupPolicies'][:1])
+        self.assertTrue('?filter=' in self.sent[0][1])
+        self.assertTrue(self.sent[1][1].endswith('/backup-policies'))
+        # Filtering turned off
+        hprmc.COLLECTION_FILTER = ''
+        self.replies = [Response(200, POLICIES)]
+        self.assertEqual(len(hprmc.hprmchost_list('rmc', {}, 'backup-policies',
+                                                  'backupPolicies')), 2)
+        self.assertTrue(self.sent[2][1].endswith('/backup-policies'))
+
+    def test_token_reuse_and_renewal(self):
+        self.assertEqual(hprmc.get_session_token('rmc', 'user', 'pwd'), 'token1')
+        self.assertEqual(hprmc.get_session_token('rmc', 'user', 'pwd'), 'token1')
+        self.assertEqual(len(self.sent), 1)
+        hprmc.session_key = ('rmc', 'user', 'pwd')
+        hprmc.session_renewed = False
+        headers = {'X-Auth-Token': 'token1'}
+        self.replies = [Response(401), Response(200, {'ok': True})]
+        response = hprmc.hprmchost_get('rmc', headers, 'storage-pools')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sent[-1][2]['X-Auth-Token'], 'token2')
+        self.assertEqual(hprmc.get_session_token('rmc', 'user', 'pwd'), 'token2')
+        # Renewed once per request only
+        self.replies = [Response(401)]
+        self.assertEqual(hprmc.hprmchost_get('rmc', headers, 'storage-pools').status_code, 401)
+        self.assertEqual(len([s for s in self.sent if s[1].endswith('/login-sessions')]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import http_transport
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        data = io.BytesIO()
+        with gzip.GzipFile(fileobj=data, mode='wb') as f:
+            f.write(b'{"members": []}' * 100)
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data.getvalue())))
+        self.end_headers()
+        self.wfile.write(data.getvalue())
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(requests is None, "requests is not installed")
+class TestHttpTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.stats_db = http_transport.STATS_DB
+        http_transport.STATS_DB = os.path.join(self.work_dir, 'var', 'http_transport.db')
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/api' % self.server.server_address[1]
+
+    def tearDown(self):
+        http_transport.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        http_transport.STATS_DB = self.stats_db
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_connection_reuse(self):
+        for i in range(5):
+            reply = http_transport.get(self.url + '/volumes/%d' % i)
+            self.assertEqual(reply.content, b'{"members": []}' * 100)
+        http_transport.flush_stats()
+        http_transport.get(self.url)
+        http_transport.close_all()
+        status = http_transport.get_status()
+        self.assertEqual(len(status), 1)
+        self.assertEqual(status[0]['requests'], 6)
+        self.assertEqual(status[0]['connections'], 1)
+        self.assertEqual(status[0]['reused'], 5)
+        self.assertEqual(status[0]['errors'], 0)
+        # Compressed bytes on the wire
+        self.assertTrue(0 < status[0]['bytes'] < 6 * 1500)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import filelock
+from src import inflight
+
+ROOT_DIR = os.path.abspath(os.path.dirname(__file__) + '/' + '..')
+
+# Holds the request key in a second process for a while
+HOLDER = '''
+import sys, time
+sys.path.append(%r)
+from src import filelock
+from src import inflight
+inflight.INFLIGHT_DIR = %r
+def work():
+    sys.stdout.write("started\\n")
+    sys.stdout.flush()
+    time.sleep(0.5)
+    return (0, "from-holder", "")
+inflight.single_flight(("m", "a", "s", "CREATE_SNAP", "snap1"), work)
+'''
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        inflight.INFLIGHT_DIR = self.dir
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def work(self):
+        self.calls += 1
+        time.sleep(0.2)
+        return (0, 'snap1', '')
+
+    def test_threads(self):
+        key = ('m', 'a', 's', 'CREATE_SNAP', 'snap1')
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(inflight.single_flight(key, self.work)))
+            for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [(0, 'snap1', '')] * 5)
+        self.assertFalse(inflight.in_flight(key))
+        # A request arriving after the first one finished runs again
+        inflight.single_flight(key, self.work)
+        self.assertEqual(self.calls, 2)
+
+    def test_processes(self):
+        key = ('m', 'a', 's', 'CREATE_SNAP', 'snap1')
+        proc = subprocess.Popen([sys.executable, '-c', HOLDER % (ROOT_DIR, self.dir)],
+                                stdout=subprocess.PIPE)
+        proc.stdout.readline()
+        self.assertTrue(inflight.in_flight(key))
+        result = inflight.single_flight(key, self.work)
+        proc.wait()
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(result, (0, 'from-holder', ''))
+
+    def test_result_written_during_lock_attempt(self):
+        key = ('m', 'a', 's', 'CREATE_SNAP', 'snap1')
+        saved = inflight.filelock.FileLock
+
+        class RacingLock(object):
+            # The running request finishes right after the failed attempt
+            def __init__(self, path):
+                pass
+
+            def acquire(self, blocking=True):
+                if not blocking:
+                    inflight._write_result(key, (0, 'from-holder', ''))
+                    return False
+                return True
+
+            def release(self):
+                pass
+
+        inflight.filelock.FileLock = RacingLock
+        try:
+            result = inflight.single_flight(key, self.work)
+        finally:
+            inflight.filelock.FileLock = saved
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(result, (0, 'from-holder', ''))
+
+    @unittest.skipIf(os.name == 'nt', 'Windows does not remove open files')
+    def test_prune_keeps_one_lock_per_key(self):
+        path = os.path.join(self.dir, 'key.lock')
+        first = filelock.FileLock(path)
+        first.acquire()
+        waiter = filelock.FileLock(path)
+        locked = threading.Event()
+
+        def wait():
+            waiter.acquire(timeout=5)
+            locked.set()
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        time.sleep(0.3)
+        # prune() removes the file while it holds the lock, the waiter
+        # has it open already
+        os.remove(path)
+        first.release()
+        self.assertTrue(locked.wait(5))
+        thread.join()
+        try:
+            self.assertFalse(filelock.FileLock(path).acquire(blocking=False))
+        finally:
+            waiter.release()
+        old = time.time() - inflight.PRUNE_AGE - 1
+        os.utime(path, (old, old))
+        inflight.prune()
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import journal_store
+from src import script_db
+
+
+class TestJournalStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.base = os.path.join(self.dir, 'handoff.journal')
+
+    def tearDown(self):
+        journal_store.close_all()
+        script_db.close_all()
+        shutil.rmtree(self.dir)
+
+    def reopen(self):
+        # A new process reads the state back from the files
+        journal_store.close_all()
+        return (journal_store.JournalScriptDB(self.base),
+                journal_store.JournalSnapToReplayDB(self.base))
+
+    def test_same_results_as_sqlite(self):
+        store = script_db.StateStore(self.dir)
+        sdb = journal_store.JournalScriptDB(self.base)
+        rdb = journal_store.JournalSnapToReplayDB(self.base)
+        for db in (store.clones, sdb):
+            db.insert_many([('L1', 'C1', 's1', 'g1'), ('L1', 'C2', 's2', 'g1'),
+                            ('L2', 'C3', 's1', 'g2')])
+            db.insert_clone_info('L1', 'C1', 's3', 'g1')
+            db.delete_many(access_group='g2')
+        for db in (store.snaps, rdb):
+            db.insert_many([('s1', 'R1', 'L1'), ('s2', 'R2', 'L2')])
+            db.insert_snap_info('s1', 'R9')
+            db.delete_snap_info('s2')
+        sdb, rdb = self.reopen()
+        self.assertEqual(sdb.get_clone_info('L1'), store.clones.get_clone_info('L1'))
+        self.assertEqual(sorted(sdb.get_many(luns=['L1', 'L2'])),
+                         sorted(store.clones.get_many(luns=['L1', 'L2'])))
+        self.assertEqual(rdb.get_many(serial='L1'), store.snaps.get_many(serial='L1'))
+        self.assertEqual(rdb.get_snap_info('s2'), ('', ''))
+        self.assertRaises(ValueError, rdb.delete_many)
+
+    def test_compaction_and_torn_write(self):
+        sdb, rdb = self.reopen()
+        sdb.insert_clone_info('L1', 'C1', 's1', 'g')
+        sdb.log_.compact()
+        rdb.insert_snap_info('s1', 'R1', 'L1')
+        # A writer crashed half way through a line
+        with open(sdb.log_.log_path(), 'ab') as f:
+            f.write(b'["p","clone_info",["L9"')
+        sdb, rdb = self.reopen()
+        sdb.insert_clone_info('L2', 'C2', 's2', 'g')
+        sdb, rdb = self.reopen()
+        self.assertEqual(sdb.get_clone_info('L1'), ('C1', 's1', 'g'))
+        self.assertEqual(sdb.get_clone_info('L2'), ('C2', 's2', 'g'))
+        self.assertEqual(rdb.get_snap_info('s1'), ('s1', 'R1'))
+        self.assertEqual(sdb.get_clone_info('L9'), ('', '', ''))
+        self.assertFalse(os.path.exists(self.base + '.0.log'))
+
+    def test_state_store_backend(self):
+        store = script_db.StateStore(self.dir)
+        store.clones.insert_clone_info('L1', 'C1', 's1', 'g')
+        store = script_db.StateStore(self.dir, backend='journal')
+        self.assertEqual(store.clones.get_clone_info('L1'), ('C1', 's1', 'g'))
+        store.snaps.insert_snap_info('s1', 'R1', 'L1')
+        self.assertEqual(len(store.catalog.get_history('', 'L1')), 1)
+        op = store.clones.begin_operation('CREATE_SNAP', 'array', 'L1', 's1')
+        self.assertFalse(op.resuming())
+
+    def test_catalog_after_outer_commit(self):
+        store = script_db.StateStore(self.dir, array='array', backend='journal')
+        log = store.snaps.log_
+        depths = []
+        record_created = store.catalog.record_created
+        store.catalog.record_created = lambda rows: (depths.append(log.depth) or
+                                                     record_created(rows))
+        with script_db.transaction(store.clones, store.snaps):
+            store.clones.insert_clone_info('L1', 'C1', 's1', 'g')
+            store.snaps.insert_snap_info('s1', 'R1', 'L1')
+            self.assertEqual(store.catalog.get_history('array', 'L1'), [])
+        # Written once the journal lock was released
+        self.assertEqual(depths, [0])
+        self.assertFalse(log.file_lock.locked())
+        self.assertEqual([row[2] for row in store.catalog.get_history('array', 'L1')], ['s1'])
+
+        def failing():
+            with script_db.transaction(store.clones, store.snaps):
+                store.clones.insert_clone_info('L1', 'C2', 's2', 'g')
+                store.snaps.insert_snap_info('s2', 'R2', 'L1')
+                raise RuntimeError('clone mapping failed')
+        self.assertRaises(RuntimeError, failing)
+        self.assertEqual(store.snaps.get_snap_info('s2'), ('', ''))
+        self.assertEqual([row[2] for row in store.catalog.get_history('array', 'L1')], ['s1'])
+
+    def test_sync_without_later_commit(self):
+        interval = journal_store.FSYNC_INTERVAL
+        journal_store.FSYNC_INTERVAL = 0.5
+        try:
+            sdb, rdb = self.reopen()
+            sdb.insert_clone_info('L1', 'C1', 's1', 'g')
+            self.assertEqual(sdb.log_.unsynced, 1)
+            deadline = time.time() + 10
+            while sdb.log_.unsynced and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(sdb.log_.unsynced, 0)
+        finally:
+            journal_store.FSYNC_INTERVAL = interval
+
+if __name__ == '__main__':
+    unittest.main()
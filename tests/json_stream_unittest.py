@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import json_stream
+
+
+def chunked(text, size):
+    data = text.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestJsonStream(unittest.TestCase):
+
+    def test_members_across_chunks(self):
+        members = [{'name': u'vol\u00e9%d' % i, 'wwn': '60002AC%04d' % i,
+                    'sizeMiB': 1024 * i, 'policies': {'staleSS': True}, 'ids': [i, -1.5e3]}
+                   for i in range(20)]
+        doc = json.dumps({'total': 20, 'links': [{'a': ']'}], 'members': members,
+                          'after': None}, ensure_ascii=False)
+        # Every split point, including inside numbers, strings and UTF-8 sequences
+        for size in (1, 2, 3, 7, 64, len(doc)):
+            self.assertEqual(list(json_stream.iter_items(chunked(doc, size), 'members')),
+                             members)
+        self.assertEqual(list(json_stream.iter_items(chunked(' [1, 22, 333] ', 1))),
+                         [1, 22, 333])
+        self.assertEqual(list(json_stream.iter_items([doc], 'missing')), [])
+        self.assertEqual(list(json_stream.iter_items(['{"members": []}'], 'members')), [])
+        self.assertEqual(list(json_stream.iter_items(['{"members": null}'], 'members')), [])
+        self.assertRaises(ValueError, list,
+                          json_stream.iter_items(['{"members": [{"a": 1}, {"a"'], 'members'))
+
+    def test_find_item_stops_reading(self):
+        doc = json.dumps({'members': [{'wwn': 'W%d' % i} for i in range(1000)]})
+        read = []
+
+        def chunks():
+            for chunk in chunked(doc, 100):
+                read.append(chunk)
+                yield chunk
+
+        item = json_stream.find_item(json_stream.iter_items(chunks(), 'members'),
+                                     lambda volume: volume['wwn'] == 'W10')
+        self.assertEqual(item, {'wwn': 'W10'})
+        self.assertTrue(len(read) < 5)
+        self.assertIsNone(json_stream.find_item(json_stream.iter_items([doc], 'members'),
+                                                lambda volume: False))
+
+    def test_response_size(self):
+        doc = json.dumps({'members': [{'wwn': 'W%d' % i} for i in range(1000)]})
+
+        class Response(object):
+            closed = False
+
+            def iter_content(self, size):
+                return iter(chunked(doc, 100))
+
+            def close(self):
+                self.closed = True
+
+        sizes = []
+        response = Response()
+        items = list(json_stream.iter_response(response, 'members', sizes.append))
+        self.assertEqual(len(items), 1000)
+        self.assertTrue(response.closed)
+        self.assertEqual(sizes, [len(doc)])
+        # Only the bytes read up to the match are counted
+        json_stream.find_item(json_stream.iter_response(Response(), 'members', sizes.append),
+                              lambda volume: volume['wwn'] == 'W10')
+        self.assertTrue(0 < sizes[1] < 500)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import lazy
+
+
+class TestLazy(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (lazy._profiling, list(lazy._timings))
+        del lazy._timings[:]
+
+    def tearDown(self):
+        lazy._profiling, lazy._timings[:] = self.saved
+
+    def test_record_only_when_profiling(self):
+        lazy._profiling = False
+        lazy.lazy_import('json').dumps(1)
+        lazy.record('open', 'db', 0.1)
+        self.assertEqual(lazy.timings(), [])
+        lazy._profiling = True
+        lazy.record('open', 'db', 0.1)
+        self.assertEqual(lazy.timings(), [('open', 'db', 0.1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import dispatch
+from src import driver_args
+from src import filelock
+from src import lun_locks
+
+CREATE = ['--array', 'eva', '--serial', 'abc', '--operation', 'CREATE_SNAP',
+          '--access-group', 'proxy']
+REMOVE = ['--array', 'eva', '--serial', 'ABC', '--operation', 'REMOVE_SNAP']
+OTHER_LUN = ['--array', 'eva', '--serial', 'def', '--operation', 'CREATE_SNAP']
+HELLO = ['--array', 'eva', '--serial', 'abc', '--operation', 'HELLO']
+
+
+class TestLunLocks(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        lun_locks.LOCK_DIR = self.dir
+        self.log = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def hold(self, argv, name):
+        with lun_locks.operation_locks('hpeva', argv):
+            self.log.append(name + '+')
+            time.sleep(0.2)
+            self.log.append(name + '-')
+
+    def test_lock_paths(self):
+        self.assertEqual(len(lun_locks.get_lock_paths('hpeva', CREATE)), 2)
+        self.assertEqual(lun_locks.get_lock_paths('hpeva', CREATE)[0],
+                         lun_locks.get_lock_paths('hpeva', REMOVE)[0])
+        self.assertEqual(lun_locks.get_lock_paths('hpeva', HELLO), [])
+
+    def test_option_forms(self):
+        # optparse also takes --option=value, both forms lock the same LUN
+        joined = ['--array=eva', '--serial=ABC', '--operation=REMOVE_SNAP']
+        self.assertEqual(lun_locks.get_lock_paths('hpeva', joined),
+                         lun_locks.get_lock_paths('hpeva', REMOVE))
+        self.assertEqual(dispatch.request_key('hpeva', joined),
+                         dispatch.request_key('hpeva', REMOVE))
+        self.assertNotEqual(dispatch.request_key('hpeva', joined),
+                            dispatch.request_key('hpeva', joined[:1] + ['--serial=def'] + joined[2:]))
+        self.assertEqual(dispatch.strip_model_args(['--array-model=hpeva'] + REMOVE), REMOVE)
+        self.assertEqual(driver_args.get_option(['--serial', 'a', '--serial=b'], '--serial'), 'b')
+        self.assertIsNone(driver_args.get_option(['--serial'], '--serial'))
+
+    def test_same_lun_serialized(self):
+        threads = []
+        for argv, name in ((CREATE, 'a'), (REMOVE, 'b'), (OTHER_LUN, 'c')):
+            threads.append(threading.Thread(target=self.hold, args=(argv, name)))
+            threads[-1].start()
+            time.sleep(0.05)
+        for t in threads:
+            t.join()
+        # b waits for a, c runs next to a
+        self.assertLess(self.log.index('a-'), self.log.index('b+'))
+        self.assertLess(self.log.index('c+'), self.log.index('a-'))
+
+    def test_timeout(self):
+        with lun_locks.operation_locks('hpeva', CREATE):
+            with self.assertRaises(filelock.LockTimeout):
+                with lun_locks.operation_locks('hpeva', REMOVE, timeout=0.2):
+                    pass
+
+if __name__ == '__main__':
+    unittest.main()
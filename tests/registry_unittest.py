@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import registry
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_defaults(self):
+        info = registry.get_driver('freenas')
+        self.assertEqual(info.model, 'freenas')
+        self.assertTrue(info.proxy_backup)
+        for name in ('in_process', 'interpreter', 'max_concurrency', 'session_reuse'):
+            self.assertEqual(getattr(info, name), registry.DEFAULT_CAPABILITIES[name])
+        self.assertEqual(info.get_interpreter(), sys.executable)
+        self.assertRaises(AttributeError, getattr, info, 'no_such_capability')
+        self.assertIs(registry.get_driver('freenas'), info)
+
+    def test_unknown_models(self):
+        for model in ('nosuchmodel', '', None, '..', 'hpeva/../hprmc', 'src.libs'):
+            self.assertIsNone(registry.get_driver(model))
+        self.assertEqual(registry.get_capability('nosuchmodel', 'max_concurrency'),
+                         registry.DEFAULT_CAPABILITIES['max_concurrency'])
+        # vadp holds proxy backup scripts, not a driver
+        self.assertNotIn('vadp', [info.model for info in registry.list_drivers()])
+
+    def test_python2_driver(self):
+        info = registry.get_driver('hp3par_v1')
+        self.assertEqual(info.interpreter, 'python2')
+        self.assertFalse(info.in_process)
+        self.assertEqual(info.get_interpreter(), registry.PYTHON2_EXE)
+        self.assertFalse(registry.get_capability('hp3par_v1', 'in_process'))
+        self.assertTrue(registry.get_capability('hpmsa_v1', 'session_reuse'))
+
+
+if __name__ == '__main__':
+    unittest.main()
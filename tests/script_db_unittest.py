@@ -0,0 +1,307 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import script_db
+
+
+class TestScriptDB(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        script_db.close_all()
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_migrate_legacy_tables(self):
+        conn = sqlite3.connect(self.path('script_db'))
+        conn.execute('CREATE TABLE clone_info (lun text, clone text, '
+                     'snap_name text, access_group text)')
+        conn.execute("INSERT INTO clone_info VALUES ('A', 'c1', 's1', 'g')")
+        conn.execute("INSERT INTO clone_info VALUES ('A', 'c1', 's2', 'g')")
+        conn.execute("INSERT INTO clone_info VALUES ('B', 'c2', 's3', 'g')")
+        conn.commit()
+        conn.close()
+        conn = sqlite3.connect(self.path('cred_db'))
+        conn.execute('CREATE TABLE pwd (host text, user text, pass text)')
+        conn.execute("INSERT INTO pwd VALUES ('array', 'old', 'x')")
+        conn.execute("INSERT INTO pwd VALUES ('array', 'new', 'y')")
+        conn.commit()
+        conn.close()
+
+        sdb = script_db.ScriptDB(self.path('script_db'))
+        self.assertEqual(sdb.get_clone_info('A'), ('c1', 's1', 'g'))
+        self.assertEqual(sdb.get_clone_info('B'), ('c2', 's3', 'g'))
+        self.assertEqual(sdb.get_schema_version(), script_db.ScriptDB.SCHEMA_VERSION)
+        cdb = script_db.CredDB(self.path('cred_db'))
+        self.assertEqual(cdb.get_enc_info('array'), ('new', 'y'))
+        self.assertEqual(len(cdb.get_all_enc_info()), 1)
+
+    def test_state_store_imports_legacy_layouts(self):
+        os.makedirs(self.path('var'))
+        for name, sql in ((os.path.join('var', 'cred.db'),
+                           "INSERT INTO pwd VALUES ('array', 'old', 'x')"),
+                          ('cred_db', "INSERT INTO pwd VALUES ('array', 'new', 'y')")):
+            conn = sqlite3.connect(self.path(name))
+            conn.execute('CREATE TABLE pwd (host text, user text, pass text)')
+            conn.execute(sql)
+            conn.commit()
+            conn.close()
+            os.utime(self.path(name), (0, 0) if name == 'cred_db' else None)
+        conn = sqlite3.connect(self.path('replay_db'))
+        conn.execute('CREATE TABLE snap_to_replay_info (snap_name text, replay text)')
+        conn.execute("INSERT INTO snap_to_replay_info VALUES ('snap', 'r1')")
+        conn.commit()
+        conn.close()
+
+        store = script_db.StateStore(self.dir)
+        # var\cred.db is newer, its credentials win
+        self.assertEqual(store.creds.get_enc_info('array'), ('old', 'x'))
+        self.assertEqual(store.snaps.get_snap_info('snap'), ('snap', 'r1'))
+        store.creds.insert_enc_info('array', 'admin', 'z')
+        script_db.close_all()
+        # Legacy files are imported only once
+        store = script_db.StateStore(self.dir)
+        self.assertEqual(store.creds.get_enc_info('array'), ('admin', 'z'))
+        with store.transaction():
+            store.clones.insert_clone_info('A', 'c1', 'snap', 'g')
+            store.snaps.insert_snap_info('snap2', 'r2')
+        self.assertEqual(store.snaps.get_snap_info('snap2'), ('snap2', 'r2'))
+
+    def test_upsert(self):
+        rdb = script_db.SnapToReplayDB(self.path('replay_db'))
+        rdb.setup()
+        rdb.insert_snap_info('snap', 1)
+        rdb.insert_snap_info('snap', 2, 'L1')
+        self.assertEqual(rdb.get_snap_info('snap'), ('snap', '1'))
+        self.assertEqual(rdb.get_many(serial='L1'), [('snap', '1')])
+        sdb = script_db.ScriptDB(self.path('script_db'))
+        sdb.setup()
+        sdb.insert_clone_info('A', 'c1', 's1', 'g1')
+        sdb.insert_clone_info('A', 'c1', 's2', 'g2')
+        self.assertEqual(sdb.get_clone_info('A'), ('c1', 's2', 'g2'))
+        sdb.delete_clone_info('A')
+        self.assertEqual(sdb.get_clone_info('A'), ('', '', ''))
+
+    def test_upgrade_from_version_1(self):
+        conn = sqlite3.connect(self.path('replay_db'))
+        conn.execute('CREATE TABLE snap_to_replay_info (snap_name text PRIMARY KEY, replay text)')
+        conn.execute('CREATE TABLE schema_version (name text PRIMARY KEY, version integer)')
+        conn.execute("INSERT INTO schema_version VALUES ('snap_to_replay_info', 1)")
+        conn.execute("INSERT INTO snap_to_replay_info VALUES ('snap', 'r1')")
+        conn.commit()
+        conn.close()
+        rdb = script_db.SnapToReplayDB(self.path('replay_db'))
+        self.assertEqual(rdb.get_schema_version(), 2)
+        self.assertEqual(rdb.get_many(older_than=time.time() + 10), [('snap', 'r1')])
+
+    def test_bulk(self):
+        store = script_db.StateStore(self.dir)
+        store.clones.insert_many([('L%d' % i, 'C%d' % i, 's%d' % i, 'g%d' % (i % 2))
+                                  for i in range(1200)])
+        self.assertEqual(len(store.clones.get_many(access_group='g1')), 600)
+        self.assertEqual(len(store.clones.get_many(luns=['L%d' % i for i in range(1000)],
+                                                   access_group='g0')), 500)
+        self.assertEqual(store.clones.delete_many(luns=['L1', 'L2', 'L3']), 3)
+        self.assertEqual(store.clones.get_many(luns=[]), [])
+        self.assertRaises(ValueError, store.clones.delete_many)
+
+        store.snaps.insert_many([('old%d' % i, i, 'L1') for i in range(10)])
+        cutoff = time.time() + 1
+        store.snaps.insert_many([('new', 'r', 'L2')])
+        self.assertEqual(len(store.snaps.get_many(serial='L1')), 10)
+        store.snaps.insert_snap_info('old0', 'r0')
+        self.assertEqual(store.snaps.get_many(snap_names=['old0']), [('old0', '0')])
+        self.assertEqual(len(store.snaps.get_many(serial='L1')), 10)
+        self.assertEqual(store.snaps.delete_many(serial='L1', older_than=cutoff), 10)
+        self.assertEqual(store.snaps.get_many(), [('new', 'r')])
+
+    def test_cred_cache(self):
+        cdb = script_db.StateStore(self.dir).creds
+        cdb.insert_enc_info('array', 'u1', 'p1')
+        self.assertEqual(cdb.get_enc_info('array'), ('u1', 'p1'))
+        reads = []
+        fetchone = cdb.fetchone
+        cdb.fetchone = lambda *args: reads.append(args[0]) or fetchone(*args)
+        pwd_reads = lambda: [sql for sql in reads if 'FROM pwd ' in sql]
+        self.assertEqual(cdb.get_enc_info('array'), ('u1', 'p1'))
+        self.assertEqual(reads, [])
+        # configure.py changing the password from another process
+        conn = sqlite3.connect(cdb.shared_.path)
+        conn.execute("UPDATE pwd SET pass='p2' WHERE host='array'")
+        conn.commit()
+        conn.close()
+        self.assertEqual(cdb.get_enc_info('array'), ('u1', 'p2'))
+        self.assertEqual(len(pwd_reads()), 1)
+
+    def test_cred_cache_kept_on_other_writes(self):
+        store = script_db.StateStore(self.dir, array='array')
+        cdb = store.creds
+        cdb.insert_enc_info('array', 'u1', 'p1')
+        self.assertEqual(cdb.get_enc_info('array'), ('u1', 'p1'))
+        reads = []
+        fetchone = cdb.fetchone
+        cdb.fetchone = lambda *args: reads.append(args[0]) or fetchone(*args)
+        # Writes of the same request to the other tables of the store
+        store.hello.put('model', 'array', 'L1', (0, 'ok', ''), 30)
+        store.inventory.put('array', 'volume', 'L1', {'name': 'vol1'})
+        store.clones.begin_operation('CREATE_SNAP', 'array', 'L1', 's1').step(
+            'clone', lambda: 'C1')
+        store.snaps.insert_snap_info('s1', 'R1', 'L1')
+        for i in range(3):
+            self.assertEqual(cdb.get_enc_info('array'), ('u1', 'p1'))
+        self.assertEqual([sql for sql in reads if 'FROM pwd ' in sql], [])
+        # A credential change from another process is still seen
+        conn = sqlite3.connect(cdb.shared_.path)
+        conn.execute("DELETE FROM pwd WHERE host='array'")
+        conn.commit()
+        conn.close()
+        self.assertEqual(cdb.get_enc_info('array'), ('', ''))
+        cdb.setup()
+        self.assertEqual(cdb.get_version(), 3)
+
+    def test_operation_resume(self):
+        store = script_db.StateStore(self.dir)
+        calls = []
+
+        def step(name, output):
+            calls.append(name)
+            if name == 'mount':
+                raise RuntimeError('proxy host down')
+            return output
+
+        op = store.clones.begin_operation('CREATE_SNAP', 'array', 'L1', 'snap')
+        self.assertFalse(op.resuming())
+        self.assertTrue(op.step('unmount', step, 'unmount', True))
+        self.assertEqual(op.step('clone', step, 'clone', 'C1'), 'C1')
+        self.assertRaises(RuntimeError, op.step, 'mount', step, 'mount', None)
+        script_db.close_all()
+
+        # The retry skips the steps the first attempt completed
+        store = script_db.StateStore(self.dir)
+        op = store.clones.begin_operation('CREATE_SNAP', 'array', 'L1', 'snap')
+        self.assertTrue(op.resuming())
+        self.assertEqual(op.last_step(), 'clone')
+        self.assertEqual(len(store.journal.get_unfinished()), 1)
+        self.assertTrue(op.step('unmount', step, 'unmount', True))
+        self.assertEqual(op.step('clone', step, 'clone', 'C2'), 'C1')
+        self.assertEqual(calls, ['unmount', 'clone', 'mount'])
+        op.finish()
+        self.assertEqual(store.journal.get_unfinished(), [])
+
+    def test_upsert_fallback(self):
+        script_db.HAS_UPSERT = False
+        try:
+            cdb = script_db.CredDB(self.path('cred_db'))
+            cdb.insert_enc_info('array', 'u1', 'p1')
+            cdb.insert_enc_info('array', 'u2', 'p2')
+            self.assertEqual(cdb.get_all_enc_info(), [('array', 'u2', 'p2')])
+            rdb = script_db.SnapToReplayDB(self.path('replay_db'))
+            rdb.insert_snap_info('snap', 'A', 'L1')
+            rdb.insert_snap_info('snap', 'B')
+            self.assertEqual(rdb.get_snap_info('snap'), ('snap', 'A'))
+            self.assertEqual(rdb.get_many(serial='L1'), [('snap', 'A')])
+            # The catalog keeps the row, its issue time and creation time
+            store = script_db.StateStore(self.dir, array='array', issue_time='1000')
+            store.catalog.record_created([('L1', 's1', 'R1')])
+            before = store.catalog.fetchall("SELECT rowid, * FROM %s" % store.catalog.TABLE)
+            store.catalog.issue_time = None
+            store.catalog.record_created([('L1', 's1', 'R2'), ('L1', 's2', 'R3')])
+            after = store.catalog.fetchall("SELECT rowid, * FROM %s ORDER BY rowid"
+                                           % store.catalog.TABLE)
+            self.assertEqual(len(after), 2)
+            self.assertEqual(after[0], before[0][:5] + ('R2',) + before[0][6:])
+        finally:
+            script_db.HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+    def test_snap_catalog(self):
+        store = script_db.StateStore(self.dir, array='array', issue_time='1000')
+        store.snaps.insert_snap_info('s1', 'R1', 'L1')
+        store.snaps.insert_many([('s2', 'R2', 'L1'), ('s3', 'R3', 'L2')])
+        store.snaps.delete_snap_info('s1')
+        store.snaps.delete_many(serial='L2')
+        history = store.catalog.get_history('array', 'L1')
+        self.assertEqual([row[2:5] for row in history],
+                         [('s1', 'R1', 1000.0), ('s2', 'R2', 1000.0)])
+        self.assertIsNotNone(history[0][6])
+        self.assertIsNone(history[1][6])
+        self.assertEqual(len(store.catalog.get_history('array', 'L1', include_removed=False)), 1)
+        self.assertEqual(len(store.catalog.get_history('array', 'L1', since=time.time() + 1)), 0)
+
+        # Only removed rows older than the retention are pruned
+        self.assertEqual(store.prune(keep_days=1), (0, 0))
+        self.assertEqual(store.catalog.prune(time.time() + 1, batch=1), 2)
+        self.assertEqual([row[2] for row in store.catalog.get_history('array', 'L1')], ['s2'])
+        self.assertEqual(store.creds.fetchone('PRAGMA auto_vacuum')[0], 2)
+
+    def test_snapshot_keeps_first_replay(self):
+        # HP MSA create_snap_clone recorded the snapshot, then its parent volume
+        store = script_db.StateStore(self.dir, array='array')
+        store.snaps.insert_snap_info('s1', 'A', 'L1')
+        store.snaps.insert_snap_info('s1', 'B', 'L1')
+        self.assertEqual(store.snaps.get_snap_info('s1'), ('s1', 'A'))
+        self.assertEqual([row[2:4] for row in store.catalog.get_history('array', 'L1')],
+                         [('s1', 'A')])
+        store.snaps.delete_snap_info('s1')
+        store.snaps.insert_snap_info('s1', 'B', 'L1')
+        self.assertEqual(store.snaps.get_snap_info('s1'), ('s1', 'B'))
+
+    def test_inventory_cache(self):
+        idb = script_db.StateStore(self.dir).inventory
+        idb.put_many('array', 'volume', {'wwn1': 'vol1', 'wwn2': 'vol2'})
+        self.assertEqual(idb.get('array', 'volume', 'wwn1'), 'vol1')
+        self.assertIsNone(idb.get('array', 'volume', 'WWN1'))
+        self.assertIsNone(idb.get('other', 'volume', 'wwn1'))
+        idb.put('array', 'volume', 'wwn3', 'vol3')
+        self.assertEqual(idb.invalidate('array'), 3)
+        self.assertIsNone(idb.get('array', 'volume', 'wwn1'))
+
+        # Expired records miss, the least recently used go over the limit
+        idb.put_many('array', 'volume', {'old': 'vol0'}, ttl=-1)
+        self.assertIsNone(idb.get('array', 'volume', 'old'))
+        max_entries = script_db.INVENTORY_MAX_ENTRIES
+        script_db.INVENTORY_MAX_ENTRIES = 2
+        try:
+            idb.execute("DELETE FROM inventory")
+            idb.put('array', 'volume', 'wwn1', 'vol1')
+            idb.execute("UPDATE inventory SET used=used-10")
+            idb.put('array', 'volume', 'wwn2', 'vol2')
+            self.assertEqual(idb.get('array', 'volume', 'wwn1'), 'vol1')
+            idb.put('array', 'volume', 'wwn3', 'vol3')
+            self.assertIsNone(idb.get('array', 'volume', 'wwn2'))
+            self.assertEqual(idb.get('array', 'volume', 'wwn1'), 'vol1')
+        finally:
+            script_db.INVENTORY_MAX_ENTRIES = max_entries
+
+    def test_inventory_sync(self):
+        idb = script_db.StateStore(self.dir).inventory
+        self.assertEqual(idb.get_sync('array', 'volume'), (None, None, False))
+        self.assertEqual(idb.sync('array', 'volume', {'w1': 'v1', 'w2': 'v2'}, mark=10), (2, 0))
+        # Only what changed is written, objects missing from a full listing go
+        self.assertEqual(idb.sync('array', 'volume', {'w1': 'v1', 'w3': 'v3'}, mark=20), (1, 1))
+        self.assertIsNone(idb.get('array', 'volume', 'w2'))
+        self.assertEqual(idb.get_sync('array', 'volume')[0], '20')
+        self.assertEqual(idb.sync('array', 'volume', {'w4': 'v4'}, complete=False,
+                                  removed=['w3']), (1, 1))
+        self.assertEqual(idb.get_sync('array', 'volume')[0], '20')
+        self.assertEqual(idb.drop('array', 'volume', 'v4'), 1)
+
+        # Invalidated listings keep their fingerprints for the next merge
+        idb.invalidate('array')
+        self.assertFalse(idb.get_sync('array', 'volume')[2])
+        self.assertIsNone(idb.get('array', 'volume', 'w1'))
+        self.assertEqual(idb.sync('array', 'volume', {'w1': 'v1'}), (0, 0))
+        self.assertEqual(idb.get('array', 'volume', 'w1'), 'v1')
+        self.assertTrue(idb.get_sync('array', 'volume')[2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
+from src import worker_pool
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_worker_index(self):
+        pool = worker_pool.WorkerPool(4, {'eva1': 2, 'eva2': 9})
+        self.assertEqual(pool.worker_index('eva1'), 2)
+        self.assertEqual(pool.worker_index('eva2'), 1)
+        # Stable across pools and restarts
+        self.assertEqual(pool.worker_index('10.1.1.1'),
+                         worker_pool.WorkerPool(4).worker_index('10.1.1.1'))
+        self.assertTrue(0 <= pool.worker_index(None) < 4)
+        self.assertEqual(worker_pool.WorkerPool(0).size, 1)
+
+    def test_parse_affinity(self):
+        self.assertEqual(worker_pool.parse_affinity(None), {})
+        self.assertEqual(worker_pool.parse_affinity(['eva1=1', 'fe80::1=2']),
+                         {'eva1': 1, 'fe80::1': 2})
+        self.assertRaises(ValueError, worker_pool.parse_affinity, ['eva1'])
+        self.assertRaises(ValueError, worker_pool.parse_affinity, ['eva1=x'])
+
+    def test_restart(self):
+        worker = worker_pool.Worker(0)
+        worker.start()
+        try:
+            # No such driver, the worker answers with the child interpreter's error
+            first = worker.call('nosuchmodel', ['--verbose'])
+            self.assertNotEqual(first[0], 0)
+            pid = worker.process.pid
+            worker.process.terminate()
+            worker.process.join(5)
+            self.assertEqual(worker.call('nosuchmodel', ['--verbose']), first)
+            self.assertNotEqual(worker.process.pid, pid)
+            self.assertEqual(worker.requests, 2)
+        finally:
+            worker.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()